@@ -0,0 +1,315 @@
+import logging
+import time
+from functools import cached_property
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+
+from .models import Aula, Persona
+
+logger = logging.getLogger(__name__)
+
+PROFESORES_GROUP = "ProfesoresFP"
+
+# --- Caché del ámbito de acceso (entre peticiones) ---
+ACCESS_CACHE_ALIAS = "default"
+ACCESS_VERSION_KEY_FORMAT = "access_scope_version:{}"
+ACCESS_DATA_KEY_FORMAT = "access_scope:{}:{}"
+ACCESS_CACHE_TIMEOUT_SECONDS = 60 * 60
+ACCESS_LOCAL_MAX_ENTRIES = 1024
+
+# L1 por proceso: {user_id: (version, data)}. Solo se usa si la versión
+# guardada en Redis coincide, así que una invalidación en otro proceso
+# se ve en la siguiente petición.
+_local_access = {}
+
+
+def _access_cache():
+    return caches[ACCESS_CACHE_ALIAS]
+
+
+def _load_access_data(user):
+    """Lee de la BD lo que necesitan las comprobaciones de acceso del usuario."""
+    persona = Persona.objects.filter(user=user).values("pk", "last_aula_id").first()
+    if persona and not user.is_staff:
+        aula_ids = frozenset(
+            Persona.aulas_access.through.objects.filter(
+                persona_id=persona["pk"]
+            ).values_list("aula_id", flat=True)
+        )
+    else:
+        aula_ids = frozenset()
+    return {
+        "has_persona": persona is not None,
+        "last_aula_id": persona["last_aula_id"] if persona else None,
+        "aula_ids": aula_ids,  # vacío para staff: tienen acceso a todas
+        "is_staff": user.is_staff,
+        "is_profesor": user.groups.filter(name=PROFESORES_GROUP).exists(),
+    }
+
+
+async def _aload_access_data(user):
+    """Igual que _load_access_data, con el ORM asíncrono."""
+    persona = await (
+        Persona.objects.filter(user=user).values("pk", "last_aula_id").afirst()
+    )
+    if persona and not user.is_staff:
+        aula_ids = frozenset(
+            [
+                aula_id
+                async for aula_id in Persona.aulas_access.through.objects.filter(
+                    persona_id=persona["pk"]
+                ).values_list("aula_id", flat=True)
+            ]
+        )
+    else:
+        aula_ids = frozenset()
+    return {
+        "has_persona": persona is not None,
+        "last_aula_id": persona["last_aula_id"] if persona else None,
+        "aula_ids": aula_ids,
+        "is_staff": user.is_staff,
+        "is_profesor": await user.groups.filter(name=PROFESORES_GROUP).aexists(),
+    }
+
+
+def _remember_local(user_id, version, data):
+    if len(_local_access) >= ACCESS_LOCAL_MAX_ENTRIES:
+        _local_access.clear()
+    _local_access[user_id] = (version, data)
+
+
+def get_user_access(user):
+    """
+    Devuelve el ámbito de acceso cacheado del usuario (dict).
+
+    Se busca primero en el L1 del proceso y en Redis, validado con la versión
+    por usuario que invalidan las señales; si Redis no está disponible se lee
+    directamente de la BD. El resultado se memoriza en el propio objeto user,
+    que en producción vive lo que dura la petición.
+    """
+    data = getattr(user, "_access_data", None)
+    if data is not None:
+        return data
+
+    cache = _access_cache()
+    try:
+        version_key = ACCESS_VERSION_KEY_FORMAT.format(user.pk)
+        version = cache.get(version_key)
+        if version is None:
+            version = time.time_ns()
+            cache.set(version_key, version, timeout=None)
+
+        local = _local_access.get(user.pk)
+        if local is not None and local[0] == version:
+            data = local[1]
+        else:
+            data_key = ACCESS_DATA_KEY_FORMAT.format(user.pk, version)
+            data = cache.get(data_key)
+            if data is None:
+                data = _load_access_data(user)
+                cache.set(data_key, data, timeout=ACCESS_CACHE_TIMEOUT_SECONDS)
+            _remember_local(user.pk, version, data)
+    except Exception as e:
+        logger.warning(f"Caché de acceso no disponible, se usa la BD: {e}")
+        data = _load_access_data(user)
+
+    user._access_data = data
+    return data
+
+
+async def aget_user_access(user):
+    """Versión asíncrona de get_user_access (mismas cachés y memoización)."""
+    data = getattr(user, "_access_data", None)
+    if data is not None:
+        return data
+
+    cache = _access_cache()
+    try:
+        version_key = ACCESS_VERSION_KEY_FORMAT.format(user.pk)
+        version = await cache.aget(version_key)
+        if version is None:
+            version = time.time_ns()
+            await cache.aset(version_key, version, timeout=None)
+
+        local = _local_access.get(user.pk)
+        if local is not None and local[0] == version:
+            data = local[1]
+        else:
+            data_key = ACCESS_DATA_KEY_FORMAT.format(user.pk, version)
+            data = await cache.aget(data_key)
+            if data is None:
+                data = await _aload_access_data(user)
+                await cache.aset(data_key, data, timeout=ACCESS_CACHE_TIMEOUT_SECONDS)
+            _remember_local(user.pk, version, data)
+    except Exception as e:
+        logger.warning(f"Caché de acceso no disponible, se usa la BD: {e}")
+        data = await _aload_access_data(user)
+
+    user._access_data = data
+    return data
+
+
+def invalidate_user_access(user_ids):
+    """Invalida el ámbito de acceso cacheado de los usuarios indicados."""
+    user_ids = [uid for uid in user_ids if uid is not None]
+    if not user_ids:
+        return
+    version = time.time_ns()
+    for uid in user_ids:
+        _local_access.pop(uid, None)
+    try:
+        _access_cache().set_many(
+            {ACCESS_VERSION_KEY_FORMAT.format(uid): version for uid in user_ids},
+            timeout=None,
+        )
+    except Exception as e:
+        logger.warning(f"No se pudo invalidar la caché de acceso: {e}")
+
+
+class AccessScope:
+    """
+    Ámbito de acceso de un usuario durante una petición.
+
+    Resuelve una sola vez la Persona, las aulas accesibles y el aula actual,
+    de modo que las vistas, el context processor y los decoradores comparten
+    el resultado en lugar de repetir las consultas. Las comprobaciones de
+    permisos usan el ámbito cacheado entre peticiones y no consultan la BD.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.user = getattr(request, "user", None)
+
+    @property
+    def is_authenticated(self):
+        return bool(self.user and self.user.is_authenticated)
+
+    @cached_property
+    def access(self):
+        if not self.is_authenticated:
+            return None
+        return get_user_access(self.user)
+
+    @property
+    def is_staff(self):
+        return bool(self.access and self.access["is_staff"])
+
+    @property
+    def is_profesor(self):
+        return bool(self.access and self.access["is_profesor"])
+
+    @property
+    def has_persona(self):
+        return bool(self.access and self.access["has_persona"])
+
+    @cached_property
+    def persona(self):
+        if not self.has_persona:
+            return None
+        try:
+            return self.user.persona
+        except Persona.DoesNotExist:
+            return None
+
+    def _aulas_queryset(self):
+        if self.is_staff:
+            return Aula.objects.order_by("nombre")
+        if self.has_persona:
+            return Aula.objects.filter(pk__in=self.access["aula_ids"]).order_by(
+                "nombre"
+            )
+        return Aula.objects.none()
+
+    @cached_property
+    def aulas(self):
+        """Aulas accesibles ordenadas por nombre (queryset ya evaluado)."""
+        qs = self._aulas_queryset()
+        len(qs)  # evalúa una vez y deja el resultado en la caché del queryset
+        return qs
+
+    @cached_property
+    def _aulas_by_id(self):
+        return {aula.pk: aula for aula in self.aulas}
+
+    @cached_property
+    def aula_ids(self) -> frozenset:
+        if self.is_staff:
+            return frozenset(self._aulas_by_id)
+        return self.access["aula_ids"] if self.has_persona else frozenset()
+
+    def has_aula_access(self, aula) -> bool:
+        """Igual que Persona.has_aula_access pero sin consultas; admite Aula o id."""
+        if not self.has_persona:
+            return False
+        if self.is_staff:
+            return True
+        aula_id = getattr(aula, "pk", aula)
+        return aula_id in self.access["aula_ids"]
+
+    def _accessible_aula(self, aula_id):
+        try:
+            aula_id = int(aula_id)
+        except (TypeError, ValueError):
+            return None
+        if not self.has_aula_access(aula_id):
+            return None
+        return self._aulas_by_id.get(aula_id)
+
+    @cached_property
+    def current_aula(self):
+        """Prioridad: GET ?aula -> sesión -> Persona.last_aula del usuario (con control de acceso)."""
+        aula_id = self.request.GET.get("aula")
+        if aula_id:
+            return self._accessible_aula(aula_id)
+        # session
+        sid = self.request.session.get("current_aula_id")
+        if sid:
+            aula = self._accessible_aula(sid)
+            if aula is not None or not self.has_persona:
+                return aula
+            # Si el aula existe pero no es accesible no hay aula actual; si ya
+            # no existe se pasa a la preferencia del usuario.
+            if not self.is_staff and Aula.objects.filter(pk=sid).exists():
+                return None
+        # user preference
+        if self.has_persona:
+            last_aula_id = self.access["last_aula_id"]
+            if last_aula_id is None:
+                return None
+            aula = self._aulas_by_id.get(last_aula_id)
+            if aula is None:
+                aula = Aula.objects.filter(pk=last_aula_id).first()
+            return aula
+        return None
+
+    async def aprefetch(self):
+        """
+        Para vistas async: resuelve usuario, sesión, ámbito cacheado, aulas y
+        aula actual con el ORM y la caché asíncronos. Después las propiedades
+        se pueden usar desde el bucle de eventos sin E/S bloqueante.
+        """
+        if "current_aula" in self.__dict__:
+            return self
+        self.user = await self.request.auser()
+        # request.user es perezoso y síncrono: se sustituye por el ya resuelto
+        self.request.user = self.user
+        if self.is_authenticated:
+            await aget_user_access(self.user)
+            await self.request.session.aget("current_aula_id")  # carga la sesión
+            aulas = self._aulas_queryset()
+            async for _ in aulas:  # llena la caché del queryset
+                pass
+            self.__dict__["aulas"] = aulas
+        # Solo los casos raros (aula de la sesión ya borrada...) consultan aquí
+        await sync_to_async(lambda: self.current_aula)()
+        return self
+
+
+def get_access_scope(request) -> AccessScope:
+    """Devuelve el AccessScope de la petición, creándolo si el middleware no lo hizo."""
+    scope = getattr(request, "access_scope", None)
+    if scope is None:
+        scope = AccessScope(request)
+        request.access_scope = scope
+    return scope
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Aula, Producto, Ubicacion, Prestamo, Persona
+from .models import Aula, Producto, Ubicacion, Prestamo, Persona, Recuento
 
 
 @admin.register(Aula)
@@ -47,3 +47,9 @@ class ProductoAdmin(admin.ModelAdmin):
 class PrestamoAdmin(admin.ModelAdmin):
     list_display = ("producto", "usuario", "tomado_en", "devuelto_en")
     list_filter = ("usuario", "producto")
+
+
+@admin.register(Recuento)
+class RecuentoAdmin(admin.ModelAdmin):
+    list_display = ("aula", "iniciado_por", "iniciado_en", "finalizado_en")
+    list_filter = ("aula",)
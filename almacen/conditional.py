@@ -0,0 +1,194 @@
+"""
+GET condicional (ETag / Last-Modified) para las páginas de consulta.
+
+Cada aula tiene una versión en caché que cambia al escribir un Producto, su
+Ubicacion o un Prestamo de esa aula (ver signals.py). El validador de una
+página combina esas versiones con el ámbito de acceso del usuario, su sesión
+y la URL, así que dos usuarios nunca comparten ETag. Si el navegador ya tiene
+la versión actual se responde 304 sin consultar las tablas de productos ni
+renderizar plantillas.
+"""
+
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from .access import get_access_scope
+from .fragments import PRODUCTO_VERSION_KEY_FORMAT
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_ALIAS = "default"
+AULA_VERSION_KEY_FORMAT = "aula_version:{}"
+# Alta, cambio de nombre o borrado de aulas (aparecen en el menú de todas las páginas)
+CATALOGO_VERSION_KEY = "aula_version:catalogo"
+# El panel de un usuario staff cuenta los productos de todas las aulas
+DASHBOARD_VIEWS = ("dashboard", "dashboard_counters")
+
+
+def _version_cache():
+    return caches[VERSION_CACHE_ALIAS]
+
+
+def bump_aula_versions(aula_ids, catalogo=False):
+    """Cambia la versión de las aulas indicadas (y la del catálogo de aulas)."""
+    keys = [AULA_VERSION_KEY_FORMAT.format(pk) for pk in aula_ids if pk is not None]
+    if catalogo:
+        keys.append(CATALOGO_VERSION_KEY)
+    if not keys:
+        return
+    version = time.time_ns()
+    try:
+        _version_cache().set_many({key: version for key in keys}, timeout=None)
+    except Exception as e:
+        logger.warning(f"No se pudo invalidar la versión de las aulas: {e}")
+
+
+def get_versions(keys):
+    """
+    Versiones actuales de las claves indicadas. Las que no existen (caché
+    nueva o vaciada) se inicializan con la hora actual, nunca con un valor
+    que un navegador pueda tener ya guardado.
+    """
+    cache = _version_cache()
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return versions
+
+
+def _page_versions(request, view_name, args, kwargs):
+    """Claves de versión de las que depende cada página."""
+    scope = get_access_scope(request)
+    if view_name == "inventory_row":
+        pk = kwargs["pk"] if "pk" in kwargs else args[0]
+        return [PRODUCTO_VERSION_KEY_FORMAT.format(pk)]
+    if view_name == "prestamos_overview" or (
+        view_name in DASHBOARD_VIEWS and scope.is_staff
+    ):
+        aula_ids = scope.aula_ids
+    else:
+        current_aula = scope.current_aula
+        aula_ids = {current_aula.pk} if current_aula else scope.aula_ids
+    return [AULA_VERSION_KEY_FORMAT.format(pk) for pk in sorted(aula_ids)]
+
+
+async def aget_versions(keys):
+    """Versión asíncrona de get_versions."""
+    cache = _version_cache()
+    versions = await cache.aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            await cache.aadd(key, time.time_ns(), timeout=None)
+            versions[key] = await cache.aget(key)
+    return versions
+
+
+def _validator_keys(request, view_name, args, kwargs):
+    """Claves de versión de la petición, o None si no admite GET condicional."""
+    scope = get_access_scope(request)
+    # Los mensajes pendientes se muestran una sola vez: no se puede responder 304
+    if not scope.is_authenticated or len(get_messages(request)):
+        return None
+    keys = _page_versions(request, view_name, args, kwargs)
+    keys.append(CATALOGO_VERSION_KEY)
+    return keys
+
+
+def _build_validators(request, view_name, keys, versions):
+    """(etag, last_modified) a partir de las versiones leídas."""
+    scope = get_access_scope(request)
+    access = scope.access
+    current_aula = scope.current_aula
+    state = [
+        view_name,
+        request.get_full_path(),
+        request.headers.get("HX-Request", ""),
+        scope.user.pk,
+        # El secreto CSRF va en los formularios de la página
+        request.META.get("CSRF_COOKIE", ""),
+        access["is_staff"],
+        access["is_profesor"],
+        sorted(access["aula_ids"]),
+        current_aula.pk if current_aula else None,
+        [versions[key] for key in keys],
+    ]
+    digest = hashlib.sha256(json.dumps(state).encode()).hexdigest()[:32]
+    last_modified = datetime.fromtimestamp(
+        max(versions.values()) / 1e9, tz=timezone.utc
+    )
+    return f'W/"{digest}"', last_modified
+
+
+def _validators(request, view_name, args, kwargs):
+    """(etag, last_modified) de la petición, calculados una sola vez."""
+    cached = getattr(request, "_conditional_validators", None)
+    if cached is not None:
+        return cached
+
+    validators = (None, None)
+    keys = _validator_keys(request, view_name, args, kwargs)
+    if keys is not None:
+        try:
+            versions = get_versions(keys)
+        except Exception as e:
+            logger.warning(f"Versiones no disponibles, sin GET condicional: {e}")
+        else:
+            validators = _build_validators(request, view_name, keys, versions)
+
+    request._conditional_validators = validators
+    return validators
+
+
+async def _avalidators(request, view_name, args, kwargs):
+    """Como _validators, para vistas async: deja el resultado en la petición."""
+    await get_access_scope(request).aprefetch()
+    validators = (None, None)
+    keys = _validator_keys(request, view_name, args, kwargs)
+    if keys is not None:
+        try:
+            versions = await aget_versions(keys)
+        except Exception as e:
+            logger.warning(f"Versiones no disponibles, sin GET condicional: {e}")
+        else:
+            validators = _build_validators(request, view_name, keys, versions)
+    request._conditional_validators = validators
+
+
+def conditional_page(view_func):
+    """
+    Añade ETag y Last-Modified a una vista de consulta y responde 304 si el
+    navegador ya tiene la versión actual. El navegador debe revalidar siempre
+    (no-cache) y las cachés compartidas no guardan la respuesta (private).
+    """
+    view_name = view_func.__name__
+
+    def etag(request, *args, **kwargs):
+        return _validators(request, view_name, args, kwargs)[0]
+
+    def last_modified(request, *args, **kwargs):
+        return _validators(request, view_name, args, kwargs)[1]
+
+    wrapped = cache_control(private=True, no_cache=True)(
+        condition(etag_func=etag, last_modified_func=last_modified)(view_func)
+    )
+    if iscoroutinefunction(view_func):
+        # condition() llama a etag/last_modified de forma síncrona: en las
+        # vistas async se calculan antes, con E/S asíncrona
+        async def async_wrapped(request, *args, **kwargs):
+            await _avalidators(request, view_name, args, kwargs)
+            return await wrapped(request, *args, **kwargs)
+
+        return wraps(view_func)(async_wrapped)
+    return wraps(view_func)(wrapped)
@@ -5,9 +5,12 @@ from django.http import HttpResponseForbidden
 from django.shortcuts import redirect
 from django.urls import reverse
 
+from .access import get_user_access
+
 
 def user_in_group_profesores(user) -> bool:
-    return user.is_authenticated and user.groups.filter(name="ProfesoresFP").exists()
+    # Consulta el ámbito de acceso cacheado: sin SQL en cada petición protegida
+    return user.is_authenticated and get_user_access(user)["is_profesor"]
 
 
 def profesores_required(view_func):
@@ -0,0 +1,177 @@
+"""
+Diagnóstico bajo demanda de procesos de larga duración (mqtt_listener).
+
+- SIGUSR1 activa durante N segundos un perfilador por muestreo de las pilas
+  de todos los hilos (o lo para si ya estaba activo) y guarda las pilas en
+  formato collapsed, el de flamegraph.pl y speedscope.
+- SIGUSR2 toma una instantánea de tracemalloc y la compara con la anterior.
+  La primera señal solo activa tracemalloc y guarda la referencia.
+
+Los ficheros se escriben junto al log del proceso. El trabajo se hace en
+hilos aparte: el manejador de la señal solo los lanza.
+"""
+
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL_SECONDS = 0.005
+TRACEMALLOC_FRAMES = 10
+# Líneas de la comparación de memoria (las que más crecen)
+MEMORY_TOP_LINES = 30
+
+
+def _output_path(output_dir, prefix, suffix):
+    now = time.time()
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now))
+    stamp += f"{now % 1:.3f}"[1:]  # milisegundos: dos señales seguidas
+    return os.path.join(output_dir, f"{prefix}-{stamp}.{suffix}")
+
+
+def collapse(thread_name, frame):
+    """Pila en formato collapsed: hilo;raíz;...;hoja, sin números de línea."""
+    functions = []
+    while frame is not None:
+        code = frame.f_code
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+        functions.append(f"{module}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join([thread_name, *reversed(functions)])
+
+
+class SamplingProfiler:
+    """Muestrea las pilas de todos los hilos cada SAMPLE_INTERVAL_SECONDS."""
+
+    def __init__(self, output_dir, prefix, interval=SAMPLE_INTERVAL_SECONDS):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.interval = interval
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def toggle(self, seconds):
+        """Arranca el muestreo durante `seconds` o lo para si ya está activo."""
+        if self.running:
+            self.stop()
+        else:
+            self.start(seconds)
+
+    def start(self, seconds):
+        if self.running:
+            return
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, args=(seconds,), name="profiler", daemon=True
+        )
+        self.thread.start()
+        logger.info("Perfilador activado durante %s s", seconds)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self, seconds):
+        own = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline and not self.stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    stacks[collapse(names.get(ident, str(ident)), frame)] += 1
+            samples += 1
+        path = self.write(stacks)
+        logger.info("Perfil guardado en %s (%s muestras)", path, samples)
+
+    def write(self, stacks):
+        path = _output_path(self.output_dir, self.prefix, "folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+class MemorySnapshots:
+    """Instantáneas de tracemalloc, cada una comparada con la anterior."""
+
+    def __init__(self, output_dir, prefix, frames=TRACEMALLOC_FRAMES):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.frames = frames
+        self.previous = None
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Guarda la comparación con la instantánea anterior; devuelve la ruta."""
+        with self.lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                self.previous = None
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                    tracemalloc.Filter(False, "<unknown>"),
+                ]
+            )
+            current, peak = tracemalloc.get_traced_memory()
+            lines = [
+                f"tracemalloc: {current / 1024:.0f} KiB en uso, "
+                f"pico {peak / 1024:.0f} KiB"
+            ]
+            if self.previous is None:
+                lines.append("Primera instantánea (referencia). Mayores bloques:")
+                stats = snapshot.statistics("lineno")
+            else:
+                lines.append("Diferencia con la instantánea anterior:")
+                stats = snapshot.compare_to(self.previous, "lineno")
+            lines += [str(stat) for stat in stats[:MEMORY_TOP_LINES]]
+            self.previous = snapshot
+
+            path = _output_path(self.output_dir, self.prefix, "memory.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        logger.info("Instantánea de memoria guardada en %s", path)
+        return path
+
+
+def install_signal_handlers(output_dir, prefix, profile_seconds):
+    """
+    SIGUSR1 → perfilador, SIGUSR2 → memoria. Solo en el hilo principal y en
+    sistemas con esas señales (no en Windows). Devuelve (profiler, snapshots)
+    o None si no se han instalado.
+    """
+    if not hasattr(signal, "SIGUSR1"):
+        logger.warning("SIGUSR1/SIGUSR2 no disponibles: diagnóstico desactivado")
+        return None
+
+    profiler = SamplingProfiler(output_dir, prefix)
+    snapshots = MemorySnapshots(output_dir, prefix)
+
+    def on_sigusr1(signum, frame):
+        profiler.toggle(profile_seconds)
+
+    def on_sigusr2(signum, frame):
+        threading.Thread(target=snapshots.take, name="tracemalloc", daemon=True).start()
+
+    signal.signal(signal.SIGUSR1, on_sigusr1)
+    signal.signal(signal.SIGUSR2, on_sigusr2)
+    logger.info(
+        "Diagnóstico: kill -USR1 %s (perfil de %s s), kill -USR2 %s (memoria) → %s",
+        os.getpid(),
+        profile_seconds,
+        os.getpid(),
+        output_dir,
+    )
+    return profiler, snapshots
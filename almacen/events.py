@@ -0,0 +1,187 @@
+"""
+Eventos en vivo: el listener y las vistas publican en canales pub/sub de Redis
+y los navegadores los reciben como Server-Sent Events (servidos por ASGI).
+
+EVENTS_REDIS_URL admite, además de redis://, memory:// (local_redis.py, un
+solo proceso) y fakeredis:// (si fakeredis está instalado), para las pruebas.
+"""
+
+import asyncio
+import json
+import logging
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+EPC_CHANNEL_FORMAT = "almacen:epc:{}"
+PRODUCTO_CHANNEL_FORMAT = "almacen:productos:{}"
+
+# Comentario periódico para detectar desconexiones y evitar cortes de proxies
+SSE_KEEPALIVE_SECONDS = 15
+# Cada conexión se cierra tras este tiempo; EventSource reconecta solo
+SSE_MAX_DURATION_SECONDS = 10 * 60
+SSE_RETRY_MILLISECONDS = 3000
+
+# Caché de Django con el último EPC leído en cada aula (listener y vistas)
+EPC_CACHE_ALIAS = "epc_cache"
+# Clave del último EPC del aula ({"epc", "leido_en"}), la escribe el listener
+LATEST_EPC_KEY_FORMAT = "last_epc:{}"
+
+_redis_client = None
+_fake_server = None
+
+
+def get_epc_cache():
+    """
+    Caché del último EPC por aula. Se resuelve en cada uso (no al importar)
+    para que override_settings(CACHES=...) la sustituya en las pruebas.
+    """
+    try:
+        return caches[EPC_CACHE_ALIAS]
+    except InvalidCacheBackendError:
+        return caches["default"]
+
+
+def redis_from_url(url, asynchronous=False):
+    """Cliente Redis (síncrono o asíncrono) para redis://, memory:// o fakeredis://."""
+    scheme = url.partition("://")[0]
+    if scheme == "memory":
+        from almacen.local_redis import AsyncLocalRedis, LocalRedis
+
+        return AsyncLocalRedis() if asynchronous else LocalRedis()
+    if scheme == "fakeredis":
+        global _fake_server
+        try:
+            import fakeredis
+        except ImportError as e:
+            raise ImproperlyConfigured(
+                "EVENTS_REDIS_URL=fakeredis:// requiere el paquete fakeredis"
+            ) from e
+        if _fake_server is None:
+            _fake_server = fakeredis.FakeServer()
+        if asynchronous:
+            return fakeredis.FakeAsyncRedis(server=_fake_server)
+        return fakeredis.FakeRedis(server=_fake_server)
+    if asynchronous:
+        return aioredis.Redis.from_url(url)
+    return redis.Redis.from_url(url)
+
+
+def get_redis():
+    """Cliente Redis síncrono compartido para publicar eventos."""
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis_from_url(settings.EVENTS_REDIS_URL)
+    return _redis_client
+
+
+@receiver(setting_changed)
+def _reset_clients(setting, **kwargs):
+    """Con override_settings(EVENTS_REDIS_URL=...) el cliente se recrea."""
+    global _redis_client
+    if setting == "EVENTS_REDIS_URL":
+        _redis_client = None
+
+
+def publish(channel, payload):
+    """Publica un evento JSON. Nunca falla: los eventos en vivo son opcionales."""
+    try:
+        get_redis().publish(channel, json.dumps(payload, cls=DjangoJSONEncoder))
+    except redis.RedisError as e:
+        logger.warning(f"No se pudo publicar el evento en {channel}: {e}")
+
+
+def publish_epc(aula_id, epc, leido_en):
+    """Publica el último EPC leído en un aula."""
+    publish(EPC_CHANNEL_FORMAT.format(aula_id), {"epc": epc, "leido_en": leido_en})
+
+
+async def aget_latest_epc(aula_id):
+    """
+    Último EPC leído en el aula ({"epc", "leido_en"}) o None, de la misma
+    caché que lee producto_create. Usa el pool síncrono de django-redis: un
+    cliente asíncrono por bucle no se reutilizaría con async_to_sync (WSGI),
+    que crea un bucle en cada llamada.
+    """
+    try:
+        return await get_epc_cache().aget(LATEST_EPC_KEY_FORMAT.format(aula_id))
+    except redis.RedisError as e:
+        logger.warning(f"No se pudo leer el último EPC del aula {aula_id}: {e}")
+        return None
+
+
+def publish_producto_change(producto_id, *aula_ids):
+    """
+    Notifica que un producto ha cambiado (préstamo, devolución, edición o
+    borrado) en los canales de las aulas indicadas. Se publica tras el commit
+    para que los suscriptores lean ya el estado nuevo.
+    """
+    payload = {"producto_id": producto_id}
+    channels = {
+        PRODUCTO_CHANNEL_FORMAT.format(aula_id)
+        for aula_id in aula_ids
+        if aula_id is not None
+    }
+
+    def _publish():
+        for channel in sorted(channels):
+            publish(channel, payload)
+
+    transaction.on_commit(_publish)
+
+
+def sse_message(data, event=None):
+    """Formatea un mensaje SSE; cada línea de data lleva su propio prefijo."""
+    lines = [f"event: {event}"] if event else []
+    lines += [f"data: {line}" for line in str(data).splitlines() or [""]]
+    return "\n".join(lines) + "\n\n"
+
+
+async def subscribe(channels):
+    """
+    Generador asíncrono con los payloads publicados en los canales.
+    Produce None cada SSE_KEEPALIVE_SECONDS sin mensajes.
+    """
+    client = redis_from_url(settings.EVENTS_REDIS_URL, asynchronous=True)
+    pubsub = client.pubsub()
+    try:
+        await pubsub.subscribe(*channels)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SSE_MAX_DURATION_SECONDS
+        while loop.time() < deadline:
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=SSE_KEEPALIVE_SECONDS
+            )
+            yield json.loads(message["data"]) if message else None
+    finally:
+        await pubsub.aclose()
+        await client.aclose()
+
+
+async def sse_stream(channels, render):
+    """
+    Cuerpo de una respuesta text/event-stream.
+
+    `render` es una corrutina que recibe cada payload y devuelve el mensaje SSE
+    a enviar (o None para descartarlo).
+    """
+    yield f"retry: {SSE_RETRY_MILLISECONDS}\n\n"
+    try:
+        async for payload in subscribe(channels):
+            if payload is None:
+                yield ": keepalive\n\n"
+                continue
+            message = await render(payload)
+            if message:
+                yield message
+    except redis.RedisError as e:
+        logger.warning(f"Suscripción a {channels} interrumpida: {e}")
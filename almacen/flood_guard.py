@@ -0,0 +1,179 @@
+"""
+Protección del listener MQTT frente a lectores que inundan
+rfid/lectura/<id>: un ESP32 con demodulationThreshold demasiado bajo o una
+etiqueta pegada a la antena no debe dejar sin servicio al resto de aulas.
+
+Cada lector (el <id> del topic) y cada aula tienen un token bucket. Por
+encima del límite solo pasa una de cada `sample_every` lecturas (el aula
+sigue viendo algo y el log muestra qué envía). Un lector que sigue por
+encima del límite durante `quarantine_after` segundos entra en cuarentena:
+se descartan todas sus lecturas durante `quarantine_seconds`.
+
+Un lector que funciona bien envía cada etiqueta como mucho una vez cada
+uidTTL (10 s en hardware/almacen/opciones.h): con los límites por defecto
+la ráfaga de una persona con sus productos pasa sin tocarla.
+Las lecturas de un aula con un recuento abierto no se limitan: un barrido
+del inventario envía cientos de etiquetas seguidas y solo se anotan en
+memoria.
+"""
+
+import logging
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """`burst` lecturas seguidas y `rate` por segundo de forma sostenida."""
+
+    __slots__ = ("rate", "burst", "tokens", "last")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = now
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class Source:
+    """Bucket y contadores de un lector o de un aula."""
+
+    def __init__(self, rate, burst, now):
+        self.bucket = TokenBucket(rate, burst, now)
+        self.over_since = None  # inicio de la racha por encima del límite
+        self.last_drop = None
+        self.over_count = 0  # lecturas por encima del límite en la racha
+        self.quarantined_until = None
+        self.received = 0  # en la ventana de informe actual
+        self.dropped = 0
+
+
+class FloodGuard:
+    """
+    Límites por lector y por aula: allow_reader() y allow_aula() devuelven
+    False si la lectura se descarta. Un rate 0 desactiva ese límite.
+    """
+
+    # Un segundo sin descartes termina la racha por encima del límite
+    STREAK_GAP_SECONDS = 1.0
+
+    def __init__(
+        self,
+        reader_rate,
+        reader_burst,
+        aula_rate,
+        aula_burst,
+        sample_every=10,
+        quarantine_after=10,
+        quarantine_seconds=60,
+        report_seconds=60,
+        clock=time.monotonic,
+    ):
+        self.limits = {
+            "Lector": (reader_rate, reader_burst),
+            "Aula": (aula_rate, aula_burst),
+        }
+        self.sample_every = sample_every
+        self.quarantine_after = quarantine_after
+        self.quarantine_seconds = quarantine_seconds
+        self.report_seconds = report_seconds
+        self.clock = clock
+        self.sources = {"Lector": {}, "Aula": {}}
+        # Totales desde el arranque: received, dropped, sampled, quarantined
+        self.totals = Counter()
+        self.last_report = clock()
+
+    def allow_reader(self, client_id):
+        return self._allow("Lector", client_id, quarantine=True)
+
+    def allow_aula(self, aula_id):
+        return self._allow("Aula", str(aula_id), quarantine=False)
+
+    def _allow(self, kind, key, quarantine):
+        rate, burst = self.limits[kind]
+        if rate <= 0:
+            return True
+        now = self.clock()
+        self._maybe_report(now)
+        source = self.sources[kind].get(key)
+        if source is None:
+            source = self.sources[kind][key] = Source(rate, burst, now)
+        source.received += 1
+        self.totals["received"] += 1
+
+        if source.quarantined_until is not None:
+            if now < source.quarantined_until:
+                return self._drop(source)
+            source.quarantined_until = None
+            logger.warning("%s %s sale de la cuarentena", kind, key)
+
+        if source.bucket.take(now):
+            return True
+
+        # Por encima del límite
+        if source.last_drop is None or (
+            now - source.last_drop > self.STREAK_GAP_SECONDS
+        ):
+            source.over_since = now
+            source.over_count = 0
+            logger.warning(
+                "%s %s supera el límite de %s lecturas/s: se descartan lecturas",
+                kind,
+                key,
+                rate,
+            )
+        source.last_drop = now
+        source.over_count += 1
+
+        if quarantine and now - source.over_since >= self.quarantine_after:
+            source.quarantined_until = now + self.quarantine_seconds
+            self.totals["quarantined"] += 1
+            logger.warning(
+                "%s %s en cuarentena %s s: %.0f lecturas/s durante %.0f s",
+                kind,
+                key,
+                self.quarantine_seconds,
+                source.received / max(now - self.last_report, 1e-3),
+                now - source.over_since,
+            )
+            source.last_drop = None
+            return self._drop(source)
+
+        if self.sample_every and source.over_count % self.sample_every == 0:
+            self.totals["sampled"] += 1
+            return True
+        return self._drop(source)
+
+    def _drop(self, source):
+        source.dropped += 1
+        self.totals["dropped"] += 1
+        return False
+
+    def _maybe_report(self, now):
+        """Cada report_seconds, el ritmo de los lectores y aulas con descartes."""
+        elapsed = now - self.last_report
+        if elapsed < self.report_seconds:
+            return
+        self.last_report = now
+        for kind, sources in self.sources.items():
+            for key, source in sources.items():
+                if source.dropped:
+                    logger.warning(
+                        "%s %s: %.1f lecturas/s, %d descartadas en %.0f s%s",
+                        kind,
+                        key,
+                        source.received / elapsed,
+                        source.dropped,
+                        elapsed,
+                        " (en cuarentena)" if source.quarantined_until else "",
+                    )
+                source.received = source.dropped = 0
@@ -0,0 +1,156 @@
+"""
+Caché de fragmentos HTML de productos (fila de tabla y tarjeta móvil).
+
+Cada fragmento se guarda junto a la versión del producto con la que se
+renderizó. La versión se cambia al guardar el Producto, su Ubicacion o un
+Prestamo (ver signals.py), así que un fragmento solo se reutiliza mientras
+el producto no cambie. Versiones y fragmentos se leen con un único get_many.
+"""
+
+import logging
+import time
+
+from django.core.cache import caches
+from django.db.models import Prefetch, prefetch_related_objects
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from .decorators import user_in_group_profesores
+from .models import Prestamo, Producto
+
+logger = logging.getLogger(__name__)
+
+FRAGMENT_CACHE_ALIAS = "default"
+PRODUCTO_VERSION_KEY_FORMAT = "producto_version:{}"
+PRODUCTO_FRAGMENT_KEY_FORMAT = "producto_fragment:{}:{}:{}"  # tipo, pk, nivel
+FRAGMENT_CACHE_TIMEOUT_SECONDS = 24 * 60 * 60
+
+PRODUCTO_FRAGMENT_TEMPLATES = {
+    "row": "almacen/_product_row.partial.html",
+    "card": "almacen/_product_card.partial.html",
+}
+
+
+# Préstamo abierto de cada producto en una consulta para todo el lote, en lugar
+# de las consultas por fila de Producto.current_prestamo/taken_by
+PRESTAMOS_ABIERTOS = Prefetch(
+    "prestamos",
+    queryset=Prestamo.objects.filter(devuelto_en__isnull=True).select_related(
+        "usuario"
+    ),
+    to_attr="prestamos_abiertos",
+)
+
+
+def _fragment_cache():
+    return caches[FRAGMENT_CACHE_ALIAS]
+
+
+def viewer_level(request):
+    """Nivel de permisos del que dependen los botones de cada fragmento."""
+    user = request.user
+    if not user.is_authenticated:
+        return "anonimo"
+    return "profesor" if user_in_group_profesores(user) else "usuario"
+
+
+def bump_producto_versions(producto_ids):
+    """Invalida los fragmentos cacheados de los productos indicados."""
+    producto_ids = [pk for pk in producto_ids if pk is not None]
+    if not producto_ids:
+        return
+    version = time.time_ns()
+    try:
+        _fragment_cache().set_many(
+            {PRODUCTO_VERSION_KEY_FORMAT.format(pk): version for pk in producto_ids},
+            timeout=None,
+        )
+    except Exception as e:
+        logger.warning(f"No se pudo invalidar la caché de fragmentos: {e}")
+
+
+def _render(request, kind, producto):
+    # Sin context processors: los fragmentos solo usan el producto y el usuario
+    return get_template(PRODUCTO_FRAGMENT_TEMPLATES[kind]).render(
+        {"p": producto, "request": request}
+    )
+
+
+def render_producto_fragments(request, productos, kinds=("row", "card")):
+    """
+    Devuelve {tipo: [html, ...]} en el orden de `productos`, que puede ser un
+    queryset de Producto (solo se leen los ids si todo está en caché) o una
+    lista de instancias ya cargadas.
+    """
+    if hasattr(productos, "values_list"):
+        queryset = productos
+        ids = list(productos.values_list("pk", flat=True))
+        loaded = {}
+    else:
+        queryset = None
+        ids = [p.pk for p in productos]
+        loaded = {p.pk: p for p in productos}
+
+    level = viewer_level(request)
+    version_keys = {pk: PRODUCTO_VERSION_KEY_FORMAT.format(pk) for pk in ids}
+    fragment_keys = {
+        (kind, pk): PRODUCTO_FRAGMENT_KEY_FORMAT.format(kind, pk, level)
+        for kind in kinds
+        for pk in ids
+    }
+
+    cache = _fragment_cache()
+    try:
+        cached = cache.get_many(
+            list(version_keys.values()) + list(fragment_keys.values())
+        )
+    except Exception as e:
+        logger.warning(f"Caché de fragmentos no disponible: {e}")
+        cache, cached = None, {}
+
+    # Un producto sin versión guardada nunca ha cambiado: versión 0
+    versions = {pk: cached.get(key, 0) for pk, key in version_keys.items()}
+    fragments = {}
+    missing = set()
+    for (kind, pk), key in fragment_keys.items():
+        entry = cached.get(key)
+        if entry is not None and entry[0] == versions[pk]:
+            fragments[kind, pk] = entry[1]
+        else:
+            missing.add(pk)
+
+    if missing:
+        pending = [pk for pk in missing if pk not in loaded]
+        if pending:
+            base = queryset if queryset is not None else Producto.objects.all()
+            for p in base.filter(pk__in=pending).select_related(
+                "aula", "ubicacion__persona"
+            ):
+                loaded[p.pk] = p
+
+        prefetch_related_objects(
+            [loaded[pk] for pk in missing if pk in loaded], PRESTAMOS_ABIERTOS
+        )
+        to_cache = {}
+        for pk in missing:
+            if pk not in loaded:  # borrado mientras tanto
+                continue
+            for kind in kinds:
+                if (kind, pk) in fragments:
+                    continue
+                html = _render(request, kind, loaded[pk])
+                fragments[kind, pk] = html
+                # Guardado con la versión leída: si otro proceso la cambia
+                # entretanto, el fragmento queda invalidado solo.
+                to_cache[fragment_keys[kind, pk]] = (versions[pk], html)
+
+        if cache is not None and to_cache:
+            try:
+                cache.set_many(to_cache, timeout=FRAGMENT_CACHE_TIMEOUT_SECONDS)
+            except Exception as e:
+                logger.warning(f"No se pudieron guardar fragmentos en caché: {e}")
+
+    return {
+        kind: [mark_safe(fragments[kind, pk]) for pk in ids if (kind, pk) in fragments]
+        for kind in kinds
+    }
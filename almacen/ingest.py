@@ -0,0 +1,311 @@
+"""
+Bus de ingesta opcional entre MQTT y el proceso de las lecturas, con Redis
+Streams. En lugar de mqtt_listener se ejecutan:
+
+- manage.py mqtt_bridge: decodifica cada lectura, le aplica los límites de
+  flood_guard.py y la añade (XADD) al stream de su partición. La partición
+  depende del aula, así que las lecturas de un aula quedan en orden en un
+  solo stream.
+- manage.py ingest_worker (uno o varios): cada uno lee sus particiones con
+  XREADGROUP y procesa las lecturas como mqtt_listener. Una lectura se
+  confirma (XACK) cuando el batch de su aula se ha guardado: si el worker se
+  para o la BD no responde, sigue pendiente y se vuelve a entregar.
+- manage.py ingest_status: lecturas sin leer y sin confirmar por partición,
+  y vuelta atrás a un ID del stream para reprocesar.
+"""
+
+import logging
+import time
+import zlib
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import redis
+from django.conf import settings
+from django.db import OperationalError
+
+from almacen.events import redis_from_url
+
+logger = logging.getLogger(__name__)
+
+STREAM_FORMAT = "almacen:lecturas:{}"
+# Grupo de consumidores de los ingest_worker
+GROUP = "workers"
+# Lecturas por XREADGROUP
+READ_COUNT = 500
+# Intentos de un batch que falla por sus datos antes de descartar sus lecturas
+MAX_DELIVERIES = 5
+# Espera antes de volver a leer las lecturas de un batch fallido
+RETRY_SECONDS = 5
+LAG_CHECK_SECONDS = 30
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def get_ingest_redis():
+    return redis_from_url(settings.INGEST_REDIS_URL)
+
+
+def stream_names(partitions=None):
+    partitions = partitions or settings.INGEST_PARTITIONS
+    return [STREAM_FORMAT.format(p) for p in range(partitions)]
+
+
+def stream_for(aula_id, partitions=None):
+    """Stream de las lecturas del aula (crc32: el mismo en todos los procesos)."""
+    partitions = partitions or settings.INGEST_PARTITIONS
+    return STREAM_FORMAT.format(zlib.crc32(str(aula_id).encode()) % partitions)
+
+
+def worker_streams(index, workers, partitions=None):
+    """
+    Particiones del worker `index` de `workers`. Cada partición tiene un solo
+    worker, que recibe todas las lecturas de sus aulas para formar los batches.
+    """
+    return [s for p, s in enumerate(stream_names(partitions)) if p % workers == index]
+
+
+def ensure_group(client, stream):
+    """Crea el stream y el grupo de los workers si no existen."""
+    try:
+        client.xgroup_create(stream, GROUP, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def add_reading(client, aula_id, epc, leido_en, topic):
+    """Añade una lectura decodificada al stream de su aula."""
+    return client.xadd(
+        stream_for(aula_id),
+        {
+            "aula_id": aula_id,
+            "epc": epc,
+            "leido_en": leido_en.isoformat(),
+            "topic": topic,
+        },
+        maxlen=settings.INGEST_STREAM_MAXLEN,
+        approximate=True,
+    )
+
+
+def decode_reading(fields):
+    """(aula_id, epc, leido_en, topic) de una entrada del stream."""
+    fields = {_text(k): _text(v) for k, v in fields.items()}
+    return (
+        fields["aula_id"],
+        fields["epc"],
+        datetime.fromisoformat(fields["leido_en"]),
+        fields["topic"],
+    )
+
+
+def stream_status(client, streams=None):
+    """
+    Estado de cada partición para el grupo de los workers: entradas, lecturas
+    sin leer (lag), sin confirmar y segundos desde la más antigua sin
+    confirmar. lag es None si Redis no lo sabe calcular (anterior a 7.0).
+    """
+    status = []
+    now_ms = time.time() * 1000
+    for stream in streams or stream_names():
+        length = client.xlen(stream)
+        try:
+            groups = client.xinfo_groups(stream)
+        except redis.ResponseError:
+            groups = []  # el stream aún no existe
+        group = next((g for g in groups if _text(g["name"]) == GROUP), None)
+        if group is None:
+            status.append(
+                {
+                    "stream": stream,
+                    "length": length,
+                    "lag": length,
+                    "pending": 0,
+                    "oldest_pending_seconds": None,
+                }
+            )
+            continue
+        pending = client.xpending(stream, GROUP)
+        oldest = pending["min"]
+        status.append(
+            {
+                "stream": stream,
+                "length": length,
+                "lag": group.get("lag"),
+                "pending": pending["pending"],
+                "oldest_pending_seconds": (
+                    (now_ms - int(_text(oldest).split("-")[0])) / 1000
+                    if oldest
+                    else None
+                ),
+            }
+        )
+    return status
+
+
+class StreamConsumer:
+    """
+    Transporte de ingest_worker (la interfaz de mqtt_transport, pero con
+    lecturas ya decodificadas). Entrega las lecturas de sus streams a
+    on_reading, que devuelve True si la lectura queda en el batch de su aula.
+
+    Las de un batch se confirman en committed() o, si falla, se vuelven a
+    leer del historial del consumidor; las demás (recuentos, aulas
+    inexistentes), en el siguiente loop, cuando ya se han guardado los
+    recuentos.
+    """
+
+    def __init__(
+        self, client, streams, consumer, read_count=READ_COUNT, retry_seconds=None
+    ):
+        self.client = client
+        self.streams = streams
+        self.consumer = consumer
+        self.read_count = read_count
+        self.retry_seconds = RETRY_SECONDS if retry_seconds is None else retry_seconds
+        self.done = []  # [(stream, id)] a confirmar en el siguiente loop
+        self.in_batch = defaultdict(list)  # {aula_id: [(stream, id)]}
+        self.failures = Counter()  # {(stream, id): batches fallidos}
+        # Al arrancar se releen las entregas que quedaron sin confirmar
+        self.recover = True
+        self.retry_at = 0
+        self.last_lag_check = time.monotonic()
+
+    def connect(self, on_reading):
+        for stream in self.streams:
+            ensure_group(self.client, stream)
+        self.on_reading = on_reading
+        logger.info(
+            "Consumidor %s del grupo %s en %s",
+            self.consumer,
+            GROUP,
+            ", ".join(self.streams),
+        )
+
+    def loop(self, timeout):
+        """Lee y entrega las lecturas nuevas, esperando timeout segundos como mucho."""
+        self._ack(self.done)
+        self.done = []
+        if self.recover and not self.in_batch:
+            if time.monotonic() < self.retry_at:
+                # Tras un fallo se espera antes de releer; no se leen lecturas nuevas
+                time.sleep(timeout)
+                return
+            # Historial del consumidor: entregadas antes y sin confirmar
+            response = self._read("0")
+            self.recover = any(
+                len(entries) >= self.read_count for _, entries in response
+            )
+        else:
+            response = self._read(">", block=max(1, int(timeout * 1000)))
+        for stream, entries in response:
+            for entry_id, fields in entries:
+                self._deliver(_text(stream), _text(entry_id), fields)
+        self._check_lag()
+
+    def _read(self, start, block=None):
+        return (
+            self.client.xreadgroup(
+                GROUP,
+                self.consumer,
+                dict.fromkeys(self.streams, start),
+                count=self.read_count,
+                block=block,
+            )
+            or []
+        )
+
+    def _deliver(self, stream, entry_id, fields):
+        entry = (stream, entry_id)
+        if fields is None:
+            # Recortada por INGEST_STREAM_MAXLEN antes de confirmarse
+            self.done.append(entry)
+            return
+        try:
+            aula_id, epc, leido_en, topic = decode_reading(fields)
+            queued = self.on_reading(aula_id, epc, leido_en, topic)
+        except OperationalError as e:
+            logger.error("BD no disponible, lectura %s pendiente: %s", entry_id, e)
+            self._retry_later()
+            return
+        except Exception as e:
+            logger.exception(
+                "Error procesando la lectura %s de %s: %s", entry_id, stream, e
+            )
+            queued = False
+        if queued:
+            self.in_batch[aula_id].append(entry)
+        else:
+            self.done.append(entry)
+
+    def committed(self, aula_id):
+        """El batch del aula se ha guardado: se confirman sus lecturas."""
+        entries = self.in_batch.pop(aula_id, [])
+        for entry in entries:
+            self.failures.pop(entry, None)
+        self._ack(entries)
+
+    def failed(self, aula_id, error):
+        """
+        El batch del aula no se ha guardado: sus lecturas siguen pendientes y
+        se vuelven a leer. Si la BD no estaba disponible se reintenta sin
+        límite; si no, se descartan tras MAX_DELIVERIES intentos.
+        """
+        entries = self.in_batch.pop(aula_id, [])
+        if not isinstance(error, OperationalError):
+            discarded = []
+            for entry in entries:
+                self.failures[entry] += 1
+                if self.failures[entry] >= MAX_DELIVERIES:
+                    discarded.append(entry)
+                    del self.failures[entry]
+            if discarded:
+                logger.error(
+                    "Descartadas %d lecturas del Aula %s tras %d intentos",
+                    len(discarded),
+                    aula_id,
+                    MAX_DELIVERIES,
+                    extra={"aula_id": aula_id},
+                )
+                self._ack(discarded)
+            if len(discarded) == len(entries):
+                return
+        self._retry_later()
+
+    def _retry_later(self):
+        self.recover = True
+        self.retry_at = time.monotonic() + self.retry_seconds
+
+    def _ack(self, entries):
+        by_stream = defaultdict(list)
+        for stream, entry_id in entries:
+            by_stream[stream].append(entry_id)
+        for stream, ids in by_stream.items():
+            self.client.xack(stream, GROUP, *ids)
+
+    def _check_lag(self):
+        now = time.monotonic()
+        if now - self.last_lag_check < LAG_CHECK_SECONDS:
+            return
+        self.last_lag_check = now
+        status = stream_status(self.client, self.streams)
+        lag = sum(s["lag"] or 0 for s in status)
+        logger.log(
+            logging.WARNING if lag > settings.INGEST_LAG_WARNING else logging.DEBUG,
+            "Lecturas sin leer: %d, sin confirmar: %d",
+            lag,
+            sum(s["pending"] for s in status),
+        )
+
+    def pending(self):
+        """Lecturas por leer o por confirmar (serve con stop, en pruebas)."""
+        lag = sum(s["lag"] or 0 for s in stream_status(self.client, self.streams))
+        return lag + len(self.done) + self.recover
+
+    def close(self):
+        self._ack(self.done)
+        self.done = []
+        self.client.close()
@@ -0,0 +1,402 @@
+"""
+Sustituto en memoria de lo que events.py usa de Redis (SET con caducidad,
+GET, PUBLISH, pipelines y pub/sub asíncrono), para EVENTS_REDIS_URL=memory://,
+y de los streams con grupos de consumidores que usa ingest.py.
+
+Todos los clientes del proceso comparten un mismo LocalRedisServer, así que
+lo que publica el listener en un hilo llega a las suscripciones SSE de otro
+bucle de eventos. No sirve entre procesos: es para pruebas y para el banco
+de carga (loadtest_fleet), que usan local_services() en override_settings.
+"""
+
+import asyncio
+import threading
+import time
+from collections import Counter, defaultdict
+
+from redis.exceptions import ResponseError
+
+# Alias de CACHES en settings.py
+CACHE_ALIASES = ("default", "epc_cache", "sessions")
+
+
+def locmem_caches(prefix, **options):
+    """CACHES con una LocMemCache "<prefix>-<alias>" por alias; options va a OPTIONS."""
+    caches = {}
+    for alias in CACHE_ALIASES:
+        caches[alias] = {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": f"{prefix}-{alias}",
+        }
+        if options:
+            caches[alias]["OPTIONS"] = options
+    return caches
+
+
+def local_services(prefix, **options):
+    """Ajustes para override_settings: cachés locmem, eventos e ingesta en memoria."""
+    return {
+        "CACHES": locmem_caches(prefix, **options),
+        "EVENTS_REDIS_URL": "memory://",
+        "INGEST_REDIS_URL": "memory://",
+    }
+
+
+def _bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode("utf-8")
+
+
+def _parse_id(value, last=(0, 0)):
+    """ID de stream como tupla (ms, secuencia); "$" es el último añadido."""
+    value = value.decode() if isinstance(value, bytes) else str(value)
+    if value == "-":
+        return (0, 0)
+    if value == "+":
+        return (float("inf"), 0)
+    if value == "$":
+        return last
+    ms, _, seq = value.partition("-")
+    return (int(ms), int(seq or 0))
+
+
+def _format_id(entry_id):
+    return f"{entry_id[0]}-{entry_id[1]}".encode()
+
+
+class LocalStream:
+    """Entradas de un stream y sus grupos de consumidores."""
+
+    def __init__(self):
+        self.entries = []  # [(id, {campo: valor})], ordenadas por id
+        self.last_id = (0, 0)
+        self.groups = {}  # {grupo: LocalGroup}
+
+    def after(self, entry_id):
+        return [entry for entry in self.entries if entry[0] > entry_id]
+
+
+class LocalGroup:
+    def __init__(self, last_id):
+        self.last_id = last_id
+        self.pending = {}  # {id: [consumidor, entregas]}
+        self.consumers = set()
+
+
+class LocalRedisServer:
+    """Datos y suscripciones compartidos por los clientes en memoria."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}  # {clave: (valor, caduca_en)}
+        self.subscriptions = defaultdict(set)  # {canal: {AsyncLocalPubSub}}
+        self.published = Counter()
+        self.streams = {}  # {nombre: LocalStream}
+        # Despierta a los XREADGROUP bloqueados cuando hay entradas nuevas
+        self.stream_added = threading.Condition(self.lock)
+
+    def set(self, key, value, ex=None):
+        expires = time.monotonic() + ex if ex else None
+        with self.lock:
+            self.data[key] = (_bytes(value), expires)
+        return True
+
+    def get(self, key):
+        with self.lock:
+            value, expires = self.data.get(key, (None, None))
+        if expires is not None and expires < time.monotonic():
+            return None
+        return value
+
+    def publish(self, channel, message):
+        with self.lock:
+            self.published[channel] += 1
+            subscribers = list(self.subscriptions.get(channel, ()))
+        for pubsub in subscribers:
+            pubsub.deliver(channel, _bytes(message))
+        return len(subscribers)
+
+    def flushall(self):
+        with self.lock:
+            self.data.clear()
+            self.published.clear()
+            self.streams.clear()
+
+    # --- Streams ---
+
+    def _group(self, name, groupname):
+        stream = self.streams.get(_bytes(name))
+        if stream is None or _bytes(groupname) not in stream.groups:
+            raise ResponseError(f"NOGROUP No such key '{name}' or consumer group")
+        return stream, stream.groups[_bytes(groupname)]
+
+    def xadd(self, name, fields, id="*", maxlen=None, approximate=True):
+        with self.stream_added:
+            stream = self.streams.setdefault(_bytes(name), LocalStream())
+            ms = int(time.time() * 1000)
+            if ms > stream.last_id[0]:
+                entry_id = (ms, 0)
+            else:
+                entry_id = (stream.last_id[0], stream.last_id[1] + 1)
+            stream.last_id = entry_id
+            stream.entries.append(
+                (entry_id, {_bytes(k): _bytes(v) for k, v in fields.items()})
+            )
+            if maxlen is not None and len(stream.entries) > maxlen:
+                del stream.entries[: len(stream.entries) - maxlen]
+            self.stream_added.notify_all()
+        return _format_id(entry_id)
+
+    def xlen(self, name):
+        with self.lock:
+            stream = self.streams.get(_bytes(name))
+            return len(stream.entries) if stream else 0
+
+    def xrange(self, name, min="-", max="+", count=None):
+        with self.lock:
+            stream = self.streams.get(_bytes(name))
+            if stream is None:
+                return []
+            low, high = _parse_id(min), _parse_id(max)
+            entries = [e for e in stream.entries if low <= e[0] <= high]
+        return [(_format_id(i), dict(f)) for i, f in entries[:count]]
+
+    def xgroup_create(self, name, groupname, id="$", mkstream=False):
+        with self.lock:
+            stream = self.streams.get(_bytes(name))
+            if stream is None:
+                if not mkstream:
+                    raise ResponseError("ERR The XGROUP subcommand requires the key")
+                stream = self.streams[_bytes(name)] = LocalStream()
+            if _bytes(groupname) in stream.groups:
+                raise ResponseError("BUSYGROUP Consumer Group name already exists")
+            stream.groups[_bytes(groupname)] = LocalGroup(_parse_id(id, stream.last_id))
+        return True
+
+    def xgroup_setid(self, name, groupname, id):
+        with self.lock:
+            stream, group = self._group(name, groupname)
+            group.last_id = _parse_id(id, stream.last_id)
+        return True
+
+    def _read_group(self, groupname, consumername, streams, count):
+        result = []
+        for name, start in streams.items():
+            stream, group = self._group(name, groupname)
+            group.consumers.add(_bytes(consumername))
+            if _bytes(start) == b">":
+                entries = stream.after(group.last_id)[:count]
+                if entries:
+                    group.last_id = entries[-1][0]
+                for entry_id, _ in entries:
+                    group.pending[entry_id] = [_bytes(consumername), 1]
+            else:
+                # Historial del consumidor: sus entregas sin confirmar
+                own = sorted(
+                    entry_id
+                    for entry_id, (consumer, _) in group.pending.items()
+                    if consumer == _bytes(consumername) and entry_id > _parse_id(start)
+                )[:count]
+                fields = dict(stream.entries)
+                entries = [(entry_id, fields.get(entry_id)) for entry_id in own]
+                for entry_id in own:
+                    group.pending[entry_id][1] += 1
+            if entries or _bytes(start) != b">":
+                result.append(
+                    [
+                        _bytes(name),
+                        [
+                            (_format_id(i), dict(f) if f is not None else None)
+                            for i, f in entries
+                        ],
+                    ]
+                )
+        return result
+
+    def xreadgroup(
+        self, groupname, consumername, streams, count=None, block=None, noack=False
+    ):
+        """Con block (ms, 0 = sin límite) espera a que haya entradas nuevas."""
+        deadline = None
+        if block is not None:
+            deadline = time.monotonic() + block / 1000 if block else float("inf")
+        with self.stream_added:
+            while True:
+                result = self._read_group(groupname, consumername, streams, count)
+                remaining = (deadline or 0) - time.monotonic()
+                if any(entries for _, entries in result) or remaining <= 0:
+                    return result
+                self.stream_added.wait(min(remaining, 3600))
+
+    def xack(self, name, groupname, *ids):
+        with self.lock:
+            _, group = self._group(name, groupname)
+            return sum(group.pending.pop(_parse_id(i), None) is not None for i in ids)
+
+    def xpending(self, name, groupname):
+        with self.lock:
+            _, group = self._group(name, groupname)
+            ids = sorted(group.pending)
+            per_consumer = Counter(consumer for consumer, _ in group.pending.values())
+        return {
+            "pending": len(ids),
+            "min": _format_id(ids[0]) if ids else None,
+            "max": _format_id(ids[-1]) if ids else None,
+            "consumers": [
+                {"name": name, "pending": n} for name, n in per_consumer.items()
+            ],
+        }
+
+    def xinfo_groups(self, name):
+        with self.lock:
+            stream = self.streams.get(_bytes(name))
+            if stream is None:
+                raise ResponseError("ERR no such key")
+            return [
+                {
+                    "name": groupname,
+                    "consumers": len(group.consumers),
+                    "pending": len(group.pending),
+                    "last-delivered-id": _format_id(group.last_id),
+                    "lag": len(stream.after(group.last_id)),
+                }
+                for groupname, group in stream.groups.items()
+            ]
+
+
+server = LocalRedisServer()
+
+
+class LocalPipeline:
+    """Pipeline sin transacción: ejecuta las órdenes al llamar a execute()."""
+
+    def __init__(self, server):
+        self.server = server
+        self.commands = []
+
+    def set(self, key, value, ex=None):
+        self.commands.append((self.server.set, (key, value, ex)))
+        return self
+
+    def publish(self, channel, message):
+        self.commands.append((self.server.publish, (channel, message)))
+        return self
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [method(*args) for method, args in commands]
+
+
+class LocalRedis:
+    """Cliente síncrono, con la interfaz de redis.Redis."""
+
+    def __init__(self, server=server):
+        self.server = server
+
+    def set(self, key, value, ex=None):
+        return self.server.set(key, value, ex)
+
+    def get(self, key):
+        return self.server.get(key)
+
+    def publish(self, channel, message):
+        return self.server.publish(channel, message)
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self.server)
+
+    def xadd(self, name, fields, id="*", maxlen=None, approximate=True):
+        return self.server.xadd(name, fields, id, maxlen, approximate)
+
+    def xlen(self, name):
+        return self.server.xlen(name)
+
+    def xrange(self, name, min="-", max="+", count=None):
+        return self.server.xrange(name, min, max, count)
+
+    def xgroup_create(self, name, groupname, id="$", mkstream=False):
+        return self.server.xgroup_create(name, groupname, id, mkstream)
+
+    def xgroup_setid(self, name, groupname, id):
+        return self.server.xgroup_setid(name, groupname, id)
+
+    def xreadgroup(
+        self, groupname, consumername, streams, count=None, block=None, noack=False
+    ):
+        return self.server.xreadgroup(
+            groupname, consumername, streams, count, block, noack
+        )
+
+    def xack(self, name, groupname, *ids):
+        return self.server.xack(name, groupname, *ids)
+
+    def xpending(self, name, groupname):
+        return self.server.xpending(name, groupname)
+
+    def xinfo_groups(self, name):
+        return self.server.xinfo_groups(name)
+
+    def close(self):
+        pass
+
+
+class AsyncLocalPubSub:
+    """Suscripción con la interfaz de redis.asyncio.client.PubSub."""
+
+    def __init__(self, server):
+        self.server = server
+        self.channels = set()
+        self.loop = None
+        self.queue = None
+
+    async def subscribe(self, *channels):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        with self.server.lock:
+            for channel in channels:
+                self.server.subscriptions[channel].add(self)
+        self.channels.update(channels)
+
+    def deliver(self, channel, data):
+        """Llamado desde el hilo que publica."""
+        message = {"type": "message", "channel": _bytes(channel), "data": data}
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
+        except RuntimeError:
+            # Bucle ya cerrado: la suscripción está muerta
+            pass
+
+    async def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def aclose(self):
+        with self.server.lock:
+            for channel in self.channels:
+                self.server.subscriptions[channel].discard(self)
+        self.channels.clear()
+
+
+class AsyncLocalRedis:
+    """Cliente asíncrono, con la interfaz de redis.asyncio.Redis."""
+
+    def __init__(self, server=server):
+        self.server = server
+
+    async def set(self, key, value, ex=None):
+        return self.server.set(key, value, ex)
+
+    async def get(self, key):
+        return self.server.get(key)
+
+    async def publish(self, channel, message):
+        return self.server.publish(channel, message)
+
+    def pubsub(self):
+        return AsyncLocalPubSub(self.server)
+
+    async def aclose(self):
+        pass
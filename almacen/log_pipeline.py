@@ -0,0 +1,158 @@
+"""
+Logging sin E/S en el hilo que emite el registro (callbacks del listener
+MQTT): un QueueHandler deja el registro en una cola y un hilo escritor
+(QueueListener) lo formatea y lo escribe en el fichero con rotación.
+
+Los mensajes repetidos de nivel INFO o inferior (uno por lectura) se limitan
+por plantilla a un número por minuto; WARNING y superiores pasan siempre, y
+también los registros con extra={"rate_limit": False} (las líneas de
+auditoría de préstamos y devoluciones).
+Con json_format cada línea es un objeto JSON.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+LOG_MAX_BYTES = 5 * 1024 * 1024  # 5 MB por archivo
+LOG_BACKUP_COUNT = 5
+# Campos de `extra` que se copian a las líneas JSON
+JSON_EXTRA_FIELDS = ("aula_id", "epc", "recuento_id")
+
+
+class InProcessQueueHandler(QueueHandler):
+    """
+    QueueHandler para una cola del mismo proceso: no formatea ni copia el
+    registro (QueueHandler.prepare lo hace para poder enviarlo a otro
+    proceso), así que el mensaje se compone en el hilo escritor.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Deja pasar como mucho `per_window` registros por plantilla de mensaje
+    (logger y msg sin formatear) cada `window_seconds`. El primero que pasa
+    tras una ventana con descartes indica cuántos se omitieron. Los registros
+    con el atributo rate_limit=False no se limitan.
+    """
+
+    def __init__(self, per_window, window_seconds=60, max_level=logging.INFO):
+        super().__init__()
+        self.per_window = per_window
+        self.window_seconds = window_seconds
+        self.max_level = max_level
+        self.lock = threading.Lock()
+        self.windows = {}  # {(logger, msg): [inicio, pasados, omitidos]}
+
+    def filter(self, record):
+        if (
+            record.levelno > self.max_level
+            or not self.per_window
+            or not getattr(record, "rate_limit", True)
+        ):
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.window_seconds:
+                omitted = window[2] if window else 0
+                self.windows[key] = [now, 1, 0]
+                if omitted:
+                    record.omitted = omitted
+                return True
+            if window[1] < self.per_window:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+class RateLimitFormatterMixin:
+    """Añade al mensaje los registros omitidos por RateLimitFilter."""
+
+    def formatMessage(self, record):
+        message = super().formatMessage(record)
+        omitted = getattr(record, "omitted", 0)
+        if omitted:
+            message += f" [+{omitted} similares omitidos]"
+        return message
+
+
+class TextFormatter(RateLimitFormatterMixin, logging.Formatter):
+    pass
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos de JSON_EXTRA_FIELDS."""
+
+    def format(self, record):
+        data = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in JSON_EXTRA_FIELDS:
+            if hasattr(record, field):
+                data[field] = getattr(record, field)
+        if getattr(record, "omitted", 0):
+            data["omitted"] = record.omitted
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def start_queue_logging(
+    log_file, json_format=False, rate_per_minute=0, level=logging.INFO
+):
+    """
+    Configura el logger raíz con una sola InProcessQueueHandler (sustituye la
+    de una llamada anterior) y arranca el hilo escritor. Los loggers de los
+    módulos propagan a la raíz: cada línea se escribe una vez.
+    """
+    root = logging.getLogger()
+    stop_queue_logging()
+
+    file_handler = RotatingFileHandler(
+        log_file,
+        maxBytes=LOG_MAX_BYTES,
+        backupCount=LOG_BACKUP_COUNT,
+        encoding="utf-8",
+    )
+    file_handler.setFormatter(
+        JsonFormatter() if json_format else TextFormatter(LOG_FORMAT)
+    )
+
+    records = queue.SimpleQueue()
+    handler = InProcessQueueHandler(records)
+    if rate_per_minute:
+        handler.addFilter(RateLimitFilter(rate_per_minute))
+    handler.listener = QueueListener(records, file_handler, respect_handler_level=True)
+    handler.listener.start()
+
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
+
+
+def stop_queue_logging():
+    """Vacía la cola, para el hilo escritor y quita el handler de la raíz."""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, InProcessQueueHandler):
+            root.removeHandler(handler)
+            handler.listener.stop()
+            for target in handler.listener.handlers:
+                target.close()
+
+
+atexit.register(stop_queue_logging)
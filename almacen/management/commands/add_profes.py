@@ -1,34 +1,131 @@
-from django.core.management.base import BaseCommand
+import time
+
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import Group
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from almacen.access import PROFESORES_GROUP, invalidate_user_access
+from almacen.models import Persona
 
 
 class Command(BaseCommand):
-    help = "Add users (by email) to ProfesoresFP group. Usage: python manage.py add_teachers emails.txt"
+    help = (
+        "Add users (by email) to ProfesoresFP group. "
+        "Usage: python manage.py add_profes emails.txt [--create]"
+    )
 
     def add_arguments(self, parser):
         parser.add_argument("file", help="Text file with one email per line")
+        parser.add_argument(
+            "--create",
+            action="store_true",
+            help="Crear en bloque los usuarios (y su Persona) que no existan",
+        )
 
-    def handle(self, file, *args, **kwargs):
+    def handle(self, file, *args, create, **kwargs):
+        start = time.monotonic()
         User = get_user_model()
-        group, _ = Group.objects.get_or_create(name="ProfesoresFP")
-        added, missing = 0, []
-        with open(file, "r", encoding="utf-8") as f:
-            for raw in f:
-                email = raw.strip().lower()
-                if not email:
-                    continue
-                try:
-                    user = User.objects.get(email__iexact=email)
-                except User.DoesNotExist:
-                    missing.append(email)
-                    continue
-                user.groups.add(group)
-                added += 1
-        self.stdout.write(self.style.SUCCESS(f"Added {added} users to ProfesoresFP"))
+        emails, invalid = self._read_emails(file)
+
+        with transaction.atomic():
+            group, _ = Group.objects.get_or_create(name=PROFESORES_GROUP)
+            users = self._find_users(User, emails)
+            missing = [email for email in emails if email not in users]
+            created = 0
+            if create and missing:
+                nuevos = self._create_users(User, missing)
+                created = len(nuevos)
+                users.update(nuevos)
+                missing = [email for email in missing if email not in users]
+
+            # Inserción directa en la tabla intermedia: un INSERT en lugar de
+            # un groups.add() (y sus señales m2m_changed) por usuario
+            user_ids = {pk for pks in users.values() for pk in pks}
+            Membership = User.groups.through
+            already = set(
+                Membership.objects.filter(
+                    group=group, user_id__in=user_ids
+                ).values_list("user_id", flat=True)
+            )
+            Membership.objects.bulk_create(
+                [
+                    Membership(user_id=pk, group_id=group.pk)
+                    for pk in sorted(user_ids - already)
+                ],
+                ignore_conflicts=True,
+            )
+            # Sin señales: invalidar a mano el acceso cacheado (is_profesor)
+            transaction.on_commit(lambda: invalidate_user_access(user_ids))
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Added {len(user_ids - already)} users to ProfesoresFP "
+                f"({len(already)} already there, {created} created) "
+                f"in {elapsed:.2f}s"
+            )
+        )
+        if invalid:
+            self.stdout.write(
+                self.style.WARNING(f"Invalid emails: {', '.join(invalid)}")
+            )
         if missing:
             self.stdout.write(
                 self.style.WARNING(
-                    f"Missing users (create them first): {', '.join(missing)}"
+                    f"Missing users (create them first or use --create): "
+                    f"{', '.join(missing)}"
                 )
             )
+
+    def _read_emails(self, file):
+        """Emails normalizados (minúsculas, sin repetidos, en orden) y los no válidos."""
+        emails, invalid = {}, []
+        with open(file, "r", encoding="utf-8-sig") as f:
+            for raw in f:
+                email = raw.strip().lower()
+                if not email or email.startswith("#"):
+                    continue
+                try:
+                    validate_email(email)
+                except ValidationError:
+                    invalid.append(email)
+                    continue
+                emails[email] = None
+        return list(emails), invalid
+
+    def _find_users(self, User, emails):
+        """{email en minúsculas: [pks]} con un único IN sin distinguir mayúsculas."""
+        users = {}
+        qs = (
+            User.objects.annotate(email_lower=Lower("email"))
+            .filter(email_lower__in=emails)
+            .values_list("email_lower", "pk")
+        )
+        for email, pk in qs:
+            users.setdefault(email, []).append(pk)
+        return users
+
+    def _create_users(self, User, emails):
+        """
+        Crea los usuarios con bulk_create: sin post_save, así que la Persona
+        que crearía la señal se crea aquí también en bloque. Sin contraseña
+        utilizable: entran con Google.
+        """
+        User.objects.bulk_create(
+            [
+                User(username=email, email=email, password=make_password(None))
+                for email in emails
+            ],
+            ignore_conflicts=True,
+        )
+        nuevos = self._find_users(User, emails)
+        Persona.objects.bulk_create(
+            [Persona(user_id=pks[0]) for pks in nuevos.values()],
+            ignore_conflicts=True,
+        )
+        return nuevos
@@ -0,0 +1,82 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from almacen.fragments import bump_producto_versions
+from almacen.models import Producto
+from almacen.thumbnails import build_thumbnails
+
+
+def _build(name):
+    # Se ejecuta en un proceso del pool: solo storage y Pillow, sin BD
+    try:
+        return name, build_thumbnails(name), None
+    except Exception as e:
+        return name, None, str(e)
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera las miniaturas de las fotos de productos existentes. "
+        "Usage: python manage.py generate_thumbnails [--workers N] [--all]"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Procesos en paralelo (por defecto, uno por CPU)",
+        )
+        parser.add_argument(
+            "--all",
+            dest="include_done",
+            action="store_true",
+            help="Procesar también los productos que ya tienen miniaturas",
+        )
+
+    def handle(self, *args, workers, include_done, **kwargs):
+        qs = Producto.objects.exclude(foto="").exclude(foto__isnull=True)
+        if not include_done:
+            qs = qs.filter(foto_hash="")
+        pks_by_name = {}
+        for pk, name in qs.values_list("pk", "foto"):
+            pks_by_name.setdefault(name, []).append(pk)
+        if not pks_by_name:
+            self.stdout.write("No hay fotos pendientes")
+            return
+
+        start = time.monotonic()
+        digests, errors = {}, []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_build, name) for name in pks_by_name]
+            for future in as_completed(futures):
+                name, digest, error = future.result()
+                if error:
+                    errors.append(f"{name}: {error}")
+                else:
+                    digests[name] = digest
+
+        updated = []
+        with transaction.atomic():
+            for name, digest in digests.items():
+                # Solo si la foto no ha cambiado mientras tanto
+                if Producto.objects.filter(pk__in=pks_by_name[name], foto=name).update(
+                    foto_hash=digest
+                ):
+                    updated.extend(pks_by_name[name])
+            transaction.on_commit(lambda: bump_producto_versions(updated))
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Miniaturas de {len(digests)} fotos ({len(updated)} productos) "
+                f"en {time.monotonic() - start:.1f}s con {workers} procesos"
+            )
+        )
+        if errors:
+            self.stdout.write(
+                self.style.WARNING(f"Fotos con errores: {'; '.join(errors)}")
+            )
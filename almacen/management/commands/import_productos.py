@@ -0,0 +1,201 @@
+import csv
+import time
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, transaction
+from django.db.models import OuterRef, Subquery
+
+from almacen.conditional import bump_aula_versions
+from almacen.forms import ProductoForm
+from almacen.fragments import bump_producto_versions
+from almacen.models import Aula, Producto, Ubicacion
+
+# Columnas del CSV (cabecera obligatoria); "aula" es el nombre del aula
+REQUIRED_COLUMNS = {"epc", "nombre", "aula"}
+UPDATE_FIELDS = [
+    "nombre",
+    "posicion",
+    "n_serie",
+    "aula",
+    "estanteria",
+    "cantidad",
+    "descripcion",
+    "fds",
+    "actualizado",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa productos desde un CSV (epc, nombre, aula, posicion, n_serie, "
+        "estanteria, cantidad, descripcion, fds). Si el EPC ya existe se actualiza. "
+        "Usage: python manage.py import_productos productos.csv"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="CSV en UTF-8 con cabecera")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--delimiter", default=",")
+        parser.add_argument(
+            "--rejects", help="Guardar las filas rechazadas y el motivo en este CSV"
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Solo validar, sin escribir en la BD",
+        )
+
+    def handle(self, file, *args, chunk_size, delimiter, rejects, dry_run, **kwargs):
+        start = time.monotonic()
+        # Reglas de validación del formulario de alta, sin aula (se resuelve por
+        # nombre) ni foto. Los campos se limpian directamente: instanciar un
+        # ModelForm por fila y su validate_unique (una consulta por EPC) es lo
+        # que hace lenta la importación.
+        form = ProductoForm()
+        fields = {
+            name: field
+            for name, field in form.fields.items()
+            if name not in ("aula", "foto")
+        }
+        aulas = {
+            nombre.casefold(): pk
+            for pk, nombre in Aula.objects.values_list("pk", "nombre")
+        }
+
+        self.created = self.updated = 0
+        self.rejected = []
+        seen_epcs = set()
+        with open(file, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f, delimiter=delimiter)
+            missing = REQUIRED_COLUMNS - set(reader.fieldnames or ())
+            if missing:
+                raise CommandError(f"Faltan columnas: {', '.join(sorted(missing))}")
+            # La línea 1 es la cabecera
+            rows = enumerate(reader, start=2)
+            while chunk := list(islice(rows, chunk_size)):
+                valid = []
+                for line, row in chunk:
+                    producto, error = self._validate(row, fields, aulas, seen_epcs)
+                    if error:
+                        self.rejected.append((line, row, error))
+                    else:
+                        valid.append((line, row, producto))
+                if valid and not dry_run:
+                    self._write_chunk(valid)
+
+        elapsed = time.monotonic() - start
+        verb = "Validados" if dry_run else "Importados"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} en {elapsed:.1f}s: {self.created} nuevos, "
+                f"{self.updated} actualizados, {len(self.rejected)} rechazados"
+            )
+        )
+        for line, _, error in self.rejected[:20]:
+            self.stdout.write(self.style.WARNING(f"  línea {line}: {error}"))
+        if len(self.rejected) > 20:
+            self.stdout.write(
+                self.style.WARNING(f"  ... y {len(self.rejected) - 20} más")
+            )
+        if rejects and self.rejected:
+            self._write_rejects(rejects, reader.fieldnames)
+
+    def _validate(self, row, fields, aulas, seen_epcs):
+        """Devuelve (Producto sin guardar, None) o (None, motivo del rechazo)."""
+        cleaned, errors = {}, []
+        for name, field in fields.items():
+            value = (row.get(name) or "").strip()
+            if name == "cantidad" and not value:
+                value = field.initial or 1
+            try:
+                cleaned[name] = field.clean(value)
+            except ValidationError as e:
+                errors.append(f"{name}: {' '.join(e.messages)}")
+
+        aula_id = aulas.get((row.get("aula") or "").strip().casefold())
+        if aula_id is None:
+            errors.append(f"aula: no existe el aula '{row.get('aula', '')}'")
+        if errors:
+            return None, "; ".join(errors)
+
+        if cleaned["epc"] in seen_epcs:
+            return None, f"epc: {cleaned['epc']} repetido en el fichero"
+        seen_epcs.add(cleaned["epc"])
+        return Producto(aula_id=aula_id, **cleaned), None
+
+    def _write_chunk(self, valid):
+        productos = [producto for _, _, producto in valid]
+        epcs = [p.epc for p in productos]
+        try:
+            with transaction.atomic():
+                # EPC -> aula actual de los que ya existen
+                existing = dict(
+                    Producto.objects.filter(epc__in=epcs).values_list("epc", "aula_id")
+                )
+                # Upsert por EPC: los pks quedan asignados en los objetos
+                Producto.objects.bulk_create(
+                    productos,
+                    update_conflicts=True,
+                    unique_fields=["epc"],
+                    update_fields=UPDATE_FIELDS,
+                )
+                if any(p.pk is None for p in productos):
+                    # BD sin RETURNING en upsert: leer los pks en una consulta
+                    pks = dict(
+                        Producto.objects.filter(epc__in=epcs).values_list("epc", "pk")
+                    )
+                    for p in productos:
+                        p.pk = pks[p.epc]
+
+                # Ubicación nueva en estantería para los productos que no la
+                # tienen (los nuevos y los existentes sin ella: si no, no salen en
+                # el inventario); en los demás ignore_conflicts la deja como está
+                # y se sincroniza la estantería con un único UPDATE si no están
+                # prestados, igual que en producto_edit
+                Ubicacion.objects.bulk_create(
+                    [
+                        Ubicacion(
+                            producto_id=p.pk,
+                            estado="ESTANTE",
+                            aula_id=p.aula_id,
+                            estanteria=p.estanteria,
+                            posicion=p.posicion,
+                        )
+                        for p in productos
+                    ],
+                    ignore_conflicts=True,
+                )
+                if existing:
+                    producto = Producto.objects.filter(pk=OuterRef("producto_id"))
+                    Ubicacion.objects.filter(
+                        producto__epc__in=existing, estado="ESTANTE"
+                    ).update(
+                        aula_id=Subquery(producto.values("aula_id")[:1]),
+                        estanteria=Subquery(producto.values("estanteria")[:1]),
+                        posicion=Subquery(producto.values("posicion")[:1]),
+                    )
+
+                # bulk_create y update() no emiten señales: invalidar cachés a mano
+                pks = [p.pk for p in productos]
+                aula_ids = {p.aula_id for p in productos} | set(existing.values())
+                transaction.on_commit(lambda: bump_producto_versions(pks))
+                transaction.on_commit(lambda: bump_aula_versions(aula_ids))
+        except DatabaseError as e:
+            self.rejected.extend(
+                (line, row, f"error de BD: {e}") for line, row, _ in valid
+            )
+            return
+        self.updated += len(existing)
+        self.created += len(productos) - len(existing)
+
+    def _write_rejects(self, path, fieldnames):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["linea", *fieldnames, "motivo"])
+            for line, row, error in self.rejected:
+                writer.writerow(
+                    [line, *(row.get(name, "") for name in fieldnames), error]
+                )
+        self.stdout.write(f"Filas rechazadas guardadas en {path}")
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from almacen.ingest import (
+    GROUP,
+    ensure_group,
+    get_ingest_redis,
+    stream_names,
+    stream_status,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Muestra las lecturas sin leer y sin confirmar de cada partición del bus "
+        "de ingesta y permite volver a procesarlas desde un ID del stream."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--partition",
+            type=int,
+            help="Solo esta partición (default: todas)",
+        )
+        parser.add_argument(
+            "--rewind",
+            metavar="ID",
+            help="Vuelve a entregar a los workers las lecturas posteriores a ID "
+            "(0 = todas las que conserva el stream). Los préstamos se alternan "
+            "otra vez: úsese tras restaurar una copia de la BD anterior a ID",
+        )
+        parser.add_argument(
+            "--max-lag",
+            type=int,
+            help="Termina con error si quedan más lecturas sin leer (monitorización)",
+        )
+
+    def handle(self, *args, **options):
+        client = get_ingest_redis()
+        streams = stream_names()
+        if options["partition"] is not None:
+            if not 0 <= options["partition"] < len(streams):
+                raise CommandError(f"Partición fuera de rango (0-{len(streams) - 1})")
+            streams = [streams[options["partition"]]]
+
+        if options["rewind"]:
+            for stream in streams:
+                ensure_group(client, stream)
+                client.xgroup_setid(stream, GROUP, options["rewind"])
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Grupo {GROUP} situado en {options['rewind']} "
+                    f"({len(streams)} particiones)"
+                )
+            )
+
+        status = stream_status(client, streams)
+        for s in status:
+            line = (
+                f"{s['stream']}: {s['length']} lecturas, "
+                f"{'?' if s['lag'] is None else s['lag']} sin leer, "
+                f"{s['pending']} sin confirmar"
+            )
+            if s["oldest_pending_seconds"] is not None:
+                line += f" (la más antigua hace {s['oldest_pending_seconds']:.0f} s)"
+            self.stdout.write(line)
+
+        lag = sum(s["lag"] or 0 for s in status)
+        if options["max_lag"] is not None and lag > options["max_lag"]:
+            raise CommandError(f"{lag} lecturas sin leer (máximo {options['max_lag']})")
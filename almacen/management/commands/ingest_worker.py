@@ -0,0 +1,102 @@
+import logging
+import os
+import socket
+
+from django.core.management.base import CommandError
+
+from almacen.diagnostics import install_signal_handlers
+from almacen.ingest import StreamConsumer, get_ingest_redis, worker_streams
+from almacen.management.commands import mqtt_listener
+from almacen.management.commands.mqtt_listener import (
+    PROFILER_SECONDS,
+    BatchProcessor,
+    RecuentoCollector,
+    get_log_file,
+    setup_logging,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AckingBatchProcessor(BatchProcessor):
+    """Avisa al StreamConsumer de cada batch guardado o fallido."""
+
+    def __init__(self, batch_time_seconds, consumer):
+        super().__init__(batch_time_seconds)
+        self.consumer = consumer
+
+    def _process_batch_logic(self, aula_id, batch):
+        try:
+            super()._process_batch_logic(aula_id, batch)
+        except Exception as e:
+            self.consumer.failed(aula_id, e)
+            raise
+        self.consumer.committed(aula_id)
+
+
+class Command(mqtt_listener.Command):
+    help = (
+        "Procesa las lecturas RFID que mqtt_bridge deja en los streams de Redis "
+        "(ver almacen/ingest.py)."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Número de workers que se reparten las particiones (default: 1)",
+        )
+        parser.add_argument(
+            "--index",
+            type=int,
+            default=0,
+            help="Índice de este worker, de 0 a workers-1 (default: 0)",
+        )
+        parser.add_argument(
+            "--consumer",
+            help="Nombre en el grupo de Redis; debe ser el mismo tras reiniciar "
+            "para recuperar sus lecturas sin confirmar (default: <host>-<índice>)",
+        )
+
+    def handle(self, *args, **options):
+        index, workers = options["index"], options["workers"]
+        streams = worker_streams(index, workers) if 0 <= index < workers else []
+        if not streams:
+            raise CommandError(
+                f"El worker {index} de {workers} no tiene particiones asignadas"
+            )
+        name = f"ingest-worker-{index}"
+        consumer_name = options["consumer"] or f"{socket.gethostname()}-{index}"
+
+        setup_logging(name)
+        logger.info(
+            "Iniciando el worker de ingesta %s con batch time de %s segundos...",
+            consumer_name,
+            options["batch_time"],
+        )
+        install_signal_handlers(
+            os.path.dirname(get_log_file(name)), name, PROFILER_SECONDS
+        )
+
+        consumer = StreamConsumer(get_ingest_redis(), streams, consumer_name)
+        try:
+            self.start(consumer, AckingBatchProcessor(options["batch_time"], consumer))
+            self.serve(consumer, options["check_interval"])
+        except KeyboardInterrupt:
+            logger.info("Worker detenido por el usuario")
+        except Exception as e:
+            logger.exception("Error en el worker de ingesta: %s", e)
+        finally:
+            consumer.close()
+
+    def start(self, transport, batch_processor):
+        """
+        Como mqtt_listener.Command.start, pero el transporte (StreamConsumer)
+        entrega lecturas ya decodificadas a process_reading.
+        """
+        self.batch_processor = batch_processor
+        self.recuentos = RecuentoCollector()
+        self.recuentos.refresh()
+        transport.connect(self.process_reading)
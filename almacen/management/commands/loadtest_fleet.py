@@ -0,0 +1,497 @@
+import json
+import random
+import statistics
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+from http.cookiejar import CookieJar
+from importlib import import_module
+from urllib.error import HTTPError
+from urllib.parse import urljoin
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from almacen.access import PROFESORES_GROUP
+from almacen.local_redis import local_services
+from almacen.management.commands import mqtt_listener
+from almacen.models import Aula, Persona
+from almacen.mqtt_transport import QueueBroker, QueueTransport
+
+# Como el firmware (opciones.h y Envio_datos.ino)
+CLIENT_ID_FORMAT = "almacen_{}"
+READING_TOPIC_FORMAT = "rfid/lectura/{}"
+SCREEN_TOPIC_FORMAT = "rfid/pantalla/{}"
+PAYLOAD_FORMAT = '{{"aula_id":"{}","epc":"{}","timestamp":"{}"}}'
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Separación entre dos etiquetas de una misma pasada por el arco
+TAG_GAP_SECONDS = (0.05, 0.4)
+
+# Peso de cada acción de los usuarios simulados
+USER_ACTIONS = {"get_latest_epc": 6, "inventory": 3, "toggle_prestamo": 1}
+STATICFILES_BACKEND = "django.contrib.staticfiles.storage.StaticFilesStorage"
+
+
+def is_lock_error(e):
+    return isinstance(e, OperationalError) and "locked" in str(e)
+
+
+def percentiles(values):
+    """(p50, p95, p99) en milisegundos."""
+    if len(values) < 2:
+        value = values[0] * 1000 if values else 0.0
+        return value, value, value
+    q = statistics.quantiles(values, n=100)
+    return q[49] * 1000, q[94] * 1000, q[98] * 1000
+
+
+class Stats:
+    """Resultados compartidos por los hilos de la simulación."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.published = 0
+        self.pending = {}  # {(aula_id, epc): instante de envío}
+        self.reading_latencies = []
+        self.batch_seconds = []
+        self.page_latencies = defaultdict(list)
+        self.statuses = Counter()
+        self.lock_errors = Counter()  # {"listener" | "users": n}
+        self.errors = Counter()
+        self.max_backlog = 0
+
+    def sent(self, aula_id, epc, backlog=0):
+        with self.lock:
+            self.published += 1
+            self.max_backlog = max(self.max_backlog, backlog)
+            # Lecturas repetidas antes del commit: cuenta la primera
+            self.pending.setdefault((aula_id, epc), time.perf_counter())
+
+    def committed(self, aula_id, epcs, seconds):
+        now = time.perf_counter()
+        with self.lock:
+            self.batch_seconds.append(seconds)
+            for epc in epcs:
+                sent = self.pending.pop((aula_id, epc), None)
+                if sent is not None:
+                    self.reading_latencies.append(now - sent)
+
+    def request(self, name, seconds, status):
+        with self.lock:
+            self.page_latencies[name].append(seconds)
+            self.statuses[status] += 1
+
+    def error(self, source, e):
+        with self.lock:
+            if is_lock_error(e):
+                self.lock_errors[source] += 1
+            else:
+                self.errors[f"{source}: {type(e).__name__}"] += 1
+
+
+class TimedBatchProcessor(mqtt_listener.BatchProcessor):
+    """BatchProcessor del listener que anota cuándo se guarda cada lectura."""
+
+    def __init__(self, batch_time_seconds, stats):
+        super().__init__(batch_time_seconds)
+        self.stats = stats
+
+    def _process_batch_logic(self, aula_id, batch):
+        start = time.perf_counter()
+        try:
+            super()._process_batch_logic(aula_id, batch)
+        except Exception as e:
+            self.stats.error("listener", e)
+            raise
+        self.stats.committed(
+            aula_id, {epc for epc, _ in batch}, time.perf_counter() - start
+        )
+
+
+class Gate(threading.Thread):
+    """
+    Arco RFID simulado: pasadas con el llavero de una persona seguido de
+    varios productos, separadas por un intervalo aleatorio. Cada etiqueta
+    se publica como el firmware: "1" en rfid/pantalla/<id> y la lectura en
+    rfid/lectura/<id>. Como su buffer de repetidos, no reenvía una etiqueta
+    dentro de la misma pasada.
+    """
+
+    def __init__(self, number, aula_id, llaveros, productos, broker, stats, options):
+        super().__init__(name=f"gate-{number}", daemon=True)
+        self.client_id = CLIENT_ID_FORMAT.format(number)
+        self.aula_id = str(aula_id)
+        self.llaveros = llaveros
+        self.productos = productos
+        self.broker = broker
+        self.stats = stats
+        self.interval = options["interval"]
+        self.burst = options["burst"]
+        self.deadline = options["deadline"]
+        self.rng = random.Random(f"{options['seed']}-{number}")
+
+    def run(self):
+        while True:
+            time.sleep(self.rng.expovariate(1 / self.interval))
+            if time.monotonic() >= self.deadline:
+                return
+            tags = self.rng.sample(
+                self.productos,
+                min(len(self.productos), self.rng.randint(1, self.burst)),
+            )
+            if self.llaveros:
+                tags.insert(0, self.rng.choice(self.llaveros))
+            for epc in tags:
+                self.publish(epc)
+                time.sleep(self.rng.uniform(*TAG_GAP_SECONDS))
+
+    def publish(self, epc):
+        timestamp = timezone.localtime().strftime(TIMESTAMP_FORMAT)
+        self.broker.publish(SCREEN_TOPIC_FORMAT.format(self.client_id), "1")
+        self.stats.sent(self.aula_id, epc, self.broker.pending())
+        payload = PAYLOAD_FORMAT.format(self.aula_id, epc, timestamp)
+        self.broker.publish(READING_TOPIC_FORMAT.format(self.client_id), payload)
+
+
+class ListenerThread(threading.Thread):
+    """
+    El listener real (Command.start y Command.serve: on_message, recuentos y
+    BatchProcessor) conectado al broker en memoria en lugar de a mosquitto.
+    """
+
+    def __init__(self, broker, stats, options):
+        super().__init__(name="listener", daemon=True)
+        self.check_interval = options["check_interval"]
+        self.stop = threading.Event()
+        self.transport = QueueTransport(broker)
+        self.command = mqtt_listener.Command()
+        # Suscrito antes de que los arcos empiecen a publicar
+        self.command.start(
+            self.transport, TimedBatchProcessor(options["batch_time"], stats)
+        )
+
+    def run(self):
+        try:
+            self.command.serve(self.transport, self.check_interval, self.stop)
+        finally:
+            self.transport.close()
+            connections.close_all()
+
+
+class SimulatedUser(threading.Thread):
+    """Profesor con el inventario de su aula abierto en una tablet."""
+
+    def __init__(self, number, session_key, productos, stats, options):
+        super().__init__(name=f"user-{number}", daemon=True)
+        self.productos = productos
+        self.stats = stats
+        self.think = options["think"]
+        self.deadline = options["deadline"]
+        self.rng = random.Random(f"{options['seed']}-user-{number}")
+        if options["base_url"]:
+            self.http = HttpSession(options["base_url"], session_key)
+        else:
+            self.http = None
+            self.client = Client()
+            self.client.cookies[settings.SESSION_COOKIE_NAME] = session_key
+
+    def run(self):
+        actions, weights = zip(*USER_ACTIONS.items())
+        try:
+            while time.monotonic() < self.deadline:
+                action = self.rng.choices(actions, weights)[0]
+                if action == "toggle_prestamo":
+                    method, args = "post", [self.rng.choice(self.productos)]
+                else:
+                    method, args = "get", []
+                url = reverse(f"almacen:{action}", args=args)
+                start = time.perf_counter()
+                try:
+                    status = self._request(method, url)
+                except Exception as e:
+                    self.stats.error("users", e)
+                else:
+                    self.stats.request(action, time.perf_counter() - start, status)
+                time.sleep(self.rng.uniform(0, 2 * self.think))
+        finally:
+            connections.close_all()
+
+    def _request(self, method, url):
+        if self.http:
+            return self.http.request(method, url)
+        response = getattr(self.client, method)(url, HTTP_HX_REQUEST="true")
+        return response.status_code
+
+
+class HttpSession:
+    """Cliente HTTP mínimo con cookies y la cabecera CSRF de HTMX."""
+
+    def __init__(self, base_url, session_key):
+        self.base_url = base_url
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies))
+        self.session_cookie = f"{settings.SESSION_COOKIE_NAME}={session_key}"
+
+    def request(self, method, url):
+        url = urljoin(self.base_url, url)
+        headers = {"Cookie": self.session_cookie, "HX-Request": "true"}
+        if method == "post":
+            token = next(
+                (c.value for c in self.cookies if c.name == settings.CSRF_COOKIE_NAME),
+                None,
+            )
+            if token is None:
+                # Cualquier página con {% csrf_token %} deja la cookie
+                self.request("get", reverse("almacen:inventory"))
+                return self.request(method, url)
+            headers.update({"X-CSRFToken": token, "Referer": url})
+        req = Request(url, data=b"" if method == "post" else None, headers=headers)
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                response.read()
+                return response.status
+        except HTTPError as e:
+            return e.code
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test of the whole system, offline: N simulated RFID gates publish "
+        "reading bursts (same topics and payload as the ESP32 firmware) to an "
+        "in-process stand-in broker consumed by the real mqtt_listener code, "
+        "while M simulated users hit inventory, toggle_prestamo and "
+        "get_latest_epc. Reports reading-to-commit latency, page latency "
+        "percentiles and DB lock errors. Usage: python manage.py loadtest_fleet "
+        "--gates 20 --users 40 --duration 60 (on a database from seed_almacen)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--gates", type=int, default=10)
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--duration", type=float, default=30.0)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=10.0,
+            help="Segundos medios entre dos pasadas por el mismo arco",
+        )
+        parser.add_argument(
+            "--burst", type=int, default=5, help="Máximo de productos por pasada"
+        )
+        parser.add_argument(
+            "--think",
+            type=float,
+            default=1.0,
+            help="Segundos medios entre dos peticiones de un usuario",
+        )
+        parser.add_argument(
+            "--batch-time",
+            type=float,
+            default=mqtt_listener.BATCH_TIME_SECONDS,
+            help="Agrupación de lecturas del listener, como en mqtt_listener",
+        )
+        parser.add_argument("--check-interval", type=float, default=0.5)
+        parser.add_argument(
+            "--base-url",
+            help="Servidor en marcha (http://127.0.0.1:8000) en lugar del cliente "
+            "de pruebas de Django; debe compartir la BD y las sesiones",
+        )
+        parser.add_argument(
+            "--use-redis",
+            action="store_true",
+            help="Usar las cachés y los eventos de settings (Redis) en lugar de "
+            "locmem y un sustituto en memoria",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--report", help="Guardar los resultados en este JSON")
+
+    def handle(self, *args, **options):
+        if options["gates"] < 1 and options["users"] < 1:
+            raise CommandError("Nada que simular: --gates y --users son 0")
+        aulas = self._aulas(options["gates"] or 1)
+        users = self._users(options["users"], aulas)
+
+        with ExitStack() as stack:
+            if options["base_url"]:
+                # Sesiones en el almacén de sesiones que usa el servidor
+                sessions = [self._session(user, aula.pk) for user, aula in users]
+            if not options["use_redis"]:
+                self._use_local_services(stack)
+            if not options["base_url"]:
+                # Cliente de pruebas: sin HTTPS ni manifest de collectstatic
+                stack.enter_context(
+                    override_settings(
+                        ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+                        SECURE_SSL_REDIRECT=False,
+                        STORAGES={
+                            **settings.STORAGES,
+                            "staticfiles": {"BACKEND": STATICFILES_BACKEND},
+                        },
+                    )
+                )
+                sessions = [self._session(user, aula.pk) for user, aula in users]
+            stats = self._run(aulas, users, sessions, options)
+
+        self._report(stats, options)
+
+    def _aulas(self, n):
+        """Las primeras aulas con productos, repetidas si hay más arcos que aulas."""
+        aulas = list(
+            Aula.objects.filter(productos__isnull=False).distinct().order_by("pk")[:n]
+        )
+        if not aulas:
+            raise CommandError(
+                "No hay aulas con productos (genera datos con seed_almacen)"
+            )
+        return aulas
+
+    def _users(self, n, aulas):
+        """(usuario, aula) con acceso, profesores primero."""
+        profesores = set(
+            User.objects.filter(groups__name=PROFESORES_GROUP).values_list(
+                "pk", flat=True
+            )
+        )
+        candidatos = []
+        for aula in aulas:
+            personas = (
+                Persona.objects.filter(aulas_access=aula)
+                .select_related("user")
+                .order_by("pk")
+            )
+            candidatos += [(p.user, aula) for p in personas[:n]]
+        candidatos.sort(key=lambda ua: ua[0].pk not in profesores)
+        if n and not candidatos:
+            staff = User.objects.filter(is_staff=True).first()
+            if staff is None:
+                raise CommandError("No hay usuarios con acceso a las aulas elegidas")
+            candidatos = [(staff, aula) for aula in aulas]
+        return [candidatos[i % len(candidatos)] for i in range(n)]
+
+    def _session(self, user, aula_id):
+        """Sesión iniciada con el aula actual elegida, como tras set_current_aula."""
+        store = import_module(settings.SESSION_ENGINE).SessionStore()
+        store[SESSION_KEY] = str(user.pk)
+        store[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        store[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        store["current_aula_id"] = aula_id
+        store.create()
+        return store.session_key
+
+    def _use_local_services(self, stack):
+        """Cachés locmem y eventos en memoria (local_redis.py) en lugar de Redis."""
+        stack.enter_context(override_settings(**local_services("loadtest-fleet")))
+
+    def _run(self, aulas, users, sessions, options):
+        stats = Stats()
+        broker = QueueBroker()
+        options["deadline"] = time.monotonic() + options["duration"]
+
+        productos = {
+            aula.pk: list(aula.productos.values_list("epc", flat=True))
+            for aula in aulas
+        }
+        llaveros = list(
+            Persona.objects.exclude(epc__isnull=True)
+            .exclude(epc="")
+            .values_list("epc", flat=True)[:500]
+        )
+        gates = [
+            Gate(
+                i + 1,
+                aulas[i % len(aulas)].pk,
+                llaveros,
+                productos[aulas[i % len(aulas)].pk],
+                broker,
+                stats,
+                options,
+            )
+            for i in range(options["gates"])
+        ]
+        producto_ids = {
+            aula.pk: list(aula.productos.values_list("pk", flat=True)) for aula in aulas
+        }
+        simulated = [
+            SimulatedUser(i + 1, session, producto_ids[aula.pk], stats, options)
+            for i, ((_, aula), session) in enumerate(zip(users, sessions))
+        ]
+
+        listener = ListenerThread(broker, stats, options)
+        listener.start()
+        for thread in gates + simulated:
+            thread.start()
+        for thread in gates + simulated:
+            thread.join()
+        # Sin lecturas nuevas: esperar a que se guarden los últimos lotes
+        listener.stop.set()
+        listener.join(timeout=options["batch_time"] + 30)
+        return stats
+
+    def _report(self, stats, options):
+        p50, p95, p99 = percentiles(stats.reading_latencies)
+        db50, db95, db99 = percentiles(stats.batch_seconds)
+        report = {
+            "gates": options["gates"],
+            "users": options["users"],
+            "duration": options["duration"],
+            "batch_time": options["batch_time"],
+            "readings": {
+                "published": stats.published,
+                "committed": len(stats.reading_latencies),
+                "pending": len(stats.pending),
+                "batches": len(stats.batch_seconds),
+                "max_backlog": stats.max_backlog,
+                "latency_ms": {"p50": p50, "p95": p95, "p99": p99},
+                "batch_db_ms": {"p50": db50, "p95": db95, "p99": db99},
+            },
+            "pages": {
+                name: dict(
+                    zip(("p50", "p95", "p99"), percentiles(values)),
+                    requests=len(values),
+                )
+                for name, values in sorted(stats.page_latencies.items())
+            },
+            "statuses": dict(sorted(stats.statuses.items())),
+            "lock_errors": dict(stats.lock_errors),
+            "errors": dict(stats.errors),
+        }
+
+        readings = report["readings"]
+        self.stdout.write(
+            f"{options['gates']} gates, {options['users']} users, "
+            f"{options['duration']:.0f}s: {readings['published']} readings published, "
+            f"{readings['committed']} committed in {readings['batches']} batches "
+            f"(max backlog {readings['max_backlog']} messages)"
+        )
+        self.stdout.write(
+            f"Reading → commit: p50 {p50:.0f} ms, p95 {p95:.0f} ms, p99 {p99:.0f} ms "
+            f"(batch time {options['batch_time']}s); DB per batch: p50 {db50:.1f} ms, "
+            f"p95 {db95:.1f} ms, p99 {db99:.1f} ms"
+        )
+        for name, page in report["pages"].items():
+            self.stdout.write(
+                f"{name}: {page['requests']} requests, p50 {page['p50']:.1f} ms, "
+                f"p95 {page['p95']:.1f} ms, p99 {page['p99']:.1f} ms"
+            )
+        self.stdout.write(f"Status: {report['statuses']}")
+        summary = (
+            f"DB lock errors: listener {stats.lock_errors['listener']}, "
+            f"users {stats.lock_errors['users']}; other errors: {report['errors']}"
+        )
+        failed = stats.lock_errors or stats.errors or stats.pending
+        self.stdout.write(
+            self.style.WARNING(summary) if failed else self.style.SUCCESS(summary)
+        )
+
+        if options["report"]:
+            with open(options["report"], "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report saved to {options['report']}")
@@ -0,0 +1,147 @@
+import asyncio
+import ssl
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Intervalo de sondeo de get_latest_epc en el formulario de producto
+POLL_INTERVAL_SECONDS = 5
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test for the polling endpoints: N concurrent keep-alive clients "
+        "against a running server (uWSGI or uvicorn). Reports throughput, "
+        "latency percentiles and polling clients served per core. "
+        "Usage: python manage.py loadtest_polling https://host/almacen/get-latest-epc/ "
+        "--cookie sessionid=... --clients 200 --duration 30 --cores 4"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("url", help="URL completa del endpoint (http o https)")
+        parser.add_argument("--clients", type=int, default=100)
+        parser.add_argument("--duration", type=float, default=30.0)
+        parser.add_argument(
+            "--cookie", default="", help="Cabecera Cookie (sessionid=...) de un usuario"
+        )
+        parser.add_argument(
+            "--cores",
+            type=int,
+            default=1,
+            help="Núcleos (procesos) del servidor probado, para la cifra por núcleo",
+        )
+        parser.add_argument(
+            "--unix", help="Conectar a este socket Unix en lugar de al host de la URL"
+        )
+        parser.add_argument(
+            "--insecure", action="store_true", help="No verificar el certificado TLS"
+        )
+
+    def handle(
+        self, url, *args, clients, duration, cookie, cores, unix, insecure, **kw
+    ):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise CommandError("La URL debe empezar por http:// o https://")
+        target = {
+            "host": parts.hostname,
+            "port": parts.port or (443 if parts.scheme == "https" else 80),
+            "unix": unix,
+            "ssl": self._ssl_context(insecure) if parts.scheme == "https" else None,
+        }
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        request = (
+            f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+            f"Cookie: {cookie}\r\nHX-Request: true\r\n"
+            "User-Agent: almacen-loadtest\r\n\r\n"
+        ).encode("latin-1")
+
+        latencies, statuses, errors = asyncio.run(
+            self._run(target, request, clients, duration)
+        )
+        self._report(latencies, statuses, errors, clients, duration, cores)
+
+    def _ssl_context(self, insecure):
+        context = ssl.create_default_context()
+        if insecure:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return context
+
+    async def _run(self, target, request, clients, duration):
+        latencies, statuses, errors = [], {}, []
+        deadline = time.monotonic() + duration
+
+        async def client():
+            reader = writer = None
+            while time.monotonic() < deadline:
+                try:
+                    if writer is None:
+                        reader, writer = await self._connect(target)
+                    start = time.perf_counter()
+                    writer.write(request)
+                    await writer.drain()
+                    status, close = await self._read_response(reader)
+                    latencies.append(time.perf_counter() - start)
+                    statuses[status] = statuses.get(status, 0) + 1
+                    if close:
+                        writer.close()
+                        writer = None
+                except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                    errors.append(e)
+                    writer = None
+                    await asyncio.sleep(0.1)
+            if writer is not None:
+                writer.close()
+
+        await asyncio.gather(*(client() for _ in range(clients)))
+        return latencies, statuses, errors
+
+    async def _connect(self, target):
+        if target["unix"]:
+            return await asyncio.open_unix_connection(target["unix"])
+        return await asyncio.open_connection(
+            target["host"], target["port"], ssl=target["ssl"]
+        )
+
+    async def _read_response(self, reader):
+        """Lee una respuesta HTTP/1.1 completa; devuelve (estado, cerrar)."""
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip().lower()
+        if headers.get("transfer-encoding") == "chunked":
+            while size := int((await reader.readline()).split(b";")[0], 16):
+                await reader.readexactly(size + 2)
+            await reader.readline()
+        elif length := int(headers.get("content-length", 0)):
+            await reader.readexactly(length)
+        return status, headers.get("connection") == "close"
+
+    def _report(self, latencies, statuses, errors, clients, duration, cores):
+        if not latencies:
+            raise CommandError(
+                f"Ninguna respuesta ({len(errors)} errores): {errors[:3]}"
+            )
+        rps = len(latencies) / duration
+        p50, p95, p99 = (
+            statistics.quantiles(latencies, n=100)[i] * 1000 for i in (49, 94, 98)
+        )
+        # Un formulario abierto sondea cada POLL_INTERVAL_SECONDS
+        per_core = rps * POLL_INTERVAL_SECONDS / cores
+        self.stdout.write(
+            f"{clients} clients, {len(latencies)} requests in {duration:.0f}s: "
+            f"{rps:.1f} req/s, p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms"
+        )
+        self.stdout.write(
+            f"Status: {dict(sorted(statuses.items()))}, connection errors: {len(errors)}"
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"≈ {per_core:.0f} polling clients (every {POLL_INTERVAL_SECONDS}s) "
+                f"served per core ({cores} cores)"
+            )
+        )
@@ -0,0 +1,74 @@
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the active database sessions into the session cache (Redis), so "
+        "switching SESSION_STORE to cache or cached_db logs nobody out. "
+        "Usage: python manage.py migrate_sessions [--clear]"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Borrar de la base de datos las sesiones copiadas (solo con 'cache')",
+        )
+
+    def handle(self, *args, clear, **kwargs):
+        start = time.monotonic()
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        prefix = getattr(store, "cache_key_prefix", None)
+        if prefix is None:
+            raise CommandError(
+                f"SESSION_ENGINE={settings.SESSION_ENGINE} no usa caché: "
+                "cambia SESSION_STORE a 'cache' o 'cached_db'"
+            )
+        if clear and settings.SESSION_STORE != "cache":
+            raise CommandError("--clear solo tiene sentido con SESSION_STORE=cache")
+        cache = caches[settings.SESSION_CACHE_ALIAS]
+
+        now = timezone.now()
+        Session.objects.filter(expire_date__lte=now).delete()
+        # La caché caduca cuando lo haría la sesión: se agrupan por segundos
+        # restantes para hacer un set_many por grupo y bloque
+        copied = 0
+        pending = {}
+        sessions = Session.objects.filter(expire_date__gt=now).iterator(
+            chunk_size=CHUNK_SIZE
+        )
+        for session in sessions:
+            timeout = int((session.expire_date - now).total_seconds())
+            group = pending.setdefault(timeout, {})
+            group[prefix + session.session_key] = session.get_decoded()
+            if len(group) >= CHUNK_SIZE:
+                copied += self._flush(cache, timeout, pending.pop(timeout))
+        for timeout, group in pending.items():
+            copied += self._flush(cache, timeout, group)
+
+        deleted = 0
+        if clear:
+            deleted, _ = Session.objects.all().delete()
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Copied {copied} sessions to cache '{settings.SESSION_CACHE_ALIAS}' "
+                f"({deleted} deleted from the database) in {elapsed:.2f}s"
+            )
+        )
+
+    def _flush(self, cache, timeout, group):
+        failed = cache.set_many(group, timeout)
+        if failed:
+            raise CommandError(f"No se han podido guardar {len(failed)} sesiones")
+        return len(group)
@@ -0,0 +1,79 @@
+import logging
+
+import redis
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from almacen.ingest import add_reading, get_ingest_redis
+from almacen.management.commands import mqtt_listener
+from almacen.management.commands.mqtt_listener import (
+    MQTT_BROKER,
+    MQTT_PASSWORD,
+    MQTT_PORT,
+    MQTT_USER,
+    RecuentoCollector,
+    build_flood_guard,
+    parse_reading,
+    setup_logging,
+)
+from almacen.mqtt_transport import PahoTransport
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Añade las lecturas RFID de MQTT a los streams de Redis que procesan "
+        "los ingest_worker (ver almacen/ingest.py)."
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.flood_guard = build_flood_guard()
+
+    def handle(self, *args, **options):
+        setup_logging("mqtt-bridge")
+        logger.info(
+            "Iniciando el puente MQTT → Redis Streams (%d particiones)...",
+            settings.INGEST_PARTITIONS,
+        )
+
+        transport = PahoTransport(MQTT_BROKER, MQTT_PORT, MQTT_USER, MQTT_PASSWORD)
+        try:
+            self.start(transport, get_ingest_redis())
+            self.serve(transport)
+        except KeyboardInterrupt:
+            logger.info("Puente detenido por el usuario")
+        except Exception as e:
+            logger.error("Error de conexión MQTT: %s", e)
+
+    def start(self, transport, client):
+        """Se conecta con el transporte MQTT; client es el Redis de los streams."""
+        self.client = client
+        # Solo para no limitar las aulas en recuento; las lecturas no se anotan
+        self.recuentos = RecuentoCollector()
+        self.recuentos.refresh()
+        transport.connect(self.on_connect, self.on_message)
+
+    def serve(self, transport, stop=None):
+        """Como mqtt_listener.Command.serve, sin batches que vigilar."""
+        while not (stop is not None and stop.is_set() and not transport.pending()):
+            transport.loop(1.0)
+            self.recuentos.refresh()
+
+    on_connect = mqtt_listener.Command.on_connect
+    within_limits = mqtt_listener.Command.within_limits
+
+    def on_message(self, client, userdata, msg):
+        """
+        Decodifica la lectura, aplica los límites por lector y por aula y la
+        añade a su stream. De la BD solo lee los recuentos abiertos.
+        """
+        try:
+            reading = parse_reading(msg)
+            if reading is not None and self.within_limits(reading[0], msg.topic):
+                add_reading(self.client, *reading, msg.topic)
+        except redis.RedisError as e:
+            logger.error("No se pudo añadir la lectura al stream: %s", e)
+        except Exception as e:
+            logger.exception("Error inesperado procesando mensaje MQTT: %s", e)
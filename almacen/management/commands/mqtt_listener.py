@@ -1,17 +1,28 @@
 import json
 import logging
 import os
+import time
 from collections import defaultdict
 from datetime import datetime, timedelta
-from logging.handlers import RotatingFileHandler
 
-import paho.mqtt.client as mqtt
-from django.core.cache import caches
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.db import DatabaseError
 from django.utils import timezone
 
-from almacen.models import Aula, Persona, Prestamo, Producto
+from almacen.diagnostics import install_signal_handlers
+from almacen.events import (
+    LATEST_EPC_KEY_FORMAT,
+    get_epc_cache,
+    publish_epc,
+    publish_producto_change,
+)
+from almacen.flood_guard import FloodGuard
+from almacen.log_pipeline import start_queue_logging
+from almacen.models import Aula, Persona, Producto
+from almacen.mqtt_transport import PahoTransport
+from almacen.perf import query_budget
+from almacen.prestamos import toggle
+from almacen.recuentos import guardar_lecturas, recuentos_abiertos
 
 # --- Configuración del Broker ---
 MQTT_BROKER = os.getenv("MQTT_BROKER", "localhost")
@@ -24,64 +35,137 @@ MQTT_TOPIC_READINGS = "rfid/lectura"
 # --- Configuración de Batch ---
 BATCH_TIME_SECONDS = int(os.getenv("BATCH_TIME_SECONDS", 5))
 
+# --- Protección frente a lectores que inundan (almacen/flood_guard.py) ---
+# Lecturas por segundo sostenidas y ráfaga por lector (rfid/lectura/<id>) y
+# por aula; 0 desactiva el límite
+FLOOD_READER_RATE = float(os.getenv("FLOOD_READER_RATE", 20))
+FLOOD_READER_BURST = int(os.getenv("FLOOD_READER_BURST", 100))
+FLOOD_AULA_RATE = float(os.getenv("FLOOD_AULA_RATE", 50))
+FLOOD_AULA_BURST = int(os.getenv("FLOOD_AULA_BURST", 200))
+# Por encima del límite pasa una de cada N lecturas
+FLOOD_SAMPLE_EVERY = int(os.getenv("FLOOD_SAMPLE_EVERY", 10))
+# Un lector por encima del límite durante estos segundos queda en cuarentena
+FLOOD_QUARANTINE_AFTER_SECONDS = float(os.getenv("FLOOD_QUARANTINE_AFTER_SECONDS", 10))
+FLOOD_QUARANTINE_SECONDS = float(os.getenv("FLOOD_QUARANTINE_SECONDS", 60))
+
+# --- Configuración de recuentos ---
+# Cada cuánto se consultan los recuentos abiertos (una consulta, no una por lectura)
+RECUENTO_REFRESH_SECONDS = float(os.getenv("RECUENTO_REFRESH_SECONDS", 1))
+
 # --- Configuración de Redis/Caché ---
 CACHE_TIMEOUT_SECONDS = int(os.getenv("CACHE_TIMEOUT_SECONDS", 35))
-CACHE_KEY_FORMAT = "last_epc:{}"
+CACHE_KEY_FORMAT = LATEST_EPC_KEY_FORMAT
 
-try:
-    epc_cache = caches["epc_cache"]
-except KeyError:
-    epc_cache = caches["default"]
+# --- Logging (almacen/log_pipeline.py) ---
+# "json" para una línea JSON por registro
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Máximo de mensajes INFO iguales (p. ej. uno por lectura) por minuto; 0 = sin límite
+LOG_RATE_PER_MINUTE = int(os.getenv("LOG_RATE_PER_MINUTE", 120))
 
+# --- Diagnóstico (almacen/diagnostics.py) ---
+# kill -USR1 <pid>: perfil por muestreo durante estos segundos
+PROFILER_SECONDS = float(os.getenv("PROFILER_SECONDS", 30))
 
-# Configurar logging con rotación
-def setup_logging():
-    """Configura logging con rotación de archivos. Funciona en Linux y Windows."""
 
+def get_log_file(name="mqtt-listener"):
+    """Ruta del log del proceso. Funciona en Linux y Windows."""
     # En Linux/Unix, intentar usar /var/log
     if os.path.exists("/var/log") and os.access("/var/log", os.W_OK):
-        log_file = "/var/log/mqtt-listener.log"
-    else:
-        # Fallback: usar el directorio actual
-        log_dir = os.path.join(os.getcwd(), "logs")
-        log_file = os.path.join(log_dir, "mqtt-listener.log")
-
-    if "log_dir" in locals():
-        os.makedirs(log_dir, exist_ok=True)
-    else:
-        # Para /var/log, el directorio ya debería existir
-        os.makedirs(os.path.dirname(log_file), exist_ok=True)
-
-    # Configurar handler con rotación
-    handler = RotatingFileHandler(
+        return f"/var/log/{name}.log"
+    # Fallback: usar el directorio actual
+    return os.path.join(os.getcwd(), "logs", f"{name}.log")
+
+
+def setup_logging(name="mqtt-listener"):
+    """
+    Logging del listener (ver almacen/log_pipeline.py): el fichero con
+    rotación lo escribe un hilo aparte, nunca las callbacks MQTT, y cada
+    línea se escribe una sola vez. Los mensajes por lectura se limitan a
+    LOG_RATE_PER_MINUTE por tipo de mensaje.
+    """
+    log_file = get_log_file(name)
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    start_queue_logging(
         log_file,
-        maxBytes=5 * 1024 * 1024,  # 5 MB por archivo
-        backupCount=5,  # Mantener 5 archivos de backup
-        encoding="utf-8",
+        json_format=LOG_FORMAT == "json",
+        rate_per_minute=LOG_RATE_PER_MINUTE,
     )
+    # Mostrar información sobre dónde se están guardando los logs
+    logger.info("Logging configured. Log file: %s", log_file)
+
+
+logger = logging.getLogger(__name__)
+
 
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+def build_flood_guard():
+    """FloodGuard con los límites de las variables de entorno FLOOD_*."""
+    return FloodGuard(
+        FLOOD_READER_RATE,
+        FLOOD_READER_BURST,
+        FLOOD_AULA_RATE,
+        FLOOD_AULA_BURST,
+        sample_every=FLOOD_SAMPLE_EVERY,
+        quarantine_after=FLOOD_QUARANTINE_AFTER_SECONDS,
+        quarantine_seconds=FLOOD_QUARANTINE_SECONDS,
     )
-    handler.setFormatter(formatter)
 
-    # Configurar el logger
-    logger = logging.getLogger(__name__)
-    logger.setLevel(logging.INFO)
-    logger.addHandler(handler)
 
-    # También configurar el logger raíz para capturar todo
-    root_logger = logging.getLogger()
-    root_logger.setLevel(logging.INFO)
-    root_logger.addHandler(handler)
+def reader_id(topic):
+    """El <id> de rfid/lectura/<id>."""
+    return topic.rsplit("/", 1)[-1]
 
-    # Mostrar información sobre dónde se están guardando los logs
-    logger.info(f"Logging configured. Log file: {log_file}")
 
-    return logger
+def parse_reading(msg):
+    """
+    Decodifica un mensaje de rfid/lectura/<id>. Devuelve (aula_id, epc,
+    leido_en) o None si no es una lectura válida (el motivo queda en el log).
+    """
+    payload_str = msg.payload.decode("utf-8")
+    if MQTT_TOPIC_READINGS not in msg.topic:
+        # rfid/pantalla/<id> llega con cada etiqueta: no es un aviso
+        logger.debug(
+            "Mensaje recibido: %s en topic no usado para EPC: %s",
+            payload_str,
+            msg.topic,
+        )
+        return None
+
+    try:
+        data = json.loads(payload_str)
+    except json.JSONDecodeError:
+        logger.error(
+            "Error decodificando JSON en el mensaje del topic %s. Payload: %s...",
+            msg.topic,
+            payload_str[:50],
+        )
+        return None
+
+    # Extraer los campos esperados del JSON
+    aula_id = data.get("aula_id")
+    epc = data.get("epc")
+    timestamp_str = data.get("timestamp")
+
+    if not all([aula_id, epc, timestamp_str]):
+        logger.warning(
+            "Campos clave (aula_id, epc, timestamp) faltantes en el payload "
+            "JSON: %s (Topic: %s)",
+            data,
+            msg.topic,
+        )
+        return None
 
+    # Convertir el timestamp ISO 8601 a un objeto datetime aware de Django
+    try:
+        # El formato es '2025-10-07T10:30:00'. fromisoformat maneja esto.
+        leido_en = datetime.fromisoformat(timestamp_str)
+        # Si el timestamp no incluye zona horaria (como en el ejemplo), asumimos UTC o la configuración de Django
+        if leido_en.tzinfo is None or leido_en.tzinfo.utcoffset(leido_en) is None:
+            leido_en = timezone.make_aware(leido_en)
+    except ValueError:
+        logger.error("Formato de timestamp ('%s') inválido.", timestamp_str)
+        return None
 
-logger = setup_logging()
+    return aula_id, epc, leido_en
 
 
 class BatchProcessor:
@@ -102,7 +186,11 @@ class BatchProcessor:
         self.last_epc_time[aula_id] = timestamp
 
         logger.debug(
-            f"EPC '{epc}' agregado al batch del Aula {aula_id}. Total en batch: {len(self.batches[aula_id])}"
+            "EPC '%s' agregado al batch del Aula %s. Total en batch: %d",
+            epc,
+            aula_id,
+            len(self.batches[aula_id]),
+            extra={"aula_id": aula_id, "epc": epc},
         )
 
     def check_and_process_batches(self):
@@ -127,12 +215,17 @@ class BatchProcessor:
         if not batch:
             return
 
-        logger.info(f"Procesando batch para Aula {aula_id} con {len(batch)} lecturas")
+        logger.info(
+            "Procesando batch para Aula %s con %d lecturas",
+            aula_id,
+            len(batch),
+            extra={"aula_id": aula_id},
+        )
 
         try:
             self._process_batch_logic(aula_id, batch)
         except Exception as e:
-            logger.exception(f"Error procesando batch para Aula {aula_id}: {e}")
+            logger.exception("Error procesando batch para Aula %s: %s", aula_id, e)
         finally:
             # Siempre limpiar el batch después de procesarlo
             if aula_id in self.batches:
@@ -140,6 +233,7 @@ class BatchProcessor:
             if aula_id in self.last_epc_time:
                 del self.last_epc_time[aula_id]
 
+    @query_budget(11)
     def _process_batch_logic(self, aula_id, batch):
         """Lógica principal para procesar el batch."""
         # Extraer EPCs únicos y usar el timestamp más reciente para cada uno
@@ -149,23 +243,26 @@ class BatchProcessor:
                 epc_dict[epc] = timestamp
 
         epcs = list(epc_dict.keys())
-        logger.info(f"EPCs únicos en batch: {epcs}")
+        logger.info("EPCs únicos en batch: %s", epcs, extra={"aula_id": aula_id})
 
-        # Buscar Persona en el batch
+        # Buscar Persona en el batch (una consulta; gana la primera leída)
         persona = None
         persona_epc = None
-
+        personas = {
+            p.epc: p
+            for p in Persona.objects.select_related("user").filter(epc__in=epcs)
+        }
         for epc in epcs:
-            try:
-                persona_obj = Persona.objects.select_related("user").get(epc=epc)
-                persona = persona_obj.user
+            if epc in personas:
+                persona = personas[epc].user
                 persona_epc = epc
                 logger.info(
-                    f"Persona encontrada: {persona.get_full_name() or persona.email} (EPC: {epc})"
+                    "Persona encontrada: %s (EPC: %s)",
+                    persona.get_full_name() or persona.email,
+                    epc,
+                    extra={"aula_id": aula_id, "epc": epc},
                 )
                 break
-            except Persona.DoesNotExist:
-                continue
 
         # Separar EPCs de productos
         producto_epcs = [epc for epc in epcs if epc != persona_epc]
@@ -175,147 +272,207 @@ class BatchProcessor:
             aula = Aula.objects.get(pk=aula_id)
             operation_mode = aula.operation_mode
         except Aula.DoesNotExist:
-            logger.error(f"Aula con ID {aula_id} no encontrada en la BD")
+            logger.error("Aula con ID %s no encontrada en la BD", aula_id)
             return
 
         # Validar que hay una persona si hay productos (solo en modo WITH_PERSONA)
         if producto_epcs and not persona and operation_mode == "WITH_PERSONA":
             logger.error(
-                f"Batch en Aula {aula_id} ({aula.nombre}) contiene {len(producto_epcs)} productos "
-                f"pero NO se detectó ninguna Persona. EPCs: {producto_epcs}"
+                "Batch en Aula %s (%s) contiene %d productos "
+                "pero NO se detectó ninguna Persona. EPCs: %s",
+                aula_id,
+                aula.nombre,
+                len(producto_epcs),
+                producto_epcs,
+                extra={"aula_id": aula_id},
             )
             return
 
         # En modo WITHOUT_PERSONA, advertir si hay productos sin persona pero continuar
         if producto_epcs and not persona and operation_mode == "WITHOUT_PERSONA":
             logger.warning(
-                f"Batch en Aula {aula_id} ({aula.nombre}) contiene {len(producto_epcs)} productos "
-                f"sin Persona detectada. Procesando en modo WITHOUT_PERSONA."
+                "Batch en Aula %s (%s) contiene %d productos "
+                "sin Persona detectada. Procesando en modo WITHOUT_PERSONA.",
+                aula_id,
+                aula.nombre,
+                len(producto_epcs),
+                extra={"aula_id": aula_id},
             )
 
         if not producto_epcs:
             logger.info("Batch solo contiene Persona, no hay productos para procesar.")
             return
 
-        # Procesar cada producto
-        for epc in producto_epcs:
-            timestamp = epc_dict[epc]
-            self._process_producto_epc(aula_id, epc, timestamp, persona)
+        # Préstamos y devoluciones de todo el batch en una sola operación
+        self._process_productos(aula_id, producto_epcs, max(epc_dict.values()), persona)
 
     def _process_producto_epc(self, aula_id, epc, timestamp, persona):
         """Procesa un EPC de producto individual."""
-        try:
-            producto = Producto.objects.select_related("aula").get(epc=epc)
-        except Producto.DoesNotExist:
+        self._process_productos(aula_id, [epc], timestamp, persona)
+
+    def _process_productos(self, aula_id, epcs, timestamp, persona):
+        """
+        Devuelve los productos leídos que estaban prestados y presta el resto
+        a persona (ver almacen/prestamos.py). Consultas constantes por batch.
+        """
+        productos = list(Producto.objects.filter(epc__in=epcs))
+        for epc in sorted(set(epcs) - {p.epc for p in productos}):
             logger.warning(
-                f"EPC '{epc}' no encontrado ni en Producto ni en Persona. "
-                f"Aula ID: {aula_id}, Timestamp: {timestamp}"
+                "EPC '%s' no encontrado ni en Producto ni en Persona. "
+                "Aula ID: %s, Timestamp: %s",
+                epc,
+                aula_id,
+                timestamp,
+                extra={"aula_id": aula_id, "epc": epc},
             )
+        if not productos:
             return
 
-        # Validar aula del producto
-        if producto.aula_id != aula_id:  # type: ignore[attr-defined]
-            logger.warning(
-                f"Producto '{producto.nombre}' (EPC: {epc}) está registrado en "
-                f"Aula '{producto.aula.nombre}' pero fue detectado en Aula ID {aula_id}. "
-                f"Actualizando ubicación..."
-            )
+        # Validar aula de los productos
+        movidos = [
+            p for p in productos if str(p.aula_id) != str(aula_id)  # type: ignore[attr-defined]
+        ]
+        if movidos:
             try:
                 nueva_aula = Aula.objects.get(pk=aula_id)
-                producto.aula = nueva_aula
-                producto.save(update_fields=["aula"])
-                logger.info(
-                    f"Producto '{producto.nombre}' movido a Aula '{nueva_aula.nombre}'"
-                )
             except Aula.DoesNotExist:
-                logger.error(f"Aula con ID {aula_id} no existe en la BD")
+                logger.error("Aula con ID %s no existe en la BD", aula_id)
                 return
-
-        # Buscar préstamo activo (no devuelto)
-        prestamo_activo = Prestamo.objects.filter(
-            producto=producto, devuelto_en__isnull=True
-        ).first()
-
-        with transaction.atomic():
-            # Obtener o crear la Ubicacion para este producto
-            from almacen.models import Ubicacion
-
-            ubicacion, created = Ubicacion.objects.get_or_create(producto=producto)
-
-            if prestamo_activo:
-                # DEVOLUCIÓN: El producto está prestado, marcar como devuelto
-                prestamo_activo.devuelto_en = timestamp
-                prestamo_activo.save(update_fields=["devuelto_en"])
-
-                # Actualizar Ubicacion: producto vuelve al estante
-                ubicacion.estado = "ESTANTE"
-                ubicacion.aula = producto.aula
-                ubicacion.estanteria = producto.estanteria
-                ubicacion.posicion = producto.posicion
-                ubicacion.persona = None
-                ubicacion.tomado_en = None
-                ubicacion.save(
-                    update_fields=[
-                        "estado",
-                        "aula",
-                        "estanteria",
-                        "posicion",
-                        "persona",
-                        "tomado_en",
-                    ]
+            for producto in movidos:
+                aula_original_id = producto.aula_id  # type: ignore[attr-defined]
+                logger.warning(
+                    "Producto '%s' (EPC: %s) está registrado en Aula ID %s pero fue "
+                    "detectado en Aula '%s'. Actualizando ubicación...",
+                    producto.nombre,
+                    producto.epc,
+                    aula_original_id,
+                    nueva_aula.nombre,
+                    extra={"aula_id": aula_id, "epc": producto.epc},
                 )
+                producto.aula = nueva_aula
+                producto.save(update_fields=["aula"])
+                # La página del aula de origen también debe quitar la fila
+                publish_producto_change(producto.pk, aula_original_id)
 
-                usuario_nombre = (
-                    prestamo_activo.usuario.get_full_name()
-                    or prestamo_activo.usuario.email
-                    if prestamo_activo.usuario
-                    else "desconocido"
-                )
-                logger.info(
-                    f"✓ DEVOLUCIÓN: '{producto.nombre}' devuelto por "
-                    f"{usuario_nombre} a {timestamp.strftime('%H:%M:%S')}"
-                )
-            else:
-                # PRÉSTAMO: El producto no está prestado, crear nuevo préstamo
-                # En modo WITHOUT_PERSONA, persona puede ser None
-                Prestamo.objects.create(
-                    producto=producto, usuario=persona, tomado_en=timestamp
-                )
+        prestados, devueltos = toggle(productos, persona, timestamp)
 
-                # Actualizar Ubicacion: producto tomado por persona
-                ubicacion.estado = "PERSONA"
-                ubicacion.persona = persona
-                ubicacion.tomado_en = timestamp
-                ubicacion.aula = None
-                ubicacion.estanteria = ""
-                ubicacion.posicion = ""
-                ubicacion.save(
-                    update_fields=[
-                        "estado",
-                        "persona",
-                        "tomado_en",
-                        "aula",
-                        "estanteria",
-                        "posicion",
-                    ]
-                )
+        # Un mensaje por producto: se compone solo si el nivel INFO está activo
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        por_pk = {p.pk: p for p in productos}
+        hora = timestamp.strftime("%H:%M:%S")
+        for pk in devueltos:
+            producto = por_pk[pk]
+            logger.info(
+                "✓ DEVOLUCIÓN: '%s' devuelto a %s",
+                producto.nombre,
+                hora,
+                # Auditoría de cada devolución y préstamo: sin límite por minuto
+                extra={"aula_id": aula_id, "epc": producto.epc, "rate_limit": False},
+            )
+        usuario_nombre = (
+            persona.get_full_name() or persona.email
+            if persona
+            else "(sin persona identificada)"
+        )
+        for pk in prestados:
+            producto = por_pk[pk]
+            logger.info(
+                "✓ PRÉSTAMO: '%s' tomado por %s a %s",
+                producto.nombre,
+                usuario_nombre,
+                hora,
+                extra={"aula_id": aula_id, "epc": producto.epc, "rate_limit": False},
+            )
 
-                if persona:
-                    usuario_nombre = persona.get_full_name() or persona.email
-                    logger.info(
-                        f"✓ PRÉSTAMO: '{producto.nombre}' tomado por "
-                        f"{usuario_nombre} a {timestamp.strftime('%H:%M:%S')}"
-                    )
-                else:
-                    logger.info(
-                        f"✓ PRÉSTAMO: '{producto.nombre}' tomado (sin persona identificada) "
-                        f"a {timestamp.strftime('%H:%M:%S')}"
-                    )
+
+class RecuentoCollector:
+    """
+    Acumula los EPC leídos en aulas con un recuento abierto (ver recuentos.py).
+
+    Cada EPC distinto se guarda una sola vez por recuento: las lecturas
+    repetidas se descartan en memoria y las nuevas se escriben en un único
+    INSERT en cada flush().
+    """
+
+    def __init__(self, refresh_seconds=RECUENTO_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.abiertos = {}  # {aula_id: recuento_id}
+        self.guardados = defaultdict(set)  # {recuento_id: EPCs ya en la BD}
+        self.pendientes = defaultdict(set)  # {recuento_id: EPCs por guardar}
+        self.last_refresh = None
+
+    def refresh(self):
+        """Relee los recuentos abiertos si ha pasado el intervalo."""
+        now = time.monotonic()
+        if self.last_refresh is not None and (
+            now - self.last_refresh < self.refresh_seconds
+        ):
+            return
+        self.last_refresh = now
+        try:
+            abiertos = recuentos_abiertos()
+        except DatabaseError as e:
+            logger.error("No se pudieron leer los recuentos abiertos: %s", e)
+            return
+        for aula_id in abiertos.keys() - self.abiertos.keys():
+            logger.info(
+                "Recuento %s iniciado en Aula %s",
+                abiertos[aula_id],
+                aula_id,
+                extra={"aula_id": aula_id, "recuento_id": abiertos[aula_id]},
+            )
+        for aula_id in self.abiertos.keys() - abiertos.keys():
+            recuento_id = self.abiertos[aula_id]
+            logger.info(
+                "Recuento %s finalizado en Aula %s: %d EPC distintos",
+                recuento_id,
+                aula_id,
+                len(self.guardados[recuento_id]),
+                extra={"aula_id": aula_id, "recuento_id": recuento_id},
+            )
+            self.guardados.pop(recuento_id, None)
+        self.abiertos = abiertos
+
+    def en_recuento(self, aula_id):
+        return str(aula_id) in self.abiertos
+
+    def add_epc(self, aula_id, epc):
+        """
+        Anota el EPC si el aula tiene un recuento abierto. Devuelve False si
+        no lo tiene y la lectura debe seguir el proceso normal de préstamos.
+        """
+        recuento_id = self.abiertos.get(str(aula_id))
+        if recuento_id is None:
+            return False
+        if epc not in self.guardados[recuento_id]:
+            self.pendientes[recuento_id].add(epc)
+        return True
+
+    def flush(self):
+        """Guarda los EPC nuevos y actualiza la lista de recuentos abiertos."""
+        if self.pendientes:
+            pendientes, self.pendientes = self.pendientes, defaultdict(set)
+            try:
+                guardar_lecturas(pendientes)
+            except DatabaseError as e:
+                logger.error("Error guardando lecturas de recuento: %s", e)
+                # Se reintentan en el siguiente flush
+                for recuento_id, epcs in pendientes.items():
+                    self.pendientes[recuento_id] |= epcs
+            else:
+                for recuento_id, epcs in pendientes.items():
+                    self.guardados[recuento_id] |= epcs
+        self.refresh()
 
 
 class Command(BaseCommand):
     help = "Escucha mensajes MQTT para EPC de RFID con proceso por lotes."
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.flood_guard = build_flood_guard()
+
     def add_arguments(self, parser):
         parser.add_argument(
             "--batch-time",
@@ -334,103 +491,113 @@ class Command(BaseCommand):
         batch_time = options["batch_time"]
         check_interval = options["check_interval"]
 
+        setup_logging()
         logger.info(
-            f"Iniciando el listener MQTT con batch time de {batch_time} segundos..."
+            "Iniciando el listener MQTT con batch time de %s segundos...", batch_time
         )
 
-        self.batch_processor = BatchProcessor(batch_time)
-
-        client = mqtt.Client()
-        if MQTT_USER and MQTT_PASSWORD:
-            client.username_pw_set(MQTT_USER, MQTT_PASSWORD)
-        client.on_connect = self.on_connect
-        client.on_message = self.on_message
+        # Perfil y memoria bajo demanda, junto al log
+        install_signal_handlers(
+            os.path.dirname(get_log_file()), "mqtt-listener", PROFILER_SECONDS
+        )
 
+        transport = PahoTransport(MQTT_BROKER, MQTT_PORT, MQTT_USER, MQTT_PASSWORD)
         try:
-            client.connect(MQTT_BROKER, MQTT_PORT, 60)
-            # Usar loop con timeout para poder verificar batches periódicamente
-            while True:
-                client.loop(timeout=check_interval)
-                self.batch_processor.check_and_process_batches()
+            self.start(transport, BatchProcessor(batch_time))
+            self.serve(transport, check_interval)
         except KeyboardInterrupt:
             logger.info("Listener detenido por el usuario")
         except Exception as e:
-            logger.error(f"Error de conexión MQTT: {e}")
+            logger.error("Error de conexión MQTT: %s", e)
+
+    def start(self, transport, batch_processor):
+        """
+        Prepara el listener y se conecta con el transporte (PahoTransport o,
+        en pruebas, mqtt_transport.QueueTransport).
+        """
+        self.batch_processor = batch_processor
+        self.recuentos = RecuentoCollector()
+        self.recuentos.refresh()
+        transport.connect(self.on_connect, self.on_message)
+
+    def serve(self, transport, check_interval, stop=None):
+        """
+        Bucle principal. Sin stop no termina nunca; con stop (threading.Event),
+        una vez activado termina cuando no quedan mensajes ni batches.
+        """
+        while not (
+            stop is not None
+            and stop.is_set()
+            and not transport.pending()
+            and not self.batch_processor.batches
+        ):
+            # Usar loop con timeout para poder verificar batches periódicamente
+            transport.loop(check_interval)
+            self.recuentos.flush()
+            self.batch_processor.check_and_process_batches()
 
     def on_connect(self, client, userdata, flags, rc):
         """Callback al conectarse al broker."""
         if rc == 0:
             logger.info("Conectado al broker MQTT.")
             client.subscribe(MQTT_TOPIC)
-            logger.info(f"Suscrito al tema: {MQTT_TOPIC}")
+            logger.info("Suscrito al tema: %s", MQTT_TOPIC)
         else:
-            logger.error(f"Conexión fallida con código {rc}")
+            logger.error("Conexión fallida con código %s", rc)
 
     def on_message(self, client, userdata, msg):
         """Callback al recibir un mensaje. Espera un payload JSON."""
         try:
-            payload_str = msg.payload.decode("utf-8")
-            if MQTT_TOPIC_READINGS not in msg.topic:
-                logger.warning(
-                    f"Mensaje recibido: {payload_str} en topic no usado para EPC: {msg.topic}"
-                )
-                return
-
-            try:
-                data = json.loads(payload_str)
-            except json.JSONDecodeError:
-                logger.error(
-                    f"Error decodificando JSON en el mensaje del topic {msg.topic}. "
-                    f"Payload: {payload_str[:50]}..."
-                )
-                return
-
-            # Extraer los campos esperados del JSON
-            aula_id = data.get("aula_id")
-            epc = data.get("epc")
-            timestamp_str = data.get("timestamp")
-
-            if not all([aula_id, epc, timestamp_str]):
-                logger.warning(
-                    f"Campos clave (aula_id, epc, timestamp) faltantes en el payload JSON: "
-                    f"{data} (Topic: {msg.topic})"
-                )
-                return
-
-            # Convertir el timestamp ISO 8601 a un objeto datetime aware de Django
-            try:
-                # El formato es '2025-10-07T10:30:00'. fromisoformat maneja esto.
-                leido_en = datetime.fromisoformat(timestamp_str)
-                # Si el timestamp no incluye zona horaria (como en el ejemplo), asumimos UTC o la configuración de Django
-                if (
-                    leido_en.tzinfo is None
-                    or leido_en.tzinfo.utcoffset(leido_en) is None
-                ):
-                    leido_en = timezone.make_aware(leido_en)
-            except ValueError:
-                logger.error(f"Formato de timestamp ('{timestamp_str}') inválido.")
-                return
-
-            # Validar la existencia del Aula
-            try:
-                Aula.objects.get(pk=aula_id)
-            except Aula.DoesNotExist:
-                logger.error(
-                    f"Aula con ID {aula_id} no encontrada en la BD "
-                    f"(Reportada por {msg.topic})."
-                )
-                return
-
-            # Almacenamiento en caché de Django
-            cache_key = CACHE_KEY_FORMAT.format(aula_id)
-            data_to_cache = {
-                "epc": epc,
-                "leido_en": leido_en,
-            }
-            epc_cache.set(cache_key, data_to_cache, timeout=CACHE_TIMEOUT_SECONDS)
-
-            # Agregar al batch processor
-            self.batch_processor.add_epc(aula_id, epc, leido_en)
-
+            reading = parse_reading(msg)
+            if reading is not None and self.within_limits(reading[0], msg.topic):
+                self.process_reading(*reading, msg.topic)
         except Exception as e:
-            logger.exception(f"Error inesperado procesando mensaje MQTT: {e}")
+            logger.exception("Error inesperado procesando mensaje MQTT: %s", e)
+
+    def within_limits(self, aula_id, topic):
+        """
+        False si el lector o el aula superan su límite (almacen/flood_guard.py).
+        Solo se aplica a las lecturas en vivo de MQTT: las de un stream
+        (ingest_worker) pueden llegar de golpe al vaciar una cola atrasada.
+        Las aulas en recuento no se limitan: el barrido envía cientos de EPC.
+        """
+        if self.recuentos.en_recuento(aula_id):
+            return True
+        guard = self.flood_guard
+        return guard.allow_reader(reader_id(topic)) and guard.allow_aula(aula_id)
+
+    def process_reading(self, aula_id, epc, leido_en, topic):
+        """
+        Anota la lectura en el recuento del aula o, si no hay recuento, la
+        guarda en caché, la publica y la añade al batch del aula. Devuelve
+        True si la lectura ha quedado en un batch.
+        """
+        # Aula en recuento: solo se anota el EPC, sin consultas ni préstamos
+        if self.recuentos.add_epc(aula_id, epc):
+            return False
+
+        # Validar la existencia del Aula
+        try:
+            Aula.objects.get(pk=aula_id)
+        except Aula.DoesNotExist:
+            logger.error(
+                "Aula con ID %s no encontrada en la BD (Reportada por %s).",
+                aula_id,
+                topic,
+                extra={"aula_id": aula_id, "epc": epc},
+            )
+            return False
+
+        # Almacenamiento en caché de Django (producto_create y get_latest_epc)
+        cache_key = CACHE_KEY_FORMAT.format(aula_id)
+        data_to_cache = {
+            "epc": epc,
+            "leido_en": leido_en,
+        }
+        get_epc_cache().set(cache_key, data_to_cache, timeout=CACHE_TIMEOUT_SECONDS)
+        # Aviso inmediato a los formularios abiertos (SSE)
+        publish_epc(aula_id, epc, leido_en)
+
+        # Agregar al batch processor
+        self.batch_processor.add_epc(aula_id, epc, leido_en)
+        return True
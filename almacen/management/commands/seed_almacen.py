@@ -0,0 +1,382 @@
+import math
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from almacen.access import PROFESORES_GROUP
+from almacen.conditional import bump_aula_versions
+from almacen.models import Aula, Persona, Prestamo, Producto, Ubicacion
+
+AULA_PREFIX = "Seed"
+USERNAME_PREFIX = "seed"
+EMAIL_DOMAIN = "seed.example.com"
+
+# SGTIN-96 (productos) y GID-96 (llaveros de las personas), en hexadecimal
+SGTIN96_HEADER = 0x30
+SGTIN96_FILTER = 1  # artículo de punto de venta
+SGTIN96_PARTITION = 5  # prefijo de empresa de 7 dígitos (24 bits), referencia de 20
+COMPANY_PREFIX = 8412345
+GID96_HEADER = 0x35
+GID96_MANAGER = 0x0A1B2C3
+GID96_CLASS = 0x000101
+
+CATALOGO = [
+    "Multímetro digital",
+    "Osciloscopio",
+    "Fuente de alimentación",
+    "Soldador",
+    "Estación de soldadura",
+    "Portátil",
+    "Raspberry Pi 4",
+    "Arduino Uno",
+    "Taladro percutor",
+    "Atornillador",
+    "Pinza amperimétrica",
+    "Generador de señales",
+    "Crimpadora RJ45",
+    "Comprobador de red",
+    "Switch 24 puertos",
+    "Router",
+    "Cámara IP",
+    "Proyector",
+    "Kit de sensores",
+    "Analizador lógico",
+]
+NOMBRES = ["Ana", "Luis", "Marta", "Jorge", "Lucía", "Pablo", "Elena", "Diego"]
+APELLIDOS = ["García", "Pérez", "Sánchez", "Martín", "Gómez", "Ruiz", "Díaz", "Moreno"]
+
+# Préstamos en horario lectivo, de lunes a viernes
+HORA_APERTURA = 8
+HORA_CIERRE = 21
+# Duración log-normal: mediana de 2 h (una clase), cola de varios días
+DURACION_MEDIANA_HORAS = 2
+DURACION_SIGMA = 1.2
+DURACION_MINIMA = 5 * 60
+DURACION_MAXIMA = 30 * 24 * 3600
+# Popularidad de los productos (tipo Zipf): unos pocos acaparan los préstamos
+POPULARIDAD_EXPONENTE = 0.8
+PROFESORES_CADA = 10  # una de cada 10 personas es profesor
+LLAVERO_CADA = 2  # una de cada 2 personas tiene llavero (EPC)
+PRESTAMO_FIELDS = ["producto", "usuario", "tomado_en", "devuelto_en"]
+
+
+def sgtin96(item_reference, serial):
+    value = SGTIN96_HEADER
+    value = (value << 3) | SGTIN96_FILTER
+    value = (value << 3) | SGTIN96_PARTITION
+    value = (value << 24) | COMPANY_PREFIX
+    value = (value << 20) | item_reference
+    value = (value << 38) | serial
+    return f"{value:024X}"
+
+
+def gid96(serial):
+    value = (GID96_HEADER << 88) | (GID96_MANAGER << 60) | (GID96_CLASS << 36)
+    return f"{value | serial:024X}"
+
+
+def _fill_pks(objs, queryset, field):
+    """Asigna los pks tras bulk_create en bases de datos sin RETURNING."""
+    if any(obj.pk is None for obj in objs):
+        pks = dict(queryset.values_list(field, "pk"))
+        for obj in objs:
+            obj.pk = pks[getattr(obj, field)]
+
+
+def _chunks(iterable, size):
+    it = iter(iterable)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def _aware(seconds):
+    return datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+
+
+def _utc(seconds):
+    """
+    Naive en UTC, la zona de la conexión: adapt_datetimefield_value se ahorra
+    el make_naive, que con millones de valores es lo más caro del historial.
+    """
+    return _aware(seconds).replace(tzinfo=None)
+
+
+def _insert_rows(model, fields, rows):
+    """
+    INSERT de tuplas ya preparadas para la BD, sin instanciar el modelo: en el
+    historial de préstamos (millones de filas) crear cada Prestamo y pasarlo
+    por bulk_create se lleva la mayor parte del tiempo. Como bulk_create, no
+    emite señales.
+    """
+    opts = model._meta
+    qn = connection.ops.quote_name
+    columns = ", ".join(qn(opts.get_field(name).column) for name in fields)
+    placeholders = ", ".join(["%s"] * len(fields))
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {qn(opts.db_table)} ({columns}) VALUES ({placeholders})",
+            rows,
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera datos sintéticos coherentes (aulas, productos con su ubicación, "
+        "personas y un historial de préstamos) para pruebas de rendimiento. "
+        "Determinista con --seed. Usage: python manage.py seed_almacen --aulas 20 "
+        "--productos 100000 --personas 2000 --prestamos-history 1000000"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--aulas", type=int, default=5)
+        parser.add_argument("--productos", type=int, default=1000)
+        parser.add_argument("--personas", type=int, default=100)
+        parser.add_argument("--prestamos-history", type=int, default=10000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--dias", type=int, default=365, help="Días de historial de préstamos"
+        )
+        parser.add_argument(
+            "--hasta",
+            help="Último día del historial (AAAA-MM-DD); por defecto ayer. "
+            "Con la misma fecha y semilla los datos son idénticos.",
+        )
+        parser.add_argument(
+            "--prestados",
+            type=float,
+            default=0.1,
+            help="Fracción de productos con un préstamo todavía abierto",
+        )
+        parser.add_argument("--chunk-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        if min(options["aulas"], options["productos"], options["personas"]) < 1:
+            raise CommandError("--aulas, --productos y --personas deben ser >= 1")
+        if (
+            Aula.objects.filter(nombre__startswith=f"{AULA_PREFIX} ").exists()
+            or get_user_model().objects.filter(email__endswith=EMAIL_DOMAIN).exists()
+        ):
+            raise CommandError(
+                "Ya hay datos generados por seed_almacen en esta base de datos"
+            )
+        if options["hasta"]:
+            hasta = parse_date(options["hasta"])
+            if hasta is None:
+                raise CommandError("--hasta no es una fecha válida (AAAA-MM-DD)")
+        else:
+            hasta = timezone.localdate() - timedelta(days=1)
+
+        self.rng = random.Random(options["seed"])
+        self.chunk_size = options["chunk_size"]
+        # bulk_create no emite señales (ni la que crea la Persona de cada User)
+        # y no hace falta invalidar nada salvo las versiones de las aulas
+        with transaction.atomic():
+            aulas = self._create_aulas(options["aulas"])
+            user_ids = self._create_personas(options["personas"], aulas)
+            productos = self._create_productos(options["productos"], aulas)
+            history = self._create_history(
+                productos,
+                user_ids,
+                options["prestamos_history"],
+                self._dias_lectivos(hasta, options["dias"]),
+                options["prestados"],
+            )
+            aula_ids = [a.pk for a in aulas]
+            transaction.on_commit(lambda: bump_aula_versions(aula_ids, catalogo=True))
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {len(aulas)} aulas, {len(user_ids)} personas, "
+                f"{len(productos)} productos ({history['abiertos']} on loan) and "
+                f"{history['prestamos']} prestamos in {elapsed:.1f}s"
+            )
+        )
+
+    def _create_aulas(self, n):
+        return Aula.objects.bulk_create(
+            Aula(nombre=f"{AULA_PREFIX} {i + 1:03d}") for i in range(n)
+        )
+
+    def _create_personas(self, n, aulas):
+        """Usuarios con su Persona; los profesores con acceso a algunas aulas."""
+        User = get_user_model()
+        password = make_password(None)
+        users = []
+        for i in range(n):
+            users.append(
+                User(
+                    username=f"{USERNAME_PREFIX}{i:06d}",
+                    email=f"{USERNAME_PREFIX}{i:06d}@{EMAIL_DOMAIN}",
+                    first_name=self.rng.choice(NOMBRES),
+                    last_name=self.rng.choice(APELLIDOS),
+                    password=password,
+                )
+            )
+        for chunk in _chunks(users, self.chunk_size):
+            User.objects.bulk_create(chunk)
+        seeded = User.objects.filter(email__endswith=EMAIL_DOMAIN)
+        _fill_pks(users, seeded, "username")
+
+        personas = [
+            Persona(
+                user_id=u.pk,
+                epc=gid96(i) if i % LLAVERO_CADA == 0 else None,
+                last_aula=self.rng.choice(aulas),
+            )
+            for i, u in enumerate(users)
+        ]
+        for chunk in _chunks(personas, self.chunk_size):
+            Persona.objects.bulk_create(chunk)
+        _fill_pks(personas, Persona.objects.filter(user__in=seeded), "user_id")
+
+        # Profesores: grupo y acceso a 1-3 aulas, directamente en las tablas
+        # intermedias (sin las señales m2m_changed de cada add())
+        group, _ = Group.objects.get_or_create(name=PROFESORES_GROUP)
+        Membership = User.groups.through
+        Access = Persona.aulas_access.through
+        memberships, accesos = [], []
+        for i, persona in enumerate(personas):
+            if i % PROFESORES_CADA:
+                continue
+            memberships.append(Membership(user_id=persona.user_id, group_id=group.pk))
+            for aula in self.rng.sample(aulas, min(len(aulas), self.rng.randint(1, 3))):
+                accesos.append(Access(persona_id=persona.pk, aula_id=aula.pk))
+        Membership.objects.bulk_create(memberships, batch_size=self.chunk_size)
+        Access.objects.bulk_create(accesos, batch_size=self.chunk_size)
+        return [u.pk for u in users]
+
+    def _create_productos(self, n, aulas):
+        productos = []
+        for i in range(n):
+            referencia = self.rng.randrange(len(CATALOGO))
+            productos.append(
+                Producto(
+                    epc=sgtin96(referencia, i),
+                    nombre=f"{CATALOGO[referencia]} {i + 1}",
+                    n_serie=f"SN{self.rng.getrandbits(40):010X}",
+                    aula=aulas[i % len(aulas)],
+                    estanteria=f"E{self.rng.randint(1, 8)}",
+                    posicion=f"B{self.rng.randint(1, 5)}",
+                )
+            )
+        for chunk in _chunks(productos, self.chunk_size):
+            Producto.objects.bulk_create(chunk)
+        _fill_pks(productos, Producto.objects.filter(aula__in=aulas), "epc")
+        return productos
+
+    def _dias_lectivos(self, hasta, dias):
+        """Medianoche local (epoch) de cada día laborable de los `dias` hasta `hasta`."""
+        tz = timezone.get_current_timezone()
+        lectivos = []
+        for offset in range(dias, -1, -1):
+            dia = hasta - timedelta(days=offset)
+            if dia.weekday() < 5:
+                medianoche = datetime.combine(dia, datetime.min.time(), tzinfo=tz)
+                lectivos.append(medianoche.timestamp())
+        if not lectivos:
+            raise CommandError("--dias no incluye ningún día laborable")
+        return lectivos
+
+    def _duracion(self):
+        """Duración de un préstamo en segundos."""
+        horas = self.rng.lognormvariate(
+            math.log(DURACION_MEDIANA_HORAS), DURACION_SIGMA
+        )
+        return min(max(horas * 3600, DURACION_MINIMA), DURACION_MAXIMA)
+
+    def _create_history(self, productos, user_ids, total, lectivos, prestados):
+        """
+        Reparte `total` préstamos entre los productos según su popularidad.
+        Los de cada producto no se solapan: cada uno se devuelve antes de que
+        empiece el siguiente. El último queda abierto en una fracción
+        `prestados` de los productos, con su Ubicacion en manos de la persona.
+        """
+        rng = self.rng
+        jornada = (HORA_CIERRE - HORA_APERTURA) * 3600
+        pesos = [
+            1 / (rank + 1) ** POPULARIDAD_EXPONENTE for rank in range(len(productos))
+        ]
+        rng.shuffle(pesos)
+        por_producto = Counter(
+            rng.choices(range(len(productos)), weights=pesos, k=total)
+        )
+        # Productos prestados ahora: su último préstamo sigue abierto
+        abiertos = {
+            i
+            for i in range(len(productos))
+            if i in por_producto and rng.random() < prestados
+        }
+
+        ubicaciones = {}
+        adapt = connection.ops.adapt_datetimefield_value
+        apertura = HORA_APERTURA * 3600
+
+        def prestamos():
+            for i, producto in enumerate(productos):
+                n = por_producto.get(i, 0)
+                # Segundos (epoch) para no operar con datetimes en cada préstamo
+                inicios = sorted(
+                    rng.choice(lectivos) + apertura + rng.randrange(jornada)
+                    for _ in range(n)
+                )
+                for j, tomado_en in enumerate(inicios):
+                    usuario_id = rng.choice(user_ids)
+                    if j == n - 1 and i in abiertos:
+                        ubicaciones[i] = (usuario_id, _aware(tomado_en))
+                        yield (producto.pk, usuario_id, adapt(_utc(tomado_en)), None)
+                        continue
+                    devuelto_en = tomado_en + self._duracion()
+                    if j + 1 < n:
+                        # Devuelto como tarde un minuto antes del siguiente
+                        devuelto_en = max(
+                            min(devuelto_en, inicios[j + 1] - 60), tomado_en
+                        )
+                    yield (
+                        producto.pk,
+                        usuario_id,
+                        adapt(_utc(tomado_en)),
+                        adapt(_utc(devuelto_en)),
+                    )
+
+        creados = 0
+        for chunk in _chunks(prestamos(), self.chunk_size):
+            _insert_rows(Prestamo, PRESTAMO_FIELDS, chunk)
+            creados += len(chunk)
+
+        def ubicacion(i, producto):
+            if i in ubicaciones:
+                usuario_id, tomado_en = ubicaciones[i]
+                return Ubicacion(
+                    producto_id=producto.pk,
+                    estado="PERSONA",
+                    persona_id=usuario_id,
+                    tomado_en=tomado_en,
+                    estanteria=producto.estanteria,
+                    posicion=producto.posicion,
+                )
+            return Ubicacion(
+                producto_id=producto.pk,
+                estado="ESTANTE",
+                aula_id=producto.aula_id,
+                estanteria=producto.estanteria,
+                posicion=producto.posicion,
+            )
+
+        for chunk in _chunks(
+            (ubicacion(i, p) for i, p in enumerate(productos)), self.chunk_size
+        ):
+            Ubicacion.objects.bulk_create(chunk)
+        return {"prestamos": creados, "abiertos": len(ubicaciones)}
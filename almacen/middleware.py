@@ -0,0 +1,153 @@
+from contextlib import asynccontextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.utils.functional import SimpleLazyObject
+
+from .access import AccessScope
+from .perf import QueryCounter, get_query_budget, logger as perf_logger
+from .profiling import (
+    Profile,
+    append_log,
+    ashould_profile,
+    instrument,
+    should_profile,
+)
+
+
+@asynccontextmanager
+async def _aexecute_wrapper(wrapper):
+    """
+    connection.execute_wrapper para el camino async: la conexión que ve el
+    bucle de eventos no es la del hilo donde sync_to_async hace las consultas.
+    """
+    manager = await sync_to_async(lambda: connection.execute_wrapper(wrapper))()
+    await sync_to_async(manager.__enter__)()
+    try:
+        yield
+    finally:
+        await sync_to_async(manager.__exit__)(None, None, None)
+
+
+class AsyncCapableMiddleware:
+    """
+    Base de los middlewares de almacen: con un get_response asíncrono (vistas
+    async bajo ASGI) la cadena no pasa por async_to_sync en cada petición.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.handle(request)
+
+    def handle(self, request):
+        raise NotImplementedError
+
+    async def __acall__(self, request):
+        raise NotImplementedError
+
+
+class AccessScopeMiddleware(AsyncCapableMiddleware):
+    """Adjunta a cada petición un AccessScope perezoso (request.access_scope)."""
+
+    def handle(self, request):
+        request.access_scope = SimpleLazyObject(lambda: AccessScope(request))
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.access_scope = SimpleLazyObject(lambda: AccessScope(request))
+        return await self.get_response(request)
+
+
+class QueryBudgetMiddleware(AsyncCapableMiddleware):
+    """
+    Solo con DEBUG: cuenta las consultas de cada petición y avisa en el log
+    si la vista supera el presupuesto declarado con @query_budget.
+    """
+
+    def __init__(self, get_response):
+        if not settings.DEBUG:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def handle(self, request):
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        self._check(request, counter)
+        return response
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        async with _aexecute_wrapper(counter):
+            response = await self.get_response(request)
+        self._check(request, counter)
+        return response
+
+    def _check(self, request, counter):
+        budget = getattr(request, "_query_budget", None)
+        if budget is not None and counter.count > budget:
+            perf_logger.warning(
+                f"{request.method} {request.path} ({request._query_budget_view}): "
+                f"{counter.count} consultas, presupuesto {budget} "
+                f"({counter.seconds * 1000:.1f} ms en la BD)"
+            )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = get_query_budget(view_func)
+        request._query_budget_view = getattr(view_func, "__name__", repr(view_func))
+
+
+class ProfilingMiddleware(AsyncCapableMiddleware):
+    """
+    Perfila las peticiones elegidas (ver profiling.py): cabecera Server-Timing
+    y una línea en el log de perfilado. Con PROFILING_ENABLED=False no se carga.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        instrument()
+
+    def handle(self, request):
+        if not should_profile(request, settings.PROFILING_SAMPLE_RATE):
+            return self.get_response(request)
+
+        profile = Profile()
+        token = profile.activate()
+        try:
+            with connection.execute_wrapper(profile):
+                response = self.get_response(request)
+        finally:
+            profile.deactivate(token)
+        return self._finish(profile, request, response)
+
+    async def __acall__(self, request):
+        if not await ashould_profile(request, settings.PROFILING_SAMPLE_RATE):
+            return await self.get_response(request)
+
+        profile = Profile()
+        token = profile.activate()
+        try:
+            async with _aexecute_wrapper(profile):
+                response = await self.get_response(request)
+        finally:
+            profile.deactivate(token)
+        return await sync_to_async(self._finish)(profile, request, response)
+
+    def _finish(self, profile, request, response):
+        response["Server-Timing"] = profile.server_timing()
+        append_log(profile.record(request, response))
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 14:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("almacen", "0007_aula_operation_mode"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="producto",
+            name="foto_hash",
+            field=models.CharField(blank=True, editable=False, max_length=16),
+        ),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 5.2.6 on 2026-10-19 14:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("almacen", "0008_producto_foto_hash"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Recuento",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("iniciado_en", models.DateTimeField(auto_now_add=True)),
+                ("finalizado_en", models.DateTimeField(blank=True, null=True)),
+                ("resultado", models.JSONField(blank=True, default=dict)),
+                (
+                    "aula",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="recuentos",
+                        to="almacen.aula",
+                    ),
+                ),
+                (
+                    "iniciado_por",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="recuentos",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Recuento",
+                "verbose_name_plural": "Recuentos",
+                "ordering": ["-iniciado_en"],
+            },
+        ),
+        migrations.CreateModel(
+            name="RecuentoLectura",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("epc", models.CharField(max_length=96, verbose_name="EPC")),
+                (
+                    "recuento",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="lecturas",
+                        to="almacen.recuento",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Lectura de recuento",
+                "verbose_name_plural": "Lecturas de recuento",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="recuento",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("finalizado_en__isnull", True)),
+                fields=("aula",),
+                name="recuento_abierto_por_aula",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="recuentolectura",
+            constraint=models.UniqueConstraint(
+                fields=("recuento", "epc"), name="recuento_epc_unico"
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:01
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("almacen", "0009_recuento"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="prestamo",
+            name="tomado_en",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, editable=False
+            ),
+        ),
+    ]
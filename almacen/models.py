@@ -1,10 +1,124 @@
+import copy
+
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import DatabaseError, models, transaction
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
 
 User = get_user_model()
 
+# Valores que se pueden modificar sin reasignar el campo (JSONField): solo
+# estos se copian al guardar los valores cargados
+MUTABLE_TYPES = (dict, list, set, bytearray)
+# Mensaje de Model.save() cuando el UPDATE de update_fields no encuentra la fila
+UPDATE_FIELDS_NO_ROWS = "Save with update_fields did not affect any rows."
+
+
+class DirtyFieldsMixin:
+    """
+    Guarda los valores con los que se cargó la instancia y, en un save() sin
+    update_fields (ni force_insert/force_update), escribe solo las columnas
+    que han cambiado. Si no ha cambiado nada no se hace el UPDATE (ni se
+    emiten post_save). Si la fila se ha borrado mientras tanto, se vuelve a
+    insertar entera, como haría el save() de Django.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)  # type: ignore[misc]
+        # Los valores tal como llegan de la BD (field_names son attnames)
+        loaded = dict(zip(field_names, values))
+        for attname, value in loaded.items():
+            if isinstance(value, MUTABLE_TYPES):
+                loaded[attname] = copy.deepcopy(value)
+        instance.__dict__["_loaded_values"] = loaded
+        return instance
+
+    def _snapshot(self, attnames=None):
+        loaded = self.__dict__.setdefault("_loaded_values", {})
+        for field in self._meta.concrete_fields:  # type: ignore[attr-defined]
+            attname = field.attname
+            if attname in self.__dict__ and (attnames is None or attname in attnames):
+                value = self.__dict__[attname]
+                if isinstance(value, FieldFile):
+                    value = value.name
+                elif isinstance(value, MUTABLE_TYPES):
+                    value = copy.deepcopy(value)
+                loaded[attname] = value
+
+    def get_loaded_value(self, attname, default=None):
+        """Valor de la columna al cargar la instancia (o en el último save)."""
+        return self.__dict__.get("_loaded_values", {}).get(attname, default)
+
+    def get_dirty_fields(self):
+        """
+        Campos modificados desde que se cargó la instancia, o None si no
+        viene de la BD (hay que guardarla entera).
+        """
+        loaded = self.__dict__.get("_loaded_values")
+        if loaded is None or self._state.adding:  # type: ignore[attr-defined]
+            return None
+        dirty = []
+        for field in self._meta.concrete_fields:  # type: ignore[attr-defined]
+            attname = field.attname
+            if field.primary_key or attname not in self.__dict__:
+                continue
+            value = self.__dict__[attname]
+            if isinstance(value, FieldFile):
+                # Fichero nuevo sin guardar todavía en el storage
+                if not value._committed:
+                    dirty.append(field.name)
+                    continue
+                value = value.name
+            if attname not in loaded or loaded[attname] != value:
+                dirty.append(field.name)
+        return dirty
+
+    def save(self, *args, **kwargs):
+        partial = False
+        if (
+            kwargs.get("update_fields") is None
+            and not args
+            and not kwargs.get("force_insert")
+            and not kwargs.get("force_update")
+        ):
+            dirty = self.get_dirty_fields()
+            if dirty is not None:
+                if not dirty:
+                    return
+                # auto_now (p. ej. "actualizado") se refresca en cada escritura
+                dirty += [
+                    f.name
+                    for f in self._meta.concrete_fields  # type: ignore[attr-defined]
+                    if getattr(f, "auto_now", False) and f.name not in dirty
+                ]
+                kwargs["update_fields"] = dirty
+                partial = True
+        try:
+            super().save(*args, **kwargs)  # type: ignore[misc]
+        except DatabaseError as e:
+            # save(update_fields=...) no inserta: la fila se ha borrado mientras tanto
+            if not partial or str(e) != UPDATE_FIELDS_NO_ROWS:
+                raise
+            # El UPDATE no ha fallado (0 filas): la transacción sigue siendo válida
+            using = kwargs.get("using") or self._state.db  # type: ignore[attr-defined]
+            if transaction.get_connection(using).in_atomic_block:
+                transaction.set_rollback(False, using=using)
+            del kwargs["update_fields"]
+            super().save(*args, **kwargs)  # type: ignore[misc]
+        update_fields = kwargs.get("update_fields")
+        self._snapshot(
+            None
+            if update_fields is None
+            else {self._meta.get_field(name).attname for name in update_fields}  # type: ignore[attr-defined]
+        )
 
-class Aula(models.Model):
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)  # type: ignore[misc]
+        self._snapshot()
+
+
+class Aula(DirtyFieldsMixin, models.Model):
     OPERATION_MODE_CHOICES = [
         ("WITH_PERSONA", "Con identificación de persona"),
         ("WITHOUT_PERSONA", "Sin identificación de persona"),
@@ -27,13 +141,15 @@ class Aula(models.Model):
         return f"{self.nombre} - {self.id}"
 
 
-class Producto(models.Model):
+class Producto(DirtyFieldsMixin, models.Model):
     # Código EPC RFID (leído por el lector; típicamente emulación de teclado)
     epc = models.CharField("EPC", max_length=96, unique=True)
     nombre = models.CharField(max_length=255)
     posicion = models.CharField(max_length=100, blank=True)
     n_serie = models.CharField("Nº de serie", max_length=255, blank=True)
     foto = models.ImageField(upload_to="productos/", blank=True, null=True)
+    # Hash del contenido de la foto; vacío mientras no haya miniaturas (ver thumbnails.py)
+    foto_hash = models.CharField(max_length=16, blank=True, editable=False)
     aula = models.ForeignKey(Aula, on_delete=models.PROTECT, related_name="productos")
     estanteria = models.CharField(max_length=100, blank=True)
     cantidad = models.FloatField(default=1.0)
@@ -43,9 +159,22 @@ class Producto(models.Model):
     creado = models.DateTimeField(auto_now_add=True)
     actualizado = models.DateTimeField(auto_now=True)
 
+    def save(self, *args, **kwargs):
+        # Foto recién subida o quitada: las miniaturas anteriores ya no sirven
+        # (se generan al guardar, ver signals.py y thumbnails.py)
+        if self.foto and not self.foto._committed:
+            self.foto_hash = ""
+            self._foto_pendiente = True
+        elif not self.foto:
+            self.foto_hash = ""
+        super().save(*args, **kwargs)
+
     @property
     def current_prestamo(self):
         # requiere Prestamo(producto=..., devuelto_en is null) para significar "actualmente tomado"
+        abiertos = getattr(self, "prestamos_abiertos", None)  # ver fragments.py
+        if abiertos is not None:
+            return abiertos[0] if abiertos else None
         return (
             self.prestamos.filter(devuelto_en__isnull=True)  # type: ignore[attr-defined]
             .select_related("usuario")
@@ -69,7 +198,7 @@ class Producto(models.Model):
         return f"{self.nombre} ({self.epc})"
 
 
-class Persona(models.Model):
+class Persona(DirtyFieldsMixin, models.Model):
     """Optional profile table if you want extra fields; we just map to User."""
 
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="persona")
@@ -106,7 +235,7 @@ class Persona(models.Model):
         return self.user.get_full_name() or self.user.email
 
 
-class Ubicacion(models.Model):
+class Ubicacion(DirtyFieldsMixin, models.Model):
     ESTADO_CHOICES = [
         ("ESTANTE", "En estantería"),
         ("PERSONA", "En manos de una persona"),
@@ -143,7 +272,7 @@ class Ubicacion(models.Model):
         return f"{self.producto} - {self.estado}"
 
 
-class Prestamo(models.Model):
+class Prestamo(DirtyFieldsMixin, models.Model):
     """Historial de acciones de tomar/devolver para consulta rápida y auditoría."""
 
     producto = models.ForeignKey(
@@ -157,7 +286,8 @@ class Prestamo(models.Model):
         blank=True,
         default=None,
     )
-    tomado_en = models.DateTimeField(auto_now_add=True)
+    # Como auto_now_add, pero prestamos.py puede dar la hora de la lectura RFID
+    tomado_en = models.DateTimeField(default=timezone.now, editable=False)
     devuelto_en = models.DateTimeField(null=True, blank=True)
 
     class Meta:
@@ -167,3 +297,64 @@ class Prestamo(models.Model):
 
     def __str__(self):
         return f"{self.producto} → {self.usuario}"
+
+
+class Recuento(DirtyFieldsMixin, models.Model):
+    """
+    Sesión de inventario físico de un aula: mientras está abierta, el
+    listener guarda los EPC leídos en el aula en lugar de registrar préstamos.
+    """
+
+    aula = models.ForeignKey(Aula, on_delete=models.CASCADE, related_name="recuentos")
+    iniciado_por = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        related_name="recuentos",
+        null=True,
+        blank=True,
+    )
+    iniciado_en = models.DateTimeField(auto_now_add=True)
+    finalizado_en = models.DateTimeField(null=True, blank=True)
+    # Listas de EPC calculadas al finalizar (ver recuentos.py)
+    resultado = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ["-iniciado_en"]
+        verbose_name = "Recuento"
+        verbose_name_plural = "Recuentos"
+        constraints = [
+            # Un solo recuento abierto por aula
+            models.UniqueConstraint(
+                fields=["aula"],
+                condition=models.Q(finalizado_en__isnull=True),
+                name="recuento_abierto_por_aula",
+            )
+        ]
+
+    @property
+    def abierto(self):
+        return self.finalizado_en is None
+
+    def __str__(self):
+        return f"Recuento {self.aula.nombre} {self.iniciado_en:%Y-%m-%d %H:%M}"
+
+
+class RecuentoLectura(models.Model):
+    """EPC distinto visto durante un recuento (una fila por EPC, no por lectura)."""
+
+    recuento = models.ForeignKey(
+        Recuento, on_delete=models.CASCADE, related_name="lecturas"
+    )
+    epc = models.CharField("EPC", max_length=96)
+
+    class Meta:
+        verbose_name = "Lectura de recuento"
+        verbose_name_plural = "Lecturas de recuento"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["recuento", "epc"], name="recuento_epc_unico"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.recuento_id}: {self.epc}"  # type: ignore[attr-defined]
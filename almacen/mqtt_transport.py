@@ -0,0 +1,123 @@
+"""
+Transportes del listener MQTT (ver mqtt_listener.Command.start/serve).
+
+PahoTransport conecta con un broker real (mosquitto). QueueBroker es un
+broker en memoria dentro del proceso, con los comodines + y # de MQTT, y
+QueueTransport el cliente que lo consume: con ellos el camino completo del
+listener se prueba sin servicios externos.
+"""
+
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import paho.mqtt.client as mqtt
+
+# Lo que el listener usa del mensaje de paho
+Message = namedtuple("Message", "topic payload")
+
+
+class PahoTransport:
+    """Cliente paho contra un broker MQTT."""
+
+    def __init__(self, host, port, username="", password="", keepalive=60):
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.client = mqtt.Client()
+        if username and password:
+            self.client.username_pw_set(username, password)
+
+    def connect(self, on_connect, on_message):
+        self.client.on_connect = on_connect
+        self.client.on_message = on_message
+        self.client.connect(self.host, self.port, self.keepalive)
+
+    def loop(self, timeout):
+        """Procesa el tráfico de red durante timeout segundos como mucho."""
+        self.client.loop(timeout=timeout)
+
+    def pending(self):
+        """Los mensajes sin leer están en el broker: no se pueden contar."""
+        return 0
+
+    def close(self):
+        self.client.disconnect()
+
+
+class QueueBroker:
+    """
+    Broker MQTT mínimo en memoria: cada publicación se copia a la cola de las
+    suscripciones cuyo filtro encaja con el topic. Sin QoS ni retained: lo
+    publicado antes de suscribirse se pierde, como en mosquitto.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = []  # [(filtro, cola)]
+
+    def subscribe(self, topic_filter, messages=None):
+        """Suscribe la cola (o una nueva) al filtro y la devuelve."""
+        messages = queue.Queue() if messages is None else messages
+        with self.lock:
+            self.subscriptions.append((topic_filter, messages))
+        return messages
+
+    def unsubscribe(self, messages):
+        with self.lock:
+            self.subscriptions = [s for s in self.subscriptions if s[1] is not messages]
+
+    def publish(self, topic, payload):
+        """Publica y devuelve a cuántas suscripciones se ha entregado."""
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        message = Message(topic, payload)
+        with self.lock:
+            targets = {
+                id(messages): messages
+                for topic_filter, messages in self.subscriptions
+                if mqtt.topic_matches_sub(topic_filter, topic)
+            }
+        for messages in targets.values():
+            messages.put(message)
+        return len(targets)
+
+    def pending(self):
+        """Mensajes entregados a las colas y aún sin leer."""
+        with self.lock:
+            queues = {id(messages): messages for _, messages in self.subscriptions}
+        return sum(messages.qsize() for messages in queues.values())
+
+
+class QueueTransport:
+    """Cliente de QueueBroker con la misma interfaz que PahoTransport."""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.messages = queue.Queue()
+        self.on_message = None
+
+    def connect(self, on_connect, on_message):
+        self.on_message = on_message
+        on_connect(self, None, {}, 0)
+
+    def subscribe(self, topic_filter):
+        """Llamado por on_connect, como client.subscribe de paho."""
+        self.broker.subscribe(topic_filter, self.messages)
+
+    def loop(self, timeout):
+        """Entrega los mensajes que lleguen durante timeout segundos."""
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                message = self.messages.get(timeout=remaining)
+            except queue.Empty:
+                return
+            self.on_message(self, None, message)
+
+    def pending(self):
+        return self.messages.qsize()
+
+    def close(self):
+        self.broker.unsubscribe(self.messages)
@@ -0,0 +1,45 @@
+"""
+Presupuestos de consultas SQL.
+
+Cada vista caliente declara con @query_budget cuántas consultas hace como
+máximo, con las cachés calientes y sin importar cuántos productos haya. Las
+pruebas de tests/test_perf.py lo comprueban con datos de 100 a 100k
+productos y, con DEBUG, QueryBudgetMiddleware avisa en el log de cualquier
+petición que se pase.
+"""
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def query_budget(n):
+    """Declara el presupuesto de consultas de una vista (o función)."""
+
+    def decorator(func):
+        func.query_budget = n
+        return func
+
+    return decorator
+
+
+def get_query_budget(func):
+    """Presupuesto declarado (se conserva a través de los decoradores con wraps)."""
+    return getattr(func, "query_budget", None)
+
+
+class QueryCounter:
+    """execute_wrapper que cuenta las consultas y el tiempo pasado en la BD."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
@@ -0,0 +1,156 @@
+"""
+Préstamos y devoluciones: única implementación usada por la web
+(toggle_prestamo) y por el listener MQTT.
+
+Cada llamada trabaja con un conjunto de productos y hace un número constante
+de consultas: bloquea las ubicaciones afectadas, decide con ellas qué
+productos cambian y escribe con UPDATE / bulk_create. Como el estado se lee
+con el bloqueo ya tomado, un toque en la tablet y una lectura RFID del mismo
+producto no pueden prestarlo dos veces ni devolverlo a medias.
+
+En SQLite, select_for_update() no bloquea nada: el bloqueo lo da el modo de
+transacción IMMEDIATE (ver DATABASES en settings), que toma el de escritura
+al empezar el atomic().
+
+bulk_create y update() no emiten señales, así que las cachés y los avisos
+en vivo se actualizan aquí al confirmar la transacción.
+"""
+
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .conditional import bump_aula_versions
+from .events import publish_producto_change
+from .fragments import bump_producto_versions
+from .models import Prestamo, Producto, Ubicacion
+
+
+def _producto_ids(productos):
+    """Admite Producto o pk."""
+    return sorted({getattr(p, "pk", p) for p in productos})
+
+
+def _lock(producto_ids, persona=None):
+    """
+    {producto_id: estado} de las ubicaciones, leídas con bloqueo. Con persona,
+    se omiten los productos prestados a otra persona: no se pueden devolver.
+    """
+    rows = (
+        Ubicacion.objects.select_for_update()
+        .filter(producto_id__in=producto_ids)
+        .values_list("producto_id", "estado", "persona_id")
+    )
+    return {
+        pk: estado
+        for pk, estado, persona_id in rows
+        if persona is None or estado != "PERSONA" or persona_id == persona.pk
+    }
+
+
+def _changed(aulas):
+    """Invalidación de cachés y avisos SSE al confirmar. aulas = {pk: aula_id}."""
+    producto_ids = list(aulas)
+    aula_ids = set(aulas.values())
+    transaction.on_commit(lambda: bump_producto_versions(producto_ids))
+    transaction.on_commit(lambda: bump_aula_versions(aula_ids))
+    for producto_id, aula_id in aulas.items():
+        publish_producto_change(producto_id, aula_id)
+
+
+def _checkout(aulas, estados, persona, ts):
+    """Presta los productos de aulas ({pk: aula_id}) que no están prestados."""
+    disponibles = [pk for pk in aulas if estados.get(pk, "ESTANTE") == "ESTANTE"]
+    if not disponibles:
+        return []
+    valores = {
+        "estado": "PERSONA",
+        "persona": persona,
+        "tomado_en": ts,
+        "aula": None,
+        "estanteria": "",
+        "posicion": "",
+    }
+    sin_ubicacion = [pk for pk in disponibles if pk not in estados]
+    Ubicacion.objects.filter(producto_id__in=disponibles).update(**valores)
+    if sin_ubicacion:
+        Ubicacion.objects.bulk_create(
+            Ubicacion(producto_id=pk, **valores) for pk in sin_ubicacion
+        )
+    Prestamo.objects.bulk_create(
+        Prestamo(producto_id=pk, usuario=persona, tomado_en=ts) for pk in disponibles
+    )
+    _changed({pk: aulas[pk] for pk in disponibles})
+    return disponibles
+
+
+def _checkin(aulas, estados, ts):
+    """Devuelve a su estantería los productos de aulas que están prestados."""
+    prestados = [pk for pk in aulas if estados.get(pk) == "PERSONA"]
+    if not prestados:
+        return []
+    producto = Producto.objects.filter(pk=OuterRef("producto_id"))
+    Ubicacion.objects.filter(producto_id__in=prestados).update(
+        estado="ESTANTE",
+        persona=None,
+        tomado_en=None,
+        aula_id=Subquery(producto.values("aula_id")[:1]),
+        estanteria=Subquery(producto.values("estanteria")[:1]),
+        posicion=Subquery(producto.values("posicion")[:1]),
+    )
+    Prestamo.objects.filter(producto_id__in=prestados, devuelto_en__isnull=True).update(
+        devuelto_en=ts
+    )
+    _changed({pk: aulas[pk] for pk in prestados})
+    return prestados
+
+
+def _run(productos, action, persona=None):
+    producto_ids = _producto_ids(productos)
+    if not producto_ids:
+        return action({}, {})
+    with transaction.atomic():
+        estados = _lock(producto_ids, persona)
+        # Productos borrados mientras tanto desaparecen aquí
+        aulas = dict(
+            Producto.objects.filter(pk__in=producto_ids).values_list("pk", "aula_id")
+        )
+        return action(aulas, estados)
+
+
+def checkout(productos, persona, ts=None):
+    """
+    Presta a persona (User o None en aulas sin identificación) los productos
+    que estén en la estantería. Devuelve los pks prestados; los que ya
+    estaban prestados se ignoran.
+    """
+    ts = ts or timezone.now()
+    return _run(
+        productos, lambda aulas, estados: _checkout(aulas, estados, persona, ts)
+    )
+
+
+def checkin(productos, ts=None, persona=None):
+    """
+    Devuelve a la estantería de su aula los productos prestados y cierra sus
+    préstamos abiertos. Con persona, solo los que tiene prestados esa persona,
+    comprobado con el bloqueo tomado. Devuelve los pks devueltos.
+    """
+    ts = ts or timezone.now()
+    return _run(productos, lambda aulas, estados: _checkin(aulas, estados, ts), persona)
+
+
+def toggle(productos, persona, ts=None):
+    """
+    Lectura RFID: los productos prestados se devuelven y el resto se prestan
+    a persona, todo con el mismo bloqueo. Devuelve (prestados, devueltos).
+    """
+    ts = ts or timezone.now()
+
+    def action(aulas, estados):
+        return (
+            _checkout(aulas, estados, persona, ts),
+            _checkin(aulas, estados, ts),
+        )
+
+    return _run(productos, action)
@@ -0,0 +1,311 @@
+"""
+Perfilado por petición (ProfilingMiddleware, en middleware.py).
+
+Se perfila una petición si la hace un usuario staff con la cabecera
+X-Almacen-Profile o con la cookie que activa la página de perfilado, o por
+muestreo (PROFILING_SAMPLE_RATE). Se mide el tiempo total, las consultas SQL
+(número, tiempo y huella), el render de plantillas y los aciertos y fallos de
+caché. Los resultados se devuelven en la cabecera Server-Timing y se añaden,
+una línea JSON por petición, a un log rotativo (PROFILING_LOG) que resume la
+página de staff.
+
+Las medidas de plantillas y caché envuelven los métodos de las clases una
+sola vez; fuera de una petición perfilada solo leen un ContextVar.
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import statistics
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from functools import wraps
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+PROFILE_HEADER = "X-Almacen-Profile"
+PROFILE_COOKIE = "almacen_profile"
+# Huellas SQL más lentas guardadas por petición y mostradas por endpoint
+MAX_FINGERPRINTS = 5
+PROFILING_LOG_BACKUPS = 2
+
+_current = ContextVar("almacen_profile", default=None)
+_MISSING = object()
+_instrumented = set()
+_handlers = {}  # {ruta del log: RotatingFileHandler}
+_handlers_lock = threading.Lock()
+
+_IN_LIST = re.compile(r"\bIN \((?:%s, )*%s\)")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    """SQL sin valores: las consultas iguales con otros parámetros coinciden."""
+    sql = _IN_LIST.sub("IN (...)", sql)
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    return _SPACES.sub(" ", sql).strip()[:300]
+
+
+class Profile:
+    """Medidas de una petición; también es el execute_wrapper de la BD."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.total_seconds = 0.0
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # BaseCache.get_many llama a get(): se cuenta solo la llamada externa
+        self.in_cache = False
+        self.queries = defaultdict(lambda: [0, 0.0])  # {huella: [n, segundos]}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            seconds = time.perf_counter() - start
+            self.sql_count += 1
+            self.sql_seconds += seconds
+            query = self.queries[fingerprint(sql)]
+            query[0] += 1
+            query[1] += seconds
+
+    def activate(self):
+        """Marca el contexto actual como perfilado; devuelve el token de reset."""
+        return _current.set(self)
+
+    def deactivate(self, token):
+        _current.reset(token)
+        self.total_seconds = time.perf_counter() - self.start
+
+    def server_timing(self):
+        """Valor de la cabecera Server-Timing."""
+        return ", ".join(
+            [
+                f'sql;dur={self.sql_seconds * 1000:.1f};desc="{self.sql_count} consultas"',
+                f"tpl;dur={self.template_seconds * 1000:.1f}",
+                f'cache;desc="{self.cache_hits} aciertos, '
+                f'{self.cache_misses} fallos"',
+                f"total;dur={self.total_seconds * 1000:.1f}",
+            ]
+        )
+
+    def record(self, request, response):
+        """Línea del log: claves cortas para que ocupe poco."""
+        match = getattr(request, "resolver_match", None)
+        slowest = sorted(self.queries.items(), key=lambda q: q[1][1], reverse=True)
+        return {
+            "t": round(time.time(), 3),
+            "m": request.method,
+            "v": match.view_name if match else request.path,
+            "p": request.path,
+            "s": response.status_code,
+            "ms": round(self.total_seconds * 1000, 2),
+            "sql": self.sql_count,
+            "sql_ms": round(self.sql_seconds * 1000, 2),
+            "tpl_ms": round(self.template_seconds * 1000, 2),
+            "hit": self.cache_hits,
+            "miss": self.cache_misses,
+            "q": [
+                [sql, n, round(seconds * 1000, 2)]
+                for sql, (n, seconds) in slowest[:MAX_FINGERPRINTS]
+            ],
+        }
+
+
+def should_profile(request, sample_rate):
+    """Cabecera o cookie de un staff, o muestreo. Sin coste si no hay nada."""
+    if sample_rate and random.random() < sample_rate:
+        return True
+    if PROFILE_HEADER in request.headers or PROFILE_COOKIE in request.COOKIES:
+        user = getattr(request, "user", None)
+        return bool(user and user.is_staff)
+    return False
+
+
+async def ashould_profile(request, sample_rate):
+    """should_profile para el camino async: el usuario sale de request.auser()."""
+    if sample_rate and random.random() < sample_rate:
+        return True
+    if PROFILE_HEADER in request.headers or PROFILE_COOKIE in request.COOKIES:
+        auser = getattr(request, "auser", None)
+        user = auser and await auser()
+        return bool(user and user.is_staff)
+    return False
+
+
+def _timed_render(render):
+    @wraps(render)
+    def wrapper(self, *args, **kwargs):
+        profile = _current.get()
+        if profile is None:
+            return render(self, *args, **kwargs)
+        # Las plantillas anidadas (render_to_string dentro de otra) no suman dos veces
+        profile.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            profile.template_depth -= 1
+            if not profile.template_depth:
+                profile.template_seconds += time.perf_counter() - start
+
+    wrapper.profiled = True
+    return wrapper
+
+
+def _counted_get(get):
+    @wraps(get)
+    def wrapper(self, key, default=None, *args, **kwargs):
+        profile = _current.get()
+        if profile is None or profile.in_cache:
+            return get(self, key, default, *args, **kwargs)
+        profile.in_cache = True
+        try:
+            value = get(self, key, _MISSING, *args, **kwargs)
+        finally:
+            profile.in_cache = False
+        if value is _MISSING:
+            profile.cache_misses += 1
+            return default
+        profile.cache_hits += 1
+        return value
+
+    wrapper.profiled = True
+    return wrapper
+
+
+def _counted_get_many(get_many):
+    @wraps(get_many)
+    def wrapper(self, keys, *args, **kwargs):
+        profile = _current.get()
+        if profile is None or profile.in_cache:
+            return get_many(self, keys, *args, **kwargs)
+        keys = list(keys)
+        profile.in_cache = True
+        try:
+            values = get_many(self, keys, *args, **kwargs)
+        finally:
+            profile.in_cache = False
+        profile.cache_hits += len(values)
+        profile.cache_misses += len(keys) - len(values)
+        return values
+
+    wrapper.profiled = True
+    return wrapper
+
+
+def _wrap(cls, name, decorator):
+    method = getattr(cls, name)
+    if not getattr(method, "profiled", False):
+        setattr(cls, name, decorator(method))
+
+
+def instrument():
+    """Envuelve el render de plantillas y las lecturas de las cachés configuradas."""
+    from django.template.backends.django import Template
+
+    classes = {Template} | {
+        import_string(cache["BACKEND"]) for cache in settings.CACHES.values()
+    }
+    for cls in classes - _instrumented:
+        if cls is Template:
+            _wrap(cls, "render", _timed_render)
+        else:
+            _wrap(cls, "get", _counted_get)
+            _wrap(cls, "get_many", _counted_get_many)
+        _instrumented.add(cls)
+
+
+def append_log(record, path=None):
+    """Añade una línea al log de perfilado (rota a los PROFILING_LOG_MAX_BYTES)."""
+    path = path or settings.PROFILING_LOG
+    with _handlers_lock:
+        handler = _handlers.get(path)
+        if handler is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            handler = RotatingFileHandler(
+                path,
+                maxBytes=settings.PROFILING_LOG_MAX_BYTES,
+                backupCount=PROFILING_LOG_BACKUPS,
+                encoding="utf-8",
+            )
+            _handlers[path] = handler
+    line = json.dumps(record, separators=(",", ":"), ensure_ascii=False)
+    handler.handle(logging.makeLogRecord({"msg": line}))
+
+
+def read_log(hours, path=None):
+    """Registros de las últimas `hours` horas, del más antiguo al más nuevo."""
+    path = path or settings.PROFILING_LOG
+    since = time.time() - hours * 3600
+    files = [f"{path}.{n}" for n in range(PROFILING_LOG_BACKUPS, 0, -1)] + [path]
+    for name in files:
+        try:
+            f = open(name, encoding="utf-8")
+        except FileNotFoundError:
+            continue
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # línea cortada por una rotación
+                if record.get("t", 0) >= since:
+                    yield record
+
+
+def slowest_endpoints(records, limit=20):
+    """
+    Resumen por endpoint (método y vista), del p95 más lento al más rápido,
+    con las huellas SQL que más tiempo suman.
+    """
+    groups = defaultdict(list)
+    for record in records:
+        groups[(record["m"], record["v"])].append(record)
+
+    endpoints = []
+    for (method, view), items in groups.items():
+        totals = sorted(r["ms"] for r in items)
+        queries = defaultdict(lambda: [0, 0.0])
+        for r in items:
+            for sql, n, ms in r["q"]:
+                queries[sql][0] += n
+                queries[sql][1] += ms
+        hits = sum(r["hit"] for r in items)
+        lookups = hits + sum(r["miss"] for r in items)
+        endpoints.append(
+            {
+                "method": method,
+                "view": view,
+                "requests": len(items),
+                "p50_ms": statistics.median(totals),
+                "p95_ms": totals[min(len(totals) - 1, int(len(totals) * 0.95))],
+                "max_ms": totals[-1],
+                "sql": statistics.mean(r["sql"] for r in items),
+                "sql_ms": statistics.mean(r["sql_ms"] for r in items),
+                "tpl_ms": statistics.mean(r["tpl_ms"] for r in items),
+                "cache_hit_rate": hits / lookups if lookups else None,
+                "queries": [
+                    {"sql": sql, "count": n, "ms": ms}
+                    for sql, (n, ms) in sorted(
+                        queries.items(), key=lambda q: q[1][1], reverse=True
+                    )[:MAX_FINGERPRINTS]
+                ],
+            }
+        )
+    endpoints.sort(key=lambda e: e["p95_ms"], reverse=True)
+    return endpoints[:limit]
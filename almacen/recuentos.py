@@ -0,0 +1,140 @@
+"""
+Recuentos (inventario físico) de un aula con el lector RFID.
+
+Mientras un recuento está abierto, el listener MQTT no procesa préstamos en
+esa aula: acumula en memoria los EPC distintos leídos y los guarda por lotes
+en RecuentoLectura (una fila por EPC, no por lectura), así que miles de
+lecturas por minuto de los mismos productos no llegan a la BD. Al finalizar
+se comparan conjuntos de EPC: los esperados en el aula contra los leídos.
+"""
+
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Persona, Producto, Recuento, RecuentoLectura
+
+# Tamaño de los IN (...) al buscar EPC, por debajo del límite de parámetros de SQLite
+EPC_LOOKUP_CHUNK = 1000
+
+# (clave en Recuento.resultado, título en el informe)
+CATEGORIAS = [
+    ("faltan", "No encontrados en el aula"),
+    ("otra_aula", "Registrados en otra aula"),
+    ("inesperados", "EPC desconocidos"),
+    ("prestados", "Leídos pero figuran prestados"),
+]
+
+
+def recuentos_abiertos():
+    """{aula_id (str, como llega en el payload MQTT): pk del recuento abierto}."""
+    return {
+        str(aula_id): pk
+        for aula_id, pk in Recuento.objects.filter(
+            finalizado_en__isnull=True
+        ).values_list("aula_id", "pk")
+    }
+
+
+def guardar_lecturas(lecturas):
+    """Guarda {recuento_id: EPCs} en un solo INSERT; los repetidos se ignoran."""
+    RecuentoLectura.objects.bulk_create(
+        [
+            RecuentoLectura(recuento_id=recuento_id, epc=epc)
+            for recuento_id, epcs in lecturas.items()
+            for epc in epcs
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def iniciar_recuento(aula, usuario):
+    """Abre un recuento en el aula, o devuelve el que ya estaba abierto."""
+    abierto = Recuento.objects.filter(aula=aula, finalizado_en__isnull=True).first()
+    if abierto:
+        return abierto
+    try:
+        with transaction.atomic():
+            return Recuento.objects.create(aula=aula, iniciado_por=usuario)
+    except IntegrityError:
+        # Otro profesor lo ha abierto a la vez
+        return Recuento.objects.get(aula=aula, finalizado_en__isnull=True)
+
+
+def _en_bloques(epcs):
+    it = iter(epcs)
+    while bloque := list(islice(it, EPC_LOOKUP_CHUNK)):
+        yield bloque
+
+
+def _epcs_existentes(model, epcs):
+    existentes = set()
+    for bloque in _en_bloques(epcs):
+        existentes.update(
+            model.objects.filter(epc__in=bloque).values_list("epc", flat=True)
+        )
+    return existentes
+
+
+def calcular_resultado(recuento):
+    """Diferencias entre los EPC esperados en el aula y los leídos."""
+    vistos = set(recuento.lecturas.values_list("epc", flat=True))
+    del_aula = dict(
+        Producto.objects.filter(aula_id=recuento.aula_id).values_list(
+            "epc", "ubicacion__estado"
+        )
+    )
+    # Lo prestado no se espera en la estantería
+    prestados = {epc for epc, estado in del_aula.items() if estado == "PERSONA"}
+    esperados = del_aula.keys() - prestados
+    ajenos = vistos - del_aula.keys()
+    otra_aula = _epcs_existentes(Producto, ajenos)
+    # Los llaveros de las personas que hacen el recuento no son inesperados
+    personas = _epcs_existentes(Persona, ajenos - otra_aula)
+    return {
+        "leidos": len(vistos),
+        "esperados": len(esperados),
+        "faltan": sorted(esperados - vistos),
+        "otra_aula": sorted(otra_aula),
+        "inesperados": sorted(ajenos - otra_aula - personas),
+        "prestados": sorted(prestados & vistos),
+    }
+
+
+def finalizar_recuento(recuento):
+    """Cierra el recuento y guarda su resultado (si ya estaba cerrado, no hace nada)."""
+    with transaction.atomic():
+        recuento = Recuento.objects.select_for_update().get(pk=recuento.pk)
+        if recuento.abierto:
+            recuento.finalizado_en = timezone.now()
+            recuento.resultado = calcular_resultado(recuento)
+            recuento.save(update_fields=["finalizado_en", "resultado"])
+    return recuento
+
+
+def informe(recuento):
+    """[(título, [(epc, Producto o None)])] de cada categoría del resultado."""
+    resultado = recuento.resultado
+    epcs = {epc for clave, _ in CATEGORIAS for epc in resultado.get(clave, ())}
+    productos = {}
+    for bloque in _en_bloques(epcs):
+        productos.update(
+            (p.epc, p)
+            for p in Producto.objects.select_related("aula").filter(epc__in=bloque)
+        )
+    return [
+        (titulo, [(epc, productos.get(epc)) for epc in resultado.get(clave, ())])
+        for clave, titulo in CATEGORIAS
+    ]
+
+
+def filas_informe(recuento):
+    """Cabecera y filas del informe para exports.export_response."""
+    yield ["Resultado", "EPC", "Producto", "Aula registrada", "Estantería"]
+    for titulo, filas in informe(recuento):
+        for epc, p in filas:
+            if p is None:
+                yield [titulo, epc, "", "", ""]
+            else:
+                yield [titulo, epc, p.nombre, p.aula.nombre, p.estanteria]
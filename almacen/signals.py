@@ -1,7 +1,12 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
-from .models import Persona
+from .access import invalidate_user_access
+from .conditional import bump_aula_versions
+from .fragments import bump_producto_versions
+from .models import Aula, Persona, Prestamo, Producto, Ubicacion
+from .thumbnails import schedule_thumbnails
 
 User = get_user_model()
 
@@ -16,7 +21,152 @@ def create_persona_for_user(sender, instance, created, **kwargs):
         Persona.objects.get_or_create(user=instance)
 
 
+# --- Invalidación del ámbito de acceso cacheado (almacen.access) ---
+
+
+def _invalidate_access_on_commit(user_ids):
+    user_ids = list(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: invalidate_user_access(user_ids))
+
+
 @receiver(post_save, sender=User)
-def save_persona_for_user(sender, instance, **kwargs):
-    if hasattr(instance, "persona"):
-        instance.persona.save()
+def invalidate_access_on_user_save(sender, instance, update_fields=None, **kwargs):
+    # El login solo actualiza last_login, que no afecta al acceso
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    _invalidate_access_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=Persona)
+@receiver(post_delete, sender=Persona)
+def invalidate_access_on_persona_change(sender, instance, **kwargs):
+    _invalidate_access_on_commit([instance.user_id])
+
+
+@receiver(m2m_changed, sender=Persona.aulas_access.through)
+def invalidate_access_on_aulas_change(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        # instance es la Persona
+        user_ids = [instance.user_id]
+    elif action == "pre_clear":
+        # instance es el Aula; hay que leer las personas antes de vaciarla
+        user_ids = instance.persona_set.values_list("user_id", flat=True)
+    else:
+        user_ids = Persona.objects.filter(pk__in=pk_set).values_list(
+            "user_id", flat=True
+        )
+    _invalidate_access_on_commit(user_ids)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_access_on_groups_change(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        # instance es el User
+        user_ids = [instance.pk]
+    elif action == "pre_clear":
+        # instance es el Group
+        user_ids = instance.user_set.values_list("pk", flat=True)
+    else:
+        user_ids = pk_set
+    _invalidate_access_on_commit(user_ids)
+
+
+# --- Invalidación de los fragmentos de producto cacheados (almacen.fragments) ---
+
+
+def _bump_fragments_on_commit(producto_ids):
+    producto_ids = list(producto_ids)
+    if producto_ids:
+        transaction.on_commit(lambda: bump_producto_versions(producto_ids))
+
+
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+def bump_fragments_on_producto_change(sender, instance, **kwargs):
+    _bump_fragments_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=Ubicacion)
+@receiver(post_delete, sender=Ubicacion)
+@receiver(post_save, sender=Prestamo)
+@receiver(post_delete, sender=Prestamo)
+def bump_fragments_on_prestamo_change(sender, instance, **kwargs):
+    _bump_fragments_on_commit([instance.producto_id])
+
+
+@receiver(post_save, sender=Aula)
+def bump_fragments_on_aula_change(sender, instance, created, **kwargs):
+    # El nombre del aula aparece en las filas de todos sus productos
+    if not created:
+        _bump_fragments_on_commit(instance.productos.values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=User)
+def bump_fragments_on_user_change(
+    sender, instance, created, update_fields=None, **kwargs
+):
+    # El nombre de quien tiene un producto en préstamo aparece en su fila
+    if created or (update_fields and set(update_fields) <= {"last_login"}):
+        return
+    _bump_fragments_on_commit(
+        Ubicacion.objects.filter(persona=instance).values_list("producto_id", flat=True)
+    )
+
+
+# --- Miniaturas de Producto.foto (almacen.thumbnails) ---
+
+
+@receiver(post_save, sender=Producto)
+def generate_thumbnails_on_new_foto(sender, instance, **kwargs):
+    if instance.__dict__.pop("_foto_pendiente", False):
+        schedule_thumbnails(instance.pk)
+
+
+# --- Versiones por aula para el GET condicional (almacen.conditional) ---
+
+
+def _bump_aulas_on_commit(aula_ids, catalogo=False):
+    aula_ids = {pk for pk in aula_ids if pk is not None}
+    if aula_ids or catalogo:
+        transaction.on_commit(lambda: bump_aula_versions(aula_ids, catalogo))
+
+
+def _producto_aula_id(instance):
+    """Aula del producto de una Ubicacion o Prestamo, sin consultar si ya está cargado."""
+    if type(instance).producto.is_cached(instance):
+        return instance.producto.aula_id
+    return (
+        Producto.objects.filter(pk=instance.producto_id)
+        .values_list("aula_id", flat=True)
+        .first()
+    )
+
+
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+def bump_aulas_on_producto_change(sender, instance, **kwargs):
+    # También el aula de la que sale si se ha movido (valor cargado de la BD)
+    _bump_aulas_on_commit([instance.aula_id, instance.get_loaded_value("aula_id")])
+
+
+@receiver(post_save, sender=Ubicacion)
+@receiver(post_delete, sender=Ubicacion)
+@receiver(post_save, sender=Prestamo)
+@receiver(post_delete, sender=Prestamo)
+def bump_aulas_on_prestamo_change(sender, instance, **kwargs):
+    _bump_aulas_on_commit([_producto_aula_id(instance)])
+
+
+@receiver(post_save, sender=Aula)
+@receiver(post_delete, sender=Aula)
+def bump_aulas_on_aula_change(sender, instance, **kwargs):
+    _bump_aulas_on_commit([instance.pk], catalogo=True)
@@ -1,4 +1,6 @@
-from django.db.models import Q
+from django.db.models import Case, OuterRef, Q, Subquery, Value, When
+
+from .models import Prestamo
 
 
 def filter_inventory(qs, q: str | None):
@@ -10,3 +12,36 @@ def filter_inventory(qs, q: str | None):
             | Q(descripcion__icontains=q)
         )
     return qs.select_related("aula", "ubicacion")  # removed aula__taller
+
+
+def with_loan_state(qs):
+    """
+    Anota en cada Producto su estado de préstamo y desde cuándo está prestado,
+    en la misma consulta (en lugar de las propiedades is_taken/taken_by, que
+    hacen una consulta por fila).
+    """
+    abierto = Prestamo.objects.filter(
+        producto=OuterRef("pk"), devuelto_en__isnull=True
+    ).order_by("-tomado_en")
+    return qs.annotate(
+        estado_prestamo=Case(
+            When(ubicacion__estado="PERSONA", then=Value("En manos")),
+            When(ubicacion__estado="ESTANTE", then=Value("En estantería")),
+            default=Value("Desconocido"),
+        ),
+        prestado_desde=Subquery(abierto.values("tomado_en")[:1]),
+    )
+
+
+def prestamo_history(qs, desde=None, hasta=None):
+    """Préstamos tomados en el rango [desde, hasta) con su estado anotado."""
+    if desde:
+        qs = qs.filter(tomado_en__gte=desde)
+    if hasta:
+        qs = qs.filter(tomado_en__lt=hasta)
+    return qs.annotate(
+        estado_prestamo=Case(
+            When(devuelto_en__isnull=True, then=Value("En préstamo")),
+            default=Value("Devuelto"),
+        )
+    )
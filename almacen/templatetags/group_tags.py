@@ -1,5 +1,7 @@
 from django import template
 
+from almacen.access import PROFESORES_GROUP, get_user_access
+
 register = template.Library()
 
 
@@ -7,4 +9,6 @@ register = template.Library()
 def in_group(user, group_name: str) -> bool:
     if not user.is_authenticated:
         return False
+    if group_name == PROFESORES_GROUP:
+        return get_user_access(user)["is_profesor"]
     return user.groups.filter(name=group_name).exists()
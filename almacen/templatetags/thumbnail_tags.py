@@ -0,0 +1,23 @@
+from django import template
+from django.core.files.storage import default_storage
+
+from almacen.thumbnails import THUMBNAIL_DISPLAY_PX, thumbnail_name, thumbnail_srcset
+
+register = template.Library()
+
+
+@register.filter
+def foto_src(producto, fmt: str = "jpeg") -> str:
+    """URL de la miniatura 1x, o de la foto original si aún no hay miniaturas."""
+    if producto.foto_hash:
+        return default_storage.url(
+            thumbnail_name(producto.foto_hash, THUMBNAIL_DISPLAY_PX, fmt)
+        )
+    return producto.foto.url if producto.foto else ""
+
+
+@register.filter
+def foto_srcset(producto, fmt: str = "jpeg") -> str:
+    if not producto.foto_hash:
+        return ""
+    return thumbnail_srcset(producto.foto_hash, fmt)
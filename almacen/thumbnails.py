@@ -0,0 +1,119 @@
+"""
+Miniaturas de Producto.foto.
+
+Las fotos que se suben desde el móvil pesan varios MB y en el inventario se
+muestran a 60 px. Para cada foto se generan recortes cuadrados en WebP y
+JPEG a 1x, 2x y 3x, con nombres derivados del hash del contenido: el mismo
+fichero nunca cambia, así que se puede cachear indefinidamente.
+
+La generación se hace fuera de la petición (hilo en segundo plano tras el
+commit) y en lote con `manage.py generate_thumbnails`. Mientras no existan,
+las plantillas usan la foto original.
+"""
+
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DISPLAY_PX = 60
+THUMBNAIL_DENSITIES = (1, 2, 3)
+THUMBNAIL_FORMATS = {
+    # formato: (extensión, opciones de Pillow)
+    "webp": ("webp", {"quality": 80, "method": 4}),
+    "jpeg": ("jpg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+THUMBNAIL_DIR = "productos/thumbs"
+THUMBNAIL_HASH_LENGTH = 16
+
+_executor = None
+
+
+def thumbnail_name(digest, size, fmt):
+    ext = THUMBNAIL_FORMATS[fmt][0]
+    return f"{THUMBNAIL_DIR}/{digest}-{size}.{ext}"
+
+
+def thumbnail_srcset(digest, fmt):
+    """Valor de srcset con las densidades generadas para un formato."""
+    return ", ".join(
+        f"{default_storage.url(thumbnail_name(digest, THUMBNAIL_DISPLAY_PX * d, fmt))} {d}x"
+        for d in THUMBNAIL_DENSITIES
+    )
+
+
+def build_thumbnails(name, storage=None):
+    """
+    Genera las miniaturas de la imagen `name` del storage y devuelve el hash
+    de su contenido. No toca la BD, así que se puede usar desde un pool de
+    procesos. Las miniaturas que ya existen no se regeneran.
+    """
+    storage = storage or default_storage
+    with storage.open(name, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()[:THUMBNAIL_HASH_LENGTH]
+
+    pending = [
+        (size, fmt)
+        for size in (THUMBNAIL_DISPLAY_PX * d for d in THUMBNAIL_DENSITIES)
+        for fmt in THUMBNAIL_FORMATS
+        if not storage.exists(thumbnail_name(digest, size, fmt))
+    ]
+    if not pending:
+        return digest
+
+    with Image.open(BytesIO(data)) as original:
+        # Las fotos del móvil vienen rotadas mediante EXIF
+        image = ImageOps.exif_transpose(original).convert("RGB")
+    for size, fmt in pending:
+        thumb = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        thumb.save(buffer, format=fmt.upper(), **THUMBNAIL_FORMATS[fmt][1])
+        storage.save(thumbnail_name(digest, size, fmt), ContentFile(buffer.getvalue()))
+    return digest
+
+
+def process_producto_foto(producto_id):
+    """Genera las miniaturas de un producto y guarda el hash en foto_hash."""
+    from .fragments import bump_producto_versions
+    from .models import Producto
+
+    name = (
+        Producto.objects.filter(pk=producto_id).values_list("foto", flat=True).first()
+    )
+    if not name:
+        return None
+    try:
+        digest = build_thumbnails(name)
+    except (OSError, Image.DecompressionBombError) as e:
+        logger.warning(f"No se pudieron generar miniaturas de {name}: {e}")
+        return None
+    # Solo si la foto no ha cambiado mientras tanto
+    if Producto.objects.filter(pk=producto_id, foto=name).update(foto_hash=digest):
+        # update() no emite señales: invalidar a mano las filas cacheadas
+        bump_producto_versions([producto_id])
+    return digest
+
+
+def _run_in_background(producto_id):
+    try:
+        process_producto_foto(producto_id)
+    except Exception:
+        logger.exception(f"Error generando miniaturas del producto {producto_id}")
+    finally:
+        close_old_connections()
+
+
+def schedule_thumbnails(producto_id):
+    """Encola la generación de miniaturas tras el commit, fuera de la petición."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thumbnails")
+    transaction.on_commit(lambda: _executor.submit(_run_in_background, producto_id))
@@ -5,16 +5,35 @@ app_name = "almacen"
 
 urlpatterns = [
     path("", views.dashboard, name="dashboard"),
+    path("contadores/", views.dashboard_counters, name="dashboard_counters"),  # HTMX
     path("inventario/", views.inventory, name="inventory"),
     path("inventario/row/<int:pk>/", views.inventory_row, name="inventory_row"),  # HTMX
+    path("inventario/exportar/", views.inventory_export, name="inventory_export"),
     path("producto/nuevo/", views.producto_create, name="producto_create"),
     path("producto/<int:pk>/editar/", views.producto_edit, name="producto_edit"),
     path("producto/<int:pk>/eliminar/", views.producto_delete, name="producto_delete"),
     path("prestamos/", views.prestamos_overview, name="prestamos_overview"),
+    path(
+        "prestamos/devolver-todo/",
+        views.prestamos_devolver_todo,
+        name="prestamos_devolver_todo",
+    ),
+    path("prestamos/exportar/", views.prestamos_export, name="prestamos_export"),
     path("toggle-prestamo/<int:pk>/", views.toggle_prestamo, name="toggle_prestamo"),
     path("aulas/", views.aulas_list_create, name="aulas"),
     path("set-aula/", views.set_current_aula, name="set_current_aula"),
     path("producto/nuevo/", views.producto_create, name="producto_create"),
     path("get-latest-epc/", views.get_latest_epc, name="get_latest_epc"),
+    # Server-Sent Events (servidos por ASGI, ver servidor/README.md)
+    path("eventos/epc/", views.epc_stream, name="epc_stream"),
+    path("eventos/productos/", views.productos_stream, name="productos_stream"),
+    path("recuentos/", views.recuentos, name="recuentos"),
+    path("recuentos/<int:pk>/", views.recuento_detalle, name="recuento_detalle"),
+    path(
+        "recuentos/<int:pk>/finalizar/",
+        views.recuento_finalizar,
+        name="recuento_finalizar",
+    ),
     path("persona/asignar-epc/", views.persona_assign_epc, name="persona_assign_epc"),
+    path("perfilado/", views.profiling, name="profiling"),  # solo staff
 ]
@@ -1,166 +1,259 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.core.cache import caches
-from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
+from django.db.models import Count, Q
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, redirect, render
+from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.views.decorators.http import require_POST
 
-from .decorators import profesores_required
+from .access import get_access_scope
+from .conditional import conditional_page
+from .decorators import profesores_required, user_in_group_profesores
+from .events import (
+    EPC_CHANNEL_FORMAT,
+    LATEST_EPC_KEY_FORMAT,
+    PRODUCTO_CHANNEL_FORMAT,
+    aget_latest_epc,
+    get_epc_cache,
+    publish_producto_change,
+    sse_message,
+    sse_stream,
+)
+from .exports import (
+    EXPORT_FORMATS,
+    INVENTORY_COLUMNS,
+    PRESTAMO_COLUMNS,
+    export_response,
+    export_rows,
+)
 from .forms import AulaForm, PersonaEPCForm, ProductoForm
-from .models import Aula, Persona, Prestamo, Producto, Ubicacion
-from .tables import filter_inventory
+from .fragments import render_producto_fragments
+from .models import Aula, Persona, Prestamo, Producto, Recuento, Ubicacion
+from .perf import query_budget
+from .prestamos import checkin, checkout
+from .profiling import PROFILE_COOKIE, read_log, slowest_endpoints
+from .recuentos import filas_informe, finalizar_recuento, iniciar_recuento, informe
+from .tables import filter_inventory, prestamo_history, with_loan_state
+
+# --- Perfilado ---
+PROFILING_DEFAULT_HOURS = 24
+PROFILING_MAX_HOURS = 7 * 24
 
 # --- Configuración de Caché ---
-CACHE_KEY_FORMAT = "last_epc:{}"
+CACHE_KEY_FORMAT = LATEST_EPC_KEY_FORMAT
 CACHE_LIFETIME_SECONDS = 30  # La ventana de tiempo para filtrar
 
-# Obtener la instancia del caché específico
-epc_cache = caches["epc_cache"]  #
-
 
 def is_teacher(user):
-    return user.is_authenticated and user.groups.filter(name="ProfesoresFP").exists()
+    return user_in_group_profesores(user)
 
 
 def get_current_aula(request):
     """Prioridad: GET ?aula -> sesión -> Persona.last_aula del usuario (con control de acceso)."""
-    aula_id = request.GET.get("aula")
-    if aula_id:
-        try:
-            aula = Aula.objects.get(pk=aula_id)
-            if request.user and request.user.is_authenticated:
-                try:
-                    persona = request.user.persona
-                    if persona.has_aula_access(aula):
-                        return aula
-                except Persona.DoesNotExist:
-                    pass
-            return None
-        except Aula.DoesNotExist:
-            return None
-    # session
-    sid = request.session.get("current_aula_id")
-    if sid:
-        try:
-            aula = Aula.objects.get(pk=sid)
-            if request.user and request.user.is_authenticated:
-                try:
-                    persona = request.user.persona
-                    if persona.has_aula_access(aula):
-                        return aula
-                except Persona.DoesNotExist:
-                    pass
-            return None
-        except Aula.DoesNotExist:
-            pass
-    # user preference
-    if request.user and request.user.is_authenticated:
-        try:
-            persona = request.user.persona
-            return persona.last_aula  # puede ser None
-        except Persona.DoesNotExist:
-            pass
-    return None
+    return get_access_scope(request).current_aula
 
 
-@login_required
-def dashboard(request):
+def _dashboard_queryset(request):
+    """Productos que resume el panel (aula actual o aulas accesibles)."""
     # Apply access control for non-staff users
     qs = Producto.objects.all()
-    current_aula = get_current_aula(request)
+    scope = get_access_scope(request)
+    current_aula = scope.current_aula
+
+    if not scope.has_persona:
+        qs = qs.none()
+    elif not scope.is_staff:
+        if current_aula:
+            # Filter by current aula if user has access
+            if scope.has_aula_access(current_aula):
+                qs = qs.filter(aula=current_aula)
+            else:
+                qs = qs.none()
+        else:
+            # Show all products from accessible aulas
+            qs = qs.filter(aula_id__in=scope.aula_ids)
+    return qs
+
 
-    if request.user.is_authenticated:
-        try:
-            persona = request.user.persona
-            if not persona.user.is_staff:
-                # For non-staff users, filter by accessible aulas
-                accessible_aulas = persona.get_aulas_access()
-                if current_aula:
-                    # Filter by current aula if user has access
-                    if persona.has_aula_access(current_aula):
-                        qs = qs.filter(aula=current_aula)
-                    else:
-                        qs = qs.none()
-                else:
-                    # Show all products from accessible aulas
-                    qs = qs.filter(aula__in=accessible_aulas)
-        except Persona.DoesNotExist:
-            qs = qs.none()
-
-    total = qs.count()
-    en_manos = qs.filter(ubicacion__estado="PERSONA").count()
-    en_estante = total - en_manos
-    recientes = qs.order_by("-creado")[:8]
+# Contadores del panel en una sola consulta
+DASHBOARD_COUNTERS = {
+    "total": Count("pk"),
+    "en_manos": Count("pk", filter=Q(ubicacion__estado="PERSONA")),
+}
+
+
+def _counters_context(counters):
+    return {**counters, "en_estante": counters["total"] - counters["en_manos"]}
+
+
+@query_budget(4)
+@login_required
+@conditional_page
+def dashboard(request):
+    qs = _dashboard_queryset(request)
     ctx = {
-        "total": total,
-        "en_manos": en_manos,
-        "en_estante": en_estante,
-        "recientes": recientes,
+        **_counters_context(qs.aggregate(**DASHBOARD_COUNTERS)),
+        "recientes": qs.select_related("aula").order_by("-creado")[:8],
     }
     return render(request, "almacen/dashboard.html", ctx)
 
 
 @login_required
-def inventory(request):
-    """Main inventory view with access control."""
+@conditional_page
+async def dashboard_counters(request):
+    """
+    Contadores del panel (HTMX, cada 30 s). Asíncrona y con GET condicional:
+    mientras no cambie nada en las aulas se responde 304 sin consultar.
+    """
+    qs = _dashboard_queryset(request)
+    counters = await qs.aaggregate(**DASHBOARD_COUNTERS)
+    html = render_to_string(
+        "almacen/_dashboard_counters.partial.html",
+        {**_counters_context(counters), "refresco": True},
+    )
+    return HttpResponse(html)
+
+
+def _inventory_queryset(request):
+    """Productos visibles en el inventario (control de acceso y aula actual)."""
     qs = Producto.objects.all()
-    current_aula = get_current_aula(request)
+    scope = get_access_scope(request)
+    current_aula = scope.current_aula
 
     # Aplicar control de acceso
-    if request.user.is_authenticated:
-        try:
-            persona = request.user.persona
-            if not persona.user.is_staff:
-                # Para usuarios no staff, filtrar por aulas accesibles
-                accessible_aulas = persona.get_aulas_access()
-                if current_aula:
-                    # Si hay un aula actual, solo mostrar productos de ese aula
-                    # si el usuario tiene acceso a él
-                    if persona.has_aula_access(current_aula):
-                        qs = qs.filter(aula=current_aula)
-                    else:
-                        qs = qs.none()
-                else:
-                    # Mostrar todos los productos de aulas accesibles
-                    qs = qs.filter(aula__in=accessible_aulas)
-            else:
-                # Los usuarios staff pueden ver todos los productos, pero filtrar por aula actual si está establecida
-                if current_aula:
-                    qs = qs.filter(aula=current_aula)
-        except Persona.DoesNotExist:
-            qs = qs.none()
-    else:
+    if not scope.has_persona:
         qs = qs.none()
+    elif not scope.is_staff:
+        # Para usuarios no staff, filtrar por aulas accesibles
+        if current_aula:
+            # Si hay un aula actual, solo mostrar productos de ese aula
+            # si el usuario tiene acceso a él
+            if scope.has_aula_access(current_aula):
+                qs = qs.filter(aula=current_aula)
+            else:
+                qs = qs.none()
+        else:
+            # Mostrar todos los productos de aulas accesibles
+            qs = qs.filter(aula_id__in=scope.aula_ids)
+    elif current_aula:
+        # Los usuarios staff pueden ver todos los productos, pero filtrar por aula actual si está establecida
+        qs = qs.filter(aula=current_aula)
+
+    return filter_inventory(qs, request.GET.get("q"))
 
-    qs = filter_inventory(qs, request.GET.get("q"))
+
+@query_budget(3)
+@login_required
+@conditional_page
+def inventory(request):
+    """Main inventory view with access control."""
+    fragments = render_producto_fragments(request, _inventory_queryset(request))
     ctx = {
-        "productos": qs,
+        "filas": fragments["row"],
+        "tarjetas": fragments["card"],
         "q": request.GET.get("q", ""),
-        "current_aula": current_aula,
+        "current_aula": get_access_scope(request).current_aula,
     }
     return render(request, "almacen/inventory.html", ctx)
 
 
+def _export_format(request):
+    fmt = request.GET.get("formato", "csv")
+    return fmt if fmt in EXPORT_FORMATS else None
+
+
 @login_required
-def inventory_row(request, pk: int):
-    producto = get_object_or_404(
-        Producto.objects.select_related("ubicacion", "aula"), pk=pk
+def inventory_export(request):
+    """Descarga del inventario (mismo filtro que la página) en CSV o XLSX."""
+    fmt = _export_format(request)
+    if fmt is None:
+        return HttpResponseBadRequest("Formato no soportado.")
+    qs = with_loan_state(_inventory_queryset(request)).order_by(
+        "aula__nombre", "nombre"
+    )
+    filename = f"inventario-{timezone.localdate():%Y%m%d}"
+    return export_response(export_rows(qs, INVENTORY_COLUMNS), filename, fmt)
+
+
+@profesores_required
+def prestamos_export(request):
+    """Descarga del historial de préstamos entre ?desde y ?hasta (inclusive)."""
+    fmt = _export_format(request)
+    try:
+        desde = _parse_day(request.GET.get("desde"))
+        hasta = _parse_day(request.GET.get("hasta"))
+    except ValueError:
+        return HttpResponseBadRequest("Fecha no válida (AAAA-MM-DD).")
+    if fmt is None:
+        return HttpResponseBadRequest("Formato no soportado.")
+
+    qs = Prestamo.objects.order_by("tomado_en")
+    scope = get_access_scope(request)
+    if not scope.is_staff:
+        qs = qs.filter(producto__aula_id__in=scope.aula_ids)
+    qs = prestamo_history(
+        qs,
+        desde=_start_of_day(desde) if desde else None,
+        hasta=_start_of_day(hasta + timedelta(days=1)) if hasta else None,
     )
+    filename = "prestamos" + "".join(f"-{d:%Y%m%d}" for d in (desde, hasta) if d)
+    return export_response(export_rows(qs, PRESTAMO_COLUMNS), filename, fmt)
+
+
+def _parse_day(value):
+    if not value:
+        return None
+    day = parse_date(value)
+    if day is None:
+        raise ValueError(value)
+    return day
+
+
+def _start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+
+def _inventory_row_html(request, producto):
+    return render_producto_fragments(request, [producto], kinds=("row",))["row"][0]
+
+
+@query_budget(3)
+@login_required
+@conditional_page
+async def inventory_row(request, pk: int):
+    """
+    Fila del inventario (HTMX). Asíncrona: el GET condicional, el producto y
+    el control de acceso no bloquean el bucle de eventos.
+    """
+    producto = await (
+        Producto.objects.select_related("ubicacion__persona", "aula")
+        .filter(pk=pk)
+        .afirst()
+    )
+    if producto is None:
+        raise Http404("Producto no encontrado.")
 
     # Verificar permisos de acceso para usuarios no staff
-    if request.user.is_authenticated:
-        try:
-            persona = request.user.persona
-            if not persona.has_aula_access(producto.aula):
-                return HttpResponse(status=403)  # Prohibido
-        except Persona.DoesNotExist:
-            return HttpResponse(status=403)  # Prohibido
+    if not get_access_scope(request).has_aula_access(producto.aula_id):
+        return HttpResponse(status=403)  # Prohibido
 
-    return render(request, "almacen/_product_row.partial.html", {"p": producto})
+    # Solo renderiza si el fragmento no está en caché
+    fila = await sync_to_async(_inventory_row_html)(request, producto)
+    return HttpResponse(fila)
 
 
 @profesores_required
@@ -176,13 +269,12 @@ def producto_create(request):
     initial_epc = None
     if current_aula:
         cache_key = CACHE_KEY_FORMAT.format(current_aula.pk)
-        data = epc_cache.get(cache_key)
+        data = get_epc_cache().get(cache_key)
 
         if data and data.get("epc") and data.get("leido_en"):
             # leido_en es un objeto datetime aware (del sensor)
             leido_en = data["leido_en"]
             time_limit = timezone.now() - timedelta(seconds=CACHE_LIFETIME_SECONDS)
-            print(leido_en, time_limit)
             # Solo si la lectura está dentro del límite de 30 segundos DESDE LA HORA DEL SENSOR
             if leido_en >= time_limit:
                 initial_epc = data["epc"]
@@ -222,29 +314,32 @@ def producto_create(request):
 
 
 @login_required
-def get_latest_epc(request):
+async def get_latest_epc(request):
     """
     Endpoint HTMX que devuelve el fragmento HTML con el último EPC leído
     que ha cambiado en los últimos 30 segundos, incluyendo el timestamp del sensor.
+
+    Es asíncrono (ORM y caché async): servido por ASGI, los sondeos esperando
+    a Redis no ocupan hilos de uWSGI. Lee la misma entrada de epc_cache que
+    producto_create.
     """
-    current_aula = get_current_aula(request)
+    scope = await get_access_scope(request).aprefetch()
+    current_aula = scope.current_aula
     if not current_aula:
         return HttpResponse(status=204)
     latest_epc = ""
     latest_time = None
 
-    if current_aula:
-        cache_key = CACHE_KEY_FORMAT.format(current_aula.pk)
-        data = epc_cache.get(cache_key)  # Obtener el diccionario del caché
-
-        if data and data.get("epc") and data.get("leido_en"):
-            leido_en = data["leido_en"]  # datetime object aware
-            time_limit = timezone.now() - timedelta(seconds=CACHE_LIFETIME_SECONDS)
+    data = await aget_latest_epc(current_aula.pk)
+    if data and data.get("epc") and data.get("leido_en"):
+        # leido_en es un objeto datetime aware (del sensor)
+        leido_en = data["leido_en"]
+        time_limit = timezone.now() - timedelta(seconds=CACHE_LIFETIME_SECONDS)
 
-            # Verificar que el timestamp del sensor esté dentro de los 30 segundos
-            if leido_en >= time_limit:
-                latest_epc = data["epc"]
-                latest_time = leido_en
+        # Verificar que el timestamp del sensor esté dentro de los 30 segundos
+        if leido_en >= time_limit:
+            latest_epc = data["epc"]
+            latest_time = leido_en
 
     # El valor actual del campo EPC en el formulario, enviado por hx-vals
     current_form_epc = request.GET.get("current_epc", "")
@@ -256,20 +351,123 @@ def get_latest_epc(request):
         )  # 204 No Content (No hay cambios o no hay EPC válido)
 
     # Si hay un EPC nuevo, renderizamos el partial con el aviso de tiempo.
-    return render(
-        request,
+    html = render_to_string(
         "almacen/_epc_input.partial.html",
         {
             "latest_epc": latest_epc,
             "latest_time": latest_time,  # Esto se usa para mostrar el mensaje de aviso
         },
     )
+    return HttpResponse(html)
+
+
+@login_required
+async def epc_stream(request):
+    """
+    Server-Sent Events con cada EPC leído en el aula actual, en cuanto el
+    listener lo publica. Sustituye al sondeo periódico de get_latest_epc.
+    """
+    current_aula = await sync_to_async(get_current_aula)(request)
+    if not current_aula:
+        # 204 indica a EventSource que no vuelva a conectar
+        return HttpResponse(status=204)
+
+    async def render_epc(payload):
+        html = render_to_string(
+            "almacen/_epc_input.partial.html",
+            {
+                "latest_epc": payload["epc"],
+                "latest_time": parse_datetime(payload["leido_en"]),
+            },
+        )
+        return sse_message(html, event="epc")
+
+    response = StreamingHttpResponse(
+        sse_stream([EPC_CHANNEL_FORMAT.format(current_aula.pk)], render_epc),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # nginx: no almacenar en búfer
+    return response
+
+
+def _live_aula_ids(request, vista):
+    """Aulas cuyos cambios se muestran en la vista (mismo filtro que la página)."""
+    scope = get_access_scope(request)
+    if not scope.has_persona:
+        return frozenset()
+    if vista == "inventario":
+        current_aula = scope.current_aula
+        if current_aula:
+            if scope.has_aula_access(current_aula):
+                return frozenset({current_aula.pk})
+            return frozenset()
+    return scope.aula_ids
+
+
+def _render_live_row(request, vista, aula_ids, producto_id):
+    """Fila actualizada de un producto para un suscriptor, o su eliminación."""
+    if vista == "prestamos":
+        u = (
+            Ubicacion.objects.select_related("producto", "persona")
+            .filter(
+                producto_id=producto_id,
+                estado="PERSONA",
+                producto__aula_id__in=aula_ids,
+            )
+            .first()
+        )
+        if u is None:
+            return sse_message(f"prestamo-{producto_id}", event="row-removed")
+        html = render_to_string(
+            "almacen/_prestamo_row.partial.html", {"u": u}, request=request
+        )
+        return sse_message(html, event="row")
+
+    p = (
+        Producto.objects.select_related("ubicacion", "aula")
+        .filter(pk=producto_id, aula_id__in=aula_ids)
+        .first()
+    )
+    if p is None:
+        return sse_message(f"row-{producto_id}", event="row-removed")
+    html = render_to_string(
+        "almacen/_product_row.partial.html", {"p": p}, request=request
+    )
+    return sse_message(html, event="row")
+
+
+@login_required
+async def productos_stream(request):
+    """
+    Server-Sent Events con las filas de productos que cambian (préstamos,
+    devoluciones, ediciones y borrados) en las aulas visibles para el usuario.
+    """
+    vista = "prestamos" if request.GET.get("vista") == "prestamos" else "inventario"
+    aula_ids = await sync_to_async(_live_aula_ids)(request, vista)
+    if not aula_ids:
+        # 204 indica a EventSource que no vuelva a conectar
+        return HttpResponse(status=204)
+
+    async def render_change(payload):
+        return await sync_to_async(_render_live_row)(
+            request, vista, aula_ids, payload["producto_id"]
+        )
+
+    channels = [PRODUCTO_CHANNEL_FORMAT.format(pk) for pk in sorted(aula_ids)]
+    response = StreamingHttpResponse(
+        sse_stream(channels, render_change), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # nginx: no almacenar en búfer
+    return response
 
 
 @profesores_required
 def producto_edit(request, pk: int):
     p = get_object_or_404(Producto, pk=pk)
     if request.method == "POST":
+        old_aula_id = p.aula_id  # type: ignore[attr-defined]
         form = ProductoForm(request.POST, request.FILES, instance=p)
         if form.is_valid():
             p = form.save()
@@ -283,6 +481,7 @@ def producto_edit(request, pk: int):
                     u.save()
             except Ubicacion.DoesNotExist:
                 pass
+            publish_producto_change(p.pk, old_aula_id, p.aula_id)  # type: ignore[attr-defined]
             messages.success(request, "Producto actualizado.")
             if request.htmx:
                 resp = HttpResponse(status=204)
@@ -297,7 +496,9 @@ def producto_edit(request, pk: int):
 @profesores_required
 def producto_delete(request, pk: int):
     p = get_object_or_404(Producto, pk=pk)
+    producto_id, aula_id = p.pk, p.aula_id  # type: ignore[attr-defined]
     p.delete()
+    publish_producto_change(producto_id, aula_id)
     messages.success(request, "Producto eliminado.")
     if request.htmx:
         # HX-Trigger to remove row on client side can be handled by id target
@@ -305,27 +506,73 @@ def producto_delete(request, pk: int):
     return redirect("almacen:inventory")
 
 
-@login_required
-def prestamos_overview(request):
+def _prestamos_queryset(request):
+    """Ubicaciones en manos de alguien visibles para el usuario."""
     # Who currently has products (Ubicacion.estado=PERSONA)
     ubicaciones = Ubicacion.objects.select_related("producto", "persona").filter(
         estado="PERSONA"
     )
 
     # Filter by accessible aulas for non-staff users
-    if request.user.is_authenticated and not request.user.is_staff:
-        try:
-            persona = request.user.persona
-            accessible_aulas = persona.get_aulas_access()
-            ubicaciones = ubicaciones.filter(producto__aula__in=accessible_aulas)
-        except Persona.DoesNotExist:
+    scope = get_access_scope(request)
+    if scope.is_authenticated and not scope.is_staff:
+        if not scope.has_persona:
             ubicaciones = ubicaciones.none()
+        else:
+            ubicaciones = ubicaciones.filter(producto__aula_id__in=scope.aula_ids)
+    return ubicaciones
+
+
+def _prestamos_context(request, **extra):
+    ubicaciones = list(_prestamos_queryset(request))
+    # Productos por persona identificada, para "devolver todo" de cada una
+    personas = {}
+    for u in ubicaciones:
+        if u.persona_id is not None:
+            personas.setdefault(u.persona_id, [u.persona, 0])[1] += 1
+    return {
+        "ubicaciones": ubicaciones,
+        "personas": [tuple(p) for p in personas.values()],
+        **extra,
+    }
+
 
+@query_budget(3)
+@login_required
+@conditional_page
+def prestamos_overview(request):
     return render(
-        request, "almacen/prestamos_overview.html", {"ubicaciones": ubicaciones}
+        request, "almacen/prestamos_overview.html", _prestamos_context(request)
     )
 
 
+@profesores_required
+@require_POST
+def prestamos_devolver_todo(request):
+    """
+    Devuelve de una vez todo lo prestado de la lista (o solo lo de la persona
+    indicada) con una única operación del servicio de préstamos.
+    """
+    ubicaciones = _prestamos_queryset(request)
+    persona_id = request.POST.get("persona", "")
+    if persona_id:
+        if not persona_id.isdigit():
+            return HttpResponseBadRequest("Persona no válida.")
+        ubicaciones = ubicaciones.filter(persona_id=persona_id)
+    devueltos = checkin(ubicaciones.values_list("producto_id", flat=True))
+
+    if request.htmx:
+        # Una sola respuesta: la lista se sustituye fuera de banda
+        return render(
+            request,
+            "almacen/_prestamos_list.partial.html",
+            _prestamos_context(request, oob=True, devueltos=len(devueltos)),
+        )
+    messages.success(request, f"Se han devuelto {len(devueltos)} productos.")
+    return redirect("almacen:prestamos_overview")
+
+
+@query_budget(9)
 @login_required
 def toggle_prestamo(request, pk: int):
     producto = get_object_or_404(
@@ -333,53 +580,37 @@ def toggle_prestamo(request, pk: int):
     )
 
     # Verificar permisos de acceso para usuarios no staff
-    if request.user.is_authenticated:
-        try:
-            persona = request.user.persona
-            if not persona.has_aula_access(producto.aula):
-                return HttpResponseBadRequest(
-                    "No tienes acceso a productos de esta aula."
-                )
-        except Persona.DoesNotExist:
-            return HttpResponseBadRequest("No tienes acceso a productos de esta aula.")
+    if not get_access_scope(request).has_aula_access(producto.aula_id):
+        return HttpResponseBadRequest("No tienes acceso a productos de esta aula.")
 
     try:
         u = producto.ubicacion  # type: ignore[attr-defined]
     except Ubicacion.DoesNotExist:
-        u = Ubicacion.objects.create(
-            producto=producto, estado="ESTANTE", aula=producto.aula
-        )
+        u = None
 
-    if u.estado == "ESTANTE":
-        u.estado = "PERSONA"
-        u.persona = request.user
-        u.tomado_en = timezone.now()
-        u.save()
-        Prestamo.objects.create(producto=producto, usuario=request.user)
-        messages.success(request, "Has tomado el producto.")
-    else:
-        if u.persona == request.user or is_teacher(request.user):
-            u.estado = "ESTANTE"
-            u.persona = None
-            u.aula = producto.aula
-            u.estanteria = producto.estanteria
-            u.posicion = producto.posicion
-            u.save()
-            prestamo = (
-                Prestamo.objects.filter(producto=producto, devuelto_en__isnull=True)
-                .order_by("-tomado_en")
-                .first()
-            )
-            if prestamo:
-                prestamo.devuelto_en = timezone.now()
-                prestamo.save()
+    # El servicio relee el estado con bloqueo: si una lectura RFID se ha
+    # adelantado, no se presta ni se devuelve dos veces
+    if u is None or u.estado == "ESTANTE":
+        if checkout([producto], request.user):
+            messages.success(request, "Has tomado el producto.")
+        else:
+            messages.error(request, "El producto ya está prestado.")
+    elif u.persona_id == request.user.pk or is_teacher(request.user):
+        # Sin ser profesor, solo si sigue prestado a este usuario con el bloqueo
+        # tomado: entre tanto se puede haber devuelto y prestado a otra persona
+        persona = None if is_teacher(request.user) else request.user
+        if checkin([producto], persona=persona):
             messages.success(request, "Producto devuelto al estante.")
         else:
-            return HttpResponseBadRequest(
-                "No puedes devolver un producto que no tienes."
-            )
+            messages.error(request, "El producto ya no está en tus manos.")
+    else:
+        return HttpResponseBadRequest("No puedes devolver un producto que no tienes.")
     if request.htmx:
-        return inventory_row(request, producto.pk)
+        # Fila con el estado recién guardado
+        producto = Producto.objects.select_related("ubicacion__persona", "aula").get(
+            pk=producto.pk
+        )
+        return HttpResponse(_inventory_row_html(request, producto))
     return HttpResponseRedirect(reverse("almacen:inventory"))
 
 
@@ -437,7 +668,7 @@ def persona_assign_epc(request):
     initial_epc = ""
     # We don't need current_aula here, EPC is global for personas
     cache_key = CACHE_KEY_FORMAT.format(1)  # Using a fixed key for now
-    data = epc_cache.get(cache_key)
+    data = get_epc_cache().get(cache_key)
 
     if data and data.get("epc") and data.get("leido_en"):
         leido_en = data["leido_en"]
@@ -463,3 +694,113 @@ def persona_assign_epc(request):
         "almacen/persona_assign_epc.html",
         {"form": form},
     )
+
+
+@profesores_required
+def recuentos(request):
+    """Listado de recuentos de las aulas accesibles y alta de uno nuevo."""
+    scope = get_access_scope(request)
+    if request.method == "POST":
+        aula_id = request.POST.get("aula_id")
+        aula = next((a for a in scope.aulas if str(a.pk) == aula_id), None)
+        if aula is None:
+            messages.error(request, "Aula no encontrada o sin acceso.")
+            return redirect("almacen:recuentos")
+        recuento = iniciar_recuento(aula, request.user)
+        messages.success(
+            request,
+            f"Recuento iniciado en {aula.nombre}: pasa el lector por las estanterías.",
+        )
+        return redirect("almacen:recuento_detalle", pk=recuento.pk)
+
+    qs = Recuento.objects.select_related("aula", "iniciado_por").filter(
+        aula_id__in=scope.aula_ids
+    )
+    ctx = {
+        "recuentos": qs[:50],
+        "aulas": scope.aulas,
+        "current_aula": scope.current_aula,
+    }
+    return render(request, "almacen/recuentos.html", ctx)
+
+
+@profesores_required
+def recuento_detalle(request, pk: int):
+    """Progreso de un recuento abierto o informe de uno finalizado (?formato=csv|xlsx)."""
+    recuento = get_object_or_404(
+        Recuento.objects.select_related("aula", "iniciado_por"), pk=pk
+    )
+    if not get_access_scope(request).has_aula_access(recuento.aula_id):  # type: ignore[attr-defined]
+        return HttpResponse(status=403)
+
+    if recuento.abierto:
+        leidos = recuento.lecturas.count()  # type: ignore[attr-defined]
+        if request.htmx:
+            # Contador que se refresca mientras se recorre el aula
+            return HttpResponse(str(leidos))
+        return render(
+            request,
+            "almacen/recuento_detalle.html",
+            {"recuento": recuento, "leidos": leidos},
+        )
+
+    if "formato" in request.GET:
+        fmt = _export_format(request)
+        if fmt is None:
+            return HttpResponseBadRequest("Formato no soportado.")
+        filename = f"recuento-{recuento.pk}-{recuento.iniciado_en:%Y%m%d}"
+        return export_response(filas_informe(recuento), filename, fmt)
+
+    return render(
+        request,
+        "almacen/recuento_detalle.html",
+        {"recuento": recuento, "secciones": informe(recuento)},
+    )
+
+
+@profesores_required
+@require_POST
+def recuento_finalizar(request, pk: int):
+    recuento = get_object_or_404(Recuento, pk=pk)
+    if not get_access_scope(request).has_aula_access(recuento.aula_id):  # type: ignore[attr-defined]
+        return HttpResponse(status=403)
+    finalizar_recuento(recuento)
+    messages.success(request, "Recuento finalizado.")
+    return redirect("almacen:recuento_detalle", pk=recuento.pk)
+
+
+@staff_member_required
+def profiling(request):
+    """
+    Endpoints más lentos de las últimas horas según el log de perfilado
+    (?horas=N). El POST activa o desactiva el perfilado de las peticiones del
+    propio usuario con una cookie que ProfilingMiddleware solo acepta de staff.
+    """
+    if request.method == "POST":
+        response = redirect("almacen:profiling")
+        if PROFILE_COOKIE in request.COOKIES:
+            response.delete_cookie(PROFILE_COOKIE)
+        else:
+            response.set_cookie(
+                PROFILE_COOKIE,
+                "1",
+                max_age=8 * 3600,
+                secure=request.is_secure(),
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+    try:
+        hours = int(request.GET.get("horas", PROFILING_DEFAULT_HOURS))
+    except ValueError:
+        hours = PROFILING_DEFAULT_HOURS
+    hours = min(max(hours, 1), PROFILING_MAX_HOURS)
+    ctx = {
+        "endpoints": slowest_endpoints(read_log(hours)),
+        "hours": hours,
+        "profiling_on": PROFILE_COOKIE in request.COOKIES,
+        "enabled": settings.PROFILING_ENABLED,
+        "sample_rate": settings.PROFILING_SAMPLE_RATE,
+    }
+    return render(request, "almacen/profiling.html", ctx)
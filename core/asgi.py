@@ -3,6 +3,11 @@ ASGI config for core project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+In production it serves the long-lived Server-Sent Events endpoints
+(/almacen/eventos/) and the async polling/partial views (get_latest_epc,
+inventory_row, dashboard_counters) under uvicorn, next to uWSGI (see
+servidor/README.md).
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -55,12 +55,19 @@ SITE_ID = 1
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    # Solo activo con DEBUG: avisa de las peticiones que superan el
+    # @query_budget de su vista (cuenta también las consultas de sesión y auth).
+    # Debajo de WhiteNoise, que es solo síncrono, para quedar en la parte async
+    "almacen.middleware.QueryBudgetMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django_htmx.middleware.HtmxMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "allauth.account.middleware.AccountMiddleware",
+    # Server-Timing y log de las peticiones perfiladas (almacen/profiling.py)
+    "almacen.middleware.ProfilingMiddleware",
+    "almacen.middleware.AccessScopeMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -96,6 +103,16 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "almacen_fp.sqlite3",
+        "OPTIONS": {
+            # uWSGI y el listener escriben a la vez: cada atomic() toma el bloqueo
+            # de escritura al empezar (ver almacen/prestamos.py) y espera por él
+            # en lugar de fallar con "database is locked"
+            "transaction_mode": "IMMEDIATE",
+            "timeout": 20,
+        },
+        # BD de pruebas en fichero: la de memoria compartida no espera por los
+        # bloqueos y las pruebas de concurrencia necesitan que lo haga
+        "TEST": {"NAME": BASE_DIR / "test_almacen_fp.sqlite3"},
     }
 }
 
@@ -215,6 +232,10 @@ DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", "almacen@santiagoapostol.ne
 
 
 # settings.py
+# CACHE_BACKEND: "redis" (por defecto), o "locmem"/"fakeredis" para pruebas
+# sin servidor Redis; ambos cambian también el valor por defecto de
+# EVENTS_REDIS_URL (memory:// o fakeredis://, ver almacen/events.py)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "redis")
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
@@ -231,9 +252,71 @@ CACHES = {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         },
     },
+    "sessions": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": os.getenv("SESSION_REDIS_URL", "redis://127.0.0.1:6379/3"),
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            # Si Redis no responde, "cached_db" sigue funcionando con SQLite
+            "IGNORE_EXCEPTIONS": True,
+        },
+    },
 }
+if CACHE_BACKEND == "locmem":
+    CACHES = {
+        alias: {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": f"almacen-{alias}",
+        }
+        for alias in CACHES
+    }
+elif CACHE_BACKEND == "fakeredis":
+    # django-redis con conexiones de fakeredis (pip install fakeredis)
+    from fakeredis import FakeConnection
+
+    for cache in CACHES.values():
+        cache["OPTIONS"]["CONNECTION_POOL_KWARGS"] = {
+            "connection_class": FakeConnection
+        }
 # Usaremos "epc_cache" en el código.
 
+# Sesiones: "cached_db" (por defecto) lee de Redis y solo escribe en SQLite
+# cuando la sesión cambia; "cache" las guarda solo en Redis (ni lecturas ni
+# escrituras en django_session, pero se pierden si se vacía Redis); "db" es
+# el comportamiento original. Al cambiar a "cache": manage.py migrate_sessions
+SESSION_STORE = os.getenv("SESSION_STORE", "cached_db")
+SESSION_ENGINE = f"django.contrib.sessions.backends.{SESSION_STORE}"
+SESSION_CACHE_ALIAS = "sessions"
+DJANGO_REDIS_LOG_IGNORED_EXCEPTIONS = True
+
+# Redis pub/sub para los eventos en vivo (SSE) que publica el listener MQTT
+EVENTS_REDIS_URL = os.getenv(
+    "EVENTS_REDIS_URL",
+    {"locmem": "memory://", "fakeredis": "fakeredis://"}.get(
+        CACHE_BACKEND, "redis://127.0.0.1:6379/2"
+    ),
+)
+
+# Bus de ingesta opcional con Redis Streams (almacen/ingest.py): mqtt_bridge
+# reparte las lecturas por aula en INGEST_PARTITIONS streams y uno o varios
+# ingest_worker las procesan. Cada stream guarda como mucho unas
+# INGEST_STREAM_MAXLEN lecturas; los workers avisan en el log si quedan más de
+# INGEST_LAG_WARNING lecturas sin leer
+INGEST_REDIS_URL = os.getenv("INGEST_REDIS_URL", EVENTS_REDIS_URL)
+INGEST_PARTITIONS = int(os.getenv("INGEST_PARTITIONS", 4))
+INGEST_STREAM_MAXLEN = int(os.getenv("INGEST_STREAM_MAXLEN", 1_000_000))
+INGEST_LAG_WARNING = int(os.getenv("INGEST_LAG_WARNING", 1000))
+
+# Perfilado por petición (almacen/profiling.py, informe en /perfilado/ para
+# staff). Se perfilan las peticiones de staff con la cabecera X-Almacen-Profile
+# o con el perfilado activado en esa página, y una fracción
+# PROFILING_SAMPLE_RATE (0 a 1) de todas. Con PROFILING_ENABLED=False el
+# middleware ni se carga
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "True") == "True"
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0))
+PROFILING_LOG = os.getenv("PROFILING_LOG", str(BASE_DIR / "logs" / "profiling.jsonl"))
+PROFILING_LOG_MAX_BYTES = 5 * 1024 * 1024
+
 # Whitenoise
 STORAGES = {
     "staticfiles": {
@@ -0,0 +1,163 @@
+"""Pruebas del AccessScope: Persona, aulas accesibles y aula actual resueltas una vez por petición."""
+
+import pytest
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core.cache import caches
+from django.test import RequestFactory, TestCase, override_settings
+
+from almacen.access import get_access_scope
+from almacen.context_processors import aula_context
+from almacen.decorators import user_in_group_profesores
+from almacen.local_redis import locmem_caches
+from almacen.models import Aula
+from almacen.views import get_current_aula
+
+LOCMEM_CACHES = locmem_caches("test-access-scope")
+
+
+@pytest.mark.django_db
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestAccessScope(TestCase):
+    """Prueba que vista y context processor comparten el mismo ámbito de acceso."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        caches["default"].clear()
+        self.factory = RequestFactory()
+
+        self.staff_user = User.objects.create_user(
+            username="staff_scope", email="staffscope@example.com", password="x"
+        )
+        self.staff_user.is_staff = True
+        self.staff_user.save()
+
+        self.restricted_user = User.objects.create_user(
+            username="restricted_scope",
+            email="restrictedscope@example.com",
+            password="x",
+        )
+
+        self.aula1 = Aula.objects.create(nombre="Aula 401")
+        self.aula2 = Aula.objects.create(nombre="Aula 402")
+        self.restricted_user.persona.aulas_access.add(self.aula1)
+
+    def _request(self, user, path="/", session=None):
+        request = self.factory.get(path)
+        # Usuario recién leído de la BD, como haría AuthenticationMiddleware
+        request.user = User.objects.get(pk=user.pk) if user.pk else user
+        request.session = session or {}
+        return request
+
+    def test_scope_is_resolved_once_per_request(self):
+        """Vista y context processor comparten las consultas del ámbito."""
+        request = self._request(
+            self.restricted_user, session={"current_aula_id": self.aula1.id}
+        )
+
+        # Persona, aulas accesibles, grupo de profesores y lista de aulas
+        with self.assertNumQueries(4):
+            # Lo que hace una página completa: la vista y el context processor
+            self.assertEqual(get_current_aula(request), self.aula1)
+            scope = get_access_scope(request)
+            self.assertTrue(scope.has_aula_access(self.aula1))
+            self.assertFalse(scope.has_aula_access(self.aula2.id))
+            self.assertEqual(scope.aula_ids, frozenset({self.aula1.id}))
+            self.assertFalse(user_in_group_profesores(request.user))
+            context = aula_context(request)
+            self.assertEqual(context["ctx_current_aula"], self.aula1)
+            self.assertEqual(list(context["ctx_all_aulas"]), [self.aula1])
+
+    def test_cached_scope_across_requests(self):
+        """Con el ámbito en caché las comprobaciones de acceso no usan SQL."""
+        get_access_scope(self._request(self.restricted_user)).has_aula_access(1)
+
+        request = self._request(
+            self.restricted_user, session={"current_aula_id": self.aula1.id}
+        )
+        with self.assertNumQueries(0):
+            scope = get_access_scope(request)
+            self.assertTrue(scope.has_aula_access(self.aula1.id))
+            self.assertFalse(scope.has_aula_access(self.aula2.id))
+            self.assertFalse(user_in_group_profesores(request.user))
+        # Solo la lista de aulas (navbar / aula actual) sigue leyendo la BD
+        with self.assertNumQueries(1):
+            self.assertEqual(get_current_aula(request), self.aula1)
+            aula_context(request)
+
+    def test_aulas_access_change_invalidates_scope(self):
+        """Cambiar aulas_access invalida el ámbito cacheado al confirmar."""
+        self.assertFalse(
+            get_access_scope(self._request(self.restricted_user)).has_aula_access(
+                self.aula2
+            )
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.restricted_user.persona.aulas_access.add(self.aula2)
+        scope = get_access_scope(self._request(self.restricted_user))
+        self.assertTrue(scope.has_aula_access(self.aula2))
+
+        # Desde el lado del aula (relación inversa)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.aula2.persona_set.clear()
+        scope = get_access_scope(self._request(self.restricted_user))
+        self.assertFalse(scope.has_aula_access(self.aula2))
+
+    def test_groups_change_invalidates_scope(self):
+        """Añadir o quitar el grupo de profesores invalida el ámbito cacheado."""
+        group, _ = Group.objects.get_or_create(name="ProfesoresFP")
+        self.assertFalse(
+            user_in_group_profesores(self._request(self.restricted_user).user)
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.restricted_user.groups.add(group)
+        self.assertTrue(
+            user_in_group_profesores(self._request(self.restricted_user).user)
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            group.user_set.remove(self.restricted_user)
+        self.assertFalse(
+            user_in_group_profesores(self._request(self.restricted_user).user)
+        )
+
+    def test_staff_scope_queries(self):
+        """Staff ve todas las aulas sin consultar aulas_access."""
+        request = self._request(self.staff_user, path=f"/?aula={self.aula2.id}")
+
+        # Persona, grupo de profesores y lista de aulas
+        with self.assertNumQueries(3):
+            self.assertEqual(get_current_aula(request), self.aula2)
+            self.assertTrue(get_access_scope(request).has_aula_access(self.aula1))
+            context = aula_context(request)
+            self.assertEqual(context["ctx_all_aulas"].count(), 2)
+
+    def test_inaccessible_session_aula(self):
+        """Un aula de sesión sin acceso no se devuelve ni cae a la preferencia."""
+        persona = self.restricted_user.persona
+        persona.last_aula = self.aula1
+        persona.save()
+        request = self._request(
+            self.restricted_user, session={"current_aula_id": self.aula2.id}
+        )
+
+        self.assertIsNone(get_current_aula(request))
+
+    def test_deleted_session_aula_falls_back_to_preference(self):
+        """Si el aula de sesión ya no existe se usa Persona.last_aula."""
+        persona = self.restricted_user.persona
+        persona.last_aula = self.aula1
+        persona.save()
+        request = self._request(self.restricted_user, session={"current_aula_id": 999})
+
+        self.assertEqual(get_current_aula(request), self.aula1)
+
+    def test_anonymous_scope_has_no_queries(self):
+        """Los usuarios anónimos no generan consultas."""
+        request = self._request(AnonymousUser())
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_current_aula(request))
+            self.assertFalse(get_access_scope(request).has_aula_access(self.aula1))
+            self.assertEqual(len(aula_context(request)["ctx_all_aulas"]), 0)
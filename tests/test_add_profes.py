@@ -0,0 +1,110 @@
+"""Pruebas del comando add_profes."""
+
+import logging
+import os
+import tempfile
+import time
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from almacen.models import Persona
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.mark.django_db
+class TestAddProfes(TestCase):
+    """Prueba el alta masiva de profesores."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        self.group = Group.objects.get_or_create(name="ProfesoresFP")[0]
+        self.ana = User.objects.create_user(username="ana", email="Ana@Example.com")
+        self.luis = User.objects.create_user(username="luis", email="luis@example.com")
+        self.luis.groups.add(self.group)
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _file(self, lines):
+        path = os.path.join(self.tmpdir.name, "profes.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    def _run(self, path, *args):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("add_profes", path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_adds_existing_users_case_insensitively(self):
+        """Normaliza el fichero y añade al grupo sin duplicar pertenencias."""
+        path = self._file(
+            ["  ANA@example.com ", "ana@example.com", "", "# comentario"]
+            + ["luis@example.com", "nadie@example.com", "no-es-un-email"]
+        )
+        with patch(
+            "almacen.management.commands.add_profes.invalidate_user_access"
+        ) as invalidate:
+            output = self._run(path)
+
+        self.assertIn(
+            "Added 1 users to ProfesoresFP (1 already there, 0 created)", output
+        )
+        self.assertIn("Invalid emails: no-es-un-email", output)
+        self.assertIn(
+            "Missing users (create them first or use --create): nadie@", output
+        )
+        self.assertTrue(self.ana.groups.filter(pk=self.group.pk).exists())
+        self.assertEqual(self.luis.groups.count(), 1)
+        self.assertFalse(User.objects.filter(email="nadie@example.com").exists())
+        invalidate.assert_called_once_with({self.ana.pk, self.luis.pk})
+
+    def test_create_missing_users_with_persona(self):
+        """--create da de alta usuarios con su Persona y sin contraseña."""
+        path = self._file(["nueva@example.com", "ana@example.com"])
+        output = self._run(path, "--create")
+
+        self.assertIn(
+            "Added 2 users to ProfesoresFP (0 already there, 1 created)", output
+        )
+        nueva = User.objects.get(email="nueva@example.com")
+        self.assertFalse(nueva.has_usable_password())
+        self.assertTrue(Persona.objects.filter(user=nueva).exists())
+        self.assertTrue(nueva.groups.filter(pk=self.group.pk).exists())
+
+    def test_queries_do_not_grow_with_emails(self):
+        """Las consultas no dependen del número de emails."""
+
+        def queries(n, prefijo):
+            path = self._file([f"{prefijo}{i}@example.com" for i in range(n)])
+            with CaptureQueriesContext(connection) as ctx:
+                self._run(path, "--create")
+            return [q["sql"] for q in ctx.captured_queries]
+
+        pocos, muchos = queries(5, "a"), queries(400, "b")
+        no_insert = [
+            [sql for sql in qs if not sql.startswith("INSERT")]
+            for qs in (pocos, muchos)
+        ]
+        self.assertEqual(len(no_insert[0]), len(no_insert[1]))
+        self.assertLess(len(muchos), 20)
+
+    def test_benchmark_5000_emails(self):
+        """Tiempo de 5000 altas con --create (en el log, con --log-cli-level=INFO)."""
+        path = self._file([f"profe{i}@example.com" for i in range(5000)])
+        start = time.perf_counter()
+        output = self._run(path, "--create")
+        elapsed = time.perf_counter() - start
+        logger.info("%s (total %.2fs)", output.strip(), elapsed)
+        self.assertLess(elapsed, 60)
+        self.assertEqual(self.group.user_set.count(), 5001)
@@ -0,0 +1,193 @@
+"""Pruebas de las vistas de consulta asíncronas servidas por ASGI."""
+
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import AsyncMock, patch
+
+from asgiref.sync import iscoroutinefunction
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import LiveServerTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from almacen.events import get_epc_cache
+from almacen.local_redis import locmem_caches
+from almacen.management.commands.mqtt_listener import CACHE_KEY_FORMAT
+from almacen.middleware import (
+    AccessScopeMiddleware,
+    ProfilingMiddleware,
+    QueryBudgetMiddleware,
+)
+from almacen.models import Aula, Producto, Ubicacion
+
+LOCMEM = locmem_caches("test-async-views")
+
+
+@pytest.mark.django_db
+@override_settings(CACHES=LOCMEM, SECURE_SSL_REDIRECT=False)
+class TestAsyncViews(TestCase):
+    """Prueba get_latest_epc, inventory_row y dashboard_counters con el cliente ASGI."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        caches["default"].clear()
+        self.aula = Aula.objects.create(nombre="Taller Async")
+        self.otra = Aula.objects.create(nombre="Taller Ajeno")
+        self.user = User.objects.create_user(
+            username="async_user", email="async@example.com", password="x"
+        )
+        persona = self.user.persona
+        persona.aulas_access.add(self.aula)
+        persona.last_aula = self.aula
+        persona.save()
+        self.producto = Producto.objects.create(
+            epc="ASYNC01", nombre="Fuente de alimentación", aula=self.aula
+        )
+        Ubicacion.objects.create(
+            producto=self.producto, estado="PERSONA", persona=self.user
+        )
+        Producto.objects.create(epc="ASYNC02", nombre="Soldador", aula=self.aula)
+        self.ajeno = Producto.objects.create(
+            epc="AJENO01", nombre="Ajeno", aula=self.otra
+        )
+
+    def _latest(self, epc, age_seconds=0):
+        leido_en = timezone.now() - timedelta(seconds=age_seconds)
+        return patch(
+            "almacen.views.aget_latest_epc",
+            AsyncMock(return_value={"epc": epc, "leido_en": leido_en}),
+        )
+
+    async def test_latest_epc(self):
+        """Devuelve el EPC nuevo del aula actual; 204 si es el mismo o es antiguo."""
+        await self.async_client.aforce_login(self.user)
+        url = reverse("almacen:get_latest_epc")
+
+        with self._latest("E2009999") as latest:
+            response = await self.async_client.get(url, {"current_epc": "E2000001"})
+            self.assertContains(response, 'value="E2009999"')
+            latest.assert_awaited_once_with(self.aula.pk)
+
+            response = await self.async_client.get(url, {"current_epc": "E2009999"})
+            self.assertEqual(response.status_code, 204)
+
+        with self._latest("E2009999", age_seconds=120):
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 204)
+
+    async def test_inventory_row(self):
+        """Fila del producto, 403 en aulas sin acceso, 404 si no existe y 304."""
+        await self.async_client.aforce_login(self.user)
+
+        url = reverse("almacen:inventory_row", args=[self.producto.pk])
+        response = await self.async_client.get(url)
+        self.assertContains(response, "Fuente de alimentación")
+        self.assertContains(response, "async@example.com")  # ubicacion.persona
+
+        again = await self.async_client.get(
+            url, headers={"if-none-match": response["ETag"]}
+        )
+        self.assertEqual(again.status_code, 304)
+
+        response = await self.async_client.get(
+            reverse("almacen:inventory_row", args=[self.ajeno.pk])
+        )
+        self.assertEqual(response.status_code, 403)
+        response = await self.async_client.get(
+            reverse("almacen:inventory_row", args=[99999])
+        )
+        self.assertEqual(response.status_code, 404)
+
+    async def test_dashboard_counters(self):
+        """Los contadores salen de una consulta y se revalidan con 304."""
+        await self.async_client.aforce_login(self.user)
+        url = reverse("almacen:dashboard_counters")
+
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [response.context[k] for k in ("total", "en_manos", "en_estante")],
+            [2, 1, 1],
+        )
+        self.assertNotContains(response, "fade-in-up")
+
+        again = await self.async_client.get(
+            url, headers={"if-none-match": response["ETag"]}
+        )
+        self.assertEqual(again.status_code, 304)
+
+    def test_sync_client_and_toggle_still_work(self):
+        """Bajo WSGI las vistas async también responden, y el toque devuelve la fila."""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("almacen:dashboard_counters"))
+        self.assertContains(response, 'id="dashboard-counters"')
+
+        response = self.client.post(
+            reverse("almacen:toggle_prestamo", args=[self.producto.pk]),
+            HTTP_HX_REQUEST="true",
+        )
+        self.assertContains(response, "Fuente de alimentación")
+        self.assertEqual(
+            Ubicacion.objects.get(producto=self.producto).estado, "ESTANTE"
+        )
+
+    @override_settings(DEBUG=True, PROFILING_ENABLED=True)
+    def test_middlewares_are_async_capable(self):
+        """Con un get_response async los middlewares de almacen son corrutinas."""
+
+        async def aview(request):
+            pass
+
+        for middleware in (
+            AccessScopeMiddleware,
+            ProfilingMiddleware,
+            QueryBudgetMiddleware,
+        ):
+            with self.subTest(middleware=middleware.__name__):
+                self.assertTrue(iscoroutinefunction(middleware(aview)))
+                self.assertFalse(iscoroutinefunction(middleware(lambda r: None)))
+
+    def test_latest_epc_reads_listener_cache(self):
+        """get_latest_epc lee la entrada de epc_cache que escribe el listener."""
+        get_epc_cache().set(
+            CACHE_KEY_FORMAT.format(self.aula.pk),
+            {"epc": "E2005555", "leido_en": timezone.now()},
+        )
+        self.client.force_login(self.user)
+        # Bajo WSGI cada petición corre en un bucle nuevo (async_to_sync)
+        for _ in range(2):
+            response = self.client.get(reverse("almacen:get_latest_epc"))
+            self.assertContains(response, 'value="E2005555"')
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(CACHES=LOCMEM, SECURE_SSL_REDIRECT=False)
+class TestLoadtestPolling(LiveServerTestCase):
+    """Prueba el comando de carga contra un servidor real."""
+
+    def test_reports_throughput_and_percentiles(self):
+        """Varios clientes concurrentes y un resumen con la cifra por núcleo."""
+        user = User.objects.create_user(
+            username="carga", email="carga@example.com", password="x"
+        )
+        self.client.force_login(user)
+        cookie = f"sessionid={self.client.cookies['sessionid'].value}"
+
+        out = StringIO()
+        call_command(
+            "loadtest_polling",
+            self.live_server_url + reverse("almacen:get_latest_epc"),
+            "--clients=5",
+            "--duration=1",
+            f"--cookie={cookie}",
+            stdout=out,
+        )
+        output = out.getvalue()
+        self.assertIn("5 clients", output)
+        self.assertIn("Status: {204:", output)  # sin aula actual
+        self.assertIn("connection errors: 0", output)
+        self.assertIn("polling clients (every 5s) served per core", output)
@@ -0,0 +1,150 @@
+"""Pruebas del GET condicional (ETag / Last-Modified) de las páginas de consulta."""
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from almacen.local_redis import locmem_caches
+from almacen.models import Aula, Prestamo, Producto, Ubicacion
+
+LOCMEM = locmem_caches("test-conditional-get")
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+PRODUCT_TABLES = ("almacen_producto", "almacen_ubicacion", "almacen_prestamo")
+
+
+@pytest.mark.django_db
+@override_settings(CACHES=LOCMEM, STORAGES=STORAGES, SECURE_SSL_REDIRECT=False)
+class TestConditionalGet(TestCase):
+    """Prueba las respuestas 304 y la invalidación de los validadores."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        caches["default"].clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.aula1 = Aula.objects.create(nombre="Taller ETag 1")
+            self.aula2 = Aula.objects.create(nombre="Taller ETag 2")
+            self.user = User.objects.create_user(
+                username="etag_user", email="etag@example.com", password="x"
+            )
+            self.user.persona.aulas_access.add(self.aula1, self.aula2)
+            self.other = User.objects.create_user(
+                username="etag_other", email="other@example.com", password="x"
+            )
+            self.other.persona.aulas_access.add(self.aula1, self.aula2)
+            self.producto = Producto.objects.create(
+                epc="ETAG001", nombre="Multímetro", aula=self.aula1
+            )
+            self.ubicacion = Ubicacion.objects.create(
+                producto=self.producto, aula=self.aula1
+            )
+        self.client.force_login(self.user)
+        # Como un navegador que ya tiene la cookie CSRF de una visita anterior
+        self.client.get(reverse("almacen:dashboard"))
+
+    def _revalidate(self, url, response):
+        return self.client.get(url, headers={"if-none-match": response["ETag"]})
+
+    def test_unchanged_pages_answer_304_without_product_queries(self):
+        """Si nada cambia se responde 304 sin leer las tablas de productos."""
+        for name in ("dashboard", "inventory", "prestamos_overview"):
+            url = reverse(f"almacen:{name}")
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, 200, name)
+            self.assertIn("ETag", first)
+            self.assertIn("private", first["Cache-Control"])
+
+            with CaptureQueriesContext(connection) as ctx:
+                second = self._revalidate(url, first)
+            self.assertEqual(second.status_code, 304, name)
+            self.assertEqual(second.content, b"")
+            sql = " ".join(q["sql"] for q in ctx.captured_queries)
+            for table in PRODUCT_TABLES:
+                self.assertNotIn(table, sql, name)
+
+    def test_loan_changes_the_validator(self):
+        """Un préstamo en el aula cambia el ETag del inventario y de la fila."""
+        urls = [
+            reverse("almacen:inventory"),
+            reverse("almacen:inventory_row", args=[self.producto.pk]),
+        ]
+        first = [self.client.get(url) for url in urls]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ubicacion.estado = "PERSONA"
+            self.ubicacion.persona = self.user
+            self.ubicacion.save()
+            Prestamo.objects.create(producto=self.producto, usuario=self.user)
+
+        for url, response in zip(urls, first):
+            again = self._revalidate(url, response)
+            self.assertEqual(again.status_code, 200, url)
+            self.assertNotEqual(again["ETag"], response["ETag"])
+
+    def test_moving_product_changes_both_aulas(self):
+        """Al mover un producto de aula cambian las páginas de ambas aulas."""
+        url1 = reverse("almacen:inventory") + f"?aula={self.aula1.pk}"
+        url2 = reverse("almacen:inventory") + f"?aula={self.aula2.pk}"
+        first1, first2 = self.client.get(url1), self.client.get(url2)
+
+        producto = Producto.objects.get(pk=self.producto.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            producto.aula = self.aula2
+            producto.save()
+
+        self.assertEqual(self._revalidate(url1, first1).status_code, 200)
+        self.assertEqual(self._revalidate(url2, first2).status_code, 200)
+
+    def test_change_in_other_aula_keeps_validator(self):
+        """Un cambio en otra aula no invalida la página del aula actual."""
+        url = reverse("almacen:inventory") + f"?aula={self.aula2.pk}"
+        first = self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.producto.nombre = "Multímetro digital"
+            self.producto.save()
+        self.assertEqual(self._revalidate(url, first).status_code, 304)
+
+    def test_staff_dashboard_sees_other_aulas(self):
+        """El panel de staff cuenta todas las aulas: un cambio en otra lo invalida."""
+        staff = User.objects.create_user(
+            username="etag_staff", email="staff@example.com", password="x"
+        )
+        staff.is_staff = True
+        staff.save()
+        self.client.force_login(staff)
+        self.client.get(reverse("almacen:dashboard"))
+        urls = [reverse("almacen:dashboard"), reverse("almacen:dashboard_counters")]
+        first = [self.client.get(url + f"?aula={self.aula1.pk}") for url in urls]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Producto.objects.create(
+                epc="ETAG002", nombre="Osciloscopio", aula=self.aula2
+            )
+
+        for url, response in zip(urls, first):
+            again = self._revalidate(url + f"?aula={self.aula1.pk}", response)
+            self.assertEqual(again.status_code, 200, url)
+
+    def test_users_never_share_validators(self):
+        """Dos usuarios con el mismo acceso y los mismos datos tienen ETags distintos."""
+        url = reverse("almacen:inventory")
+        mine = self.client.get(url)
+        self.client.force_login(self.other)
+        self.client.get(reverse("almacen:dashboard"))
+        theirs = self.client.get(url)
+        self.assertNotEqual(mine["ETag"], theirs["ETag"])
+        self.assertEqual(self._revalidate(url, mine).status_code, 200)
+
+    def test_access_change_invalidates(self):
+        """Perder el acceso a un aula cambia el validador de la página."""
+        url = reverse("almacen:inventory")
+        first = self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.persona.aulas_access.remove(self.aula2)
+        self.assertEqual(self._revalidate(url, first).status_code, 200)
@@ -0,0 +1,107 @@
+"""Pruebas del perfilador por muestreo y de las instantáneas de memoria."""
+
+import glob
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+
+from django.test import SimpleTestCase
+
+from almacen.diagnostics import (
+    MemorySnapshots,
+    SamplingProfiler,
+    install_signal_handlers,
+)
+
+
+def busy_loop(stop):
+    """Función reconocible en las pilas muestreadas."""
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestDiagnostics(SimpleTestCase):
+    """Prueba los ficheros que genera el diagnóstico bajo demanda."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+        self.addCleanup(tracemalloc.stop)
+
+    def _files(self, pattern):
+        return sorted(glob.glob(os.path.join(self.output_dir, pattern)))
+
+    def test_sampling_profiler_collapsed_stacks(self):
+        """Las pilas del hilo ocupado aparecen en formato collapsed."""
+        stop = threading.Event()
+        worker = threading.Thread(target=busy_loop, args=(stop,), name="ocupado")
+        worker.start()
+        self.addCleanup(worker.join)
+        self.addCleanup(stop.set)
+
+        profiler = SamplingProfiler(self.output_dir, "prueba")
+        profiler.start(0.3)
+        self.assertTrue(profiler.running)
+        profiler.thread.join(timeout=5)
+
+        [path] = self._files("prueba-*.folded")
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        busy = [line for line in lines if line.startswith("ocupado;")]
+        self.assertTrue(busy)
+        stack, count = busy[0].rsplit(" ", 1)
+        self.assertIn("test_diagnostics:busy_loop", stack)
+        self.assertGreater(int(count), 0)
+        # El propio hilo del perfilador no se muestrea
+        self.assertFalse(any(line.startswith("profiler;") for line in lines))
+
+    def test_toggle_stops_early(self):
+        """Una segunda señal para el muestreo antes de tiempo y guarda el perfil."""
+        profiler = SamplingProfiler(self.output_dir, "prueba")
+        profiler.toggle(60)
+        start = time.monotonic()
+        profiler.toggle(60)
+        profiler.thread.join(timeout=5)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(len(self._files("prueba-*.folded")), 1)
+
+    def test_memory_snapshots_diff(self):
+        """La segunda instantánea muestra lo reservado desde la primera."""
+        snapshots = MemorySnapshots(self.output_dir, "prueba")
+        first = snapshots.take()
+        with open(first, encoding="utf-8") as f:
+            self.assertIn("referencia", f.read())
+
+        retenido = [bytearray(1024) for _ in range(2000)]  # noqa: F841
+        second = snapshots.take()
+        with open(second, encoding="utf-8") as f:
+            diff = f.read()
+        self.assertIn("Diferencia", diff)
+        self.assertIn("test_diagnostics.py", diff.splitlines()[2])
+
+    @unittest.skipUnless(hasattr(signal, "SIGUSR2"), "Sin señales POSIX")
+    def test_signal_handlers(self):
+        """SIGUSR2 escribe una instantánea sin bloquear al hilo principal."""
+        previous = {
+            signum: signal.getsignal(signum)
+            for signum in (signal.SIGUSR1, signal.SIGUSR2)
+        }
+        for signum, handler in previous.items():
+            self.addCleanup(signal.signal, signum, handler)
+
+        profiler, snapshots = install_signal_handlers(self.output_dir, "prueba", 0.2)
+        os.kill(os.getpid(), signal.SIGUSR2)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and not (
+            self._files("prueba-*.memory.txt") and self._files("prueba-*.folded")
+        ):
+            time.sleep(0.05)
+        self.assertEqual(len(self._files("prueba-*.memory.txt")), 1)
+        self.assertEqual(len(self._files("prueba-*.folded")), 1)
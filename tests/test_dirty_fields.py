@@ -0,0 +1,144 @@
+"""Pruebas del guardado de solo los campos modificados (DirtyFieldsMixin)."""
+
+import pytest
+from django.contrib.auth.models import Group, User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from almacen.models import Aula, Persona, Producto, Recuento, Ubicacion
+
+
+def updates(ctx, tabla=None):
+    """UPDATE capturados, opcionalmente solo los de una tabla."""
+    sqls = [q["sql"] for q in ctx.captured_queries if q["sql"].startswith("UPDATE")]
+    if tabla:
+        sqls = [sql for sql in sqls if sql.startswith(f'UPDATE "{tabla}"')]
+    return sqls
+
+
+@pytest.mark.django_db
+@override_settings(SECURE_SSL_REDIRECT=False)
+class TestDirtyFields(TestCase):
+    """Prueba cuántos UPDATE provoca cada acción."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        self.aula = Aula.objects.create(nombre="Taller Dirty")
+        self.user = User.objects.create_user(
+            username="dirty", email="dirty@example.com", password="x"
+        )
+        self.user.groups.add(Group.objects.get_or_create(name="ProfesoresFP")[0])
+        self.user.persona.aulas_access.add(self.aula)
+        self.producto = Producto.objects.create(
+            epc="DIRTY01", nombre="Osciloscopio", aula=self.aula, estanteria="E1"
+        )
+        Ubicacion.objects.create(
+            producto=self.producto, aula=self.aula, estanteria="E1"
+        )
+
+    def test_save_writes_only_changed_columns(self):
+        """Sin cambios no hay UPDATE; con cambios solo se escriben esas columnas."""
+        producto = Producto.objects.get(pk=self.producto.pk)
+        with CaptureQueriesContext(connection) as ctx:
+            producto.save()
+        self.assertEqual(updates(ctx), [])
+
+        producto.nombre = "Osciloscopio digital"
+        with CaptureQueriesContext(connection) as ctx:
+            producto.save()
+        (sql,) = updates(ctx)
+        self.assertIn('"nombre"', sql)
+        self.assertIn('"actualizado"', sql)  # auto_now
+        self.assertNotIn('"estanteria"', sql)
+        self.assertEqual(producto.get_dirty_fields(), [])
+
+        # Cambio de aula: la señal conoce la de origen para invalidar ambas
+        otra = Aula.objects.create(nombre="Otro taller")
+        producto.aula = otra
+        self.assertEqual(producto.get_loaded_value("aula_id"), self.aula.pk)
+        producto.save()
+        self.assertEqual(producto.get_loaded_value("aula_id"), otra.pk)
+
+    def test_force_insert_and_mutable_values(self):
+        """force_insert guarda la fila entera; un JSON modificado en sitio es un cambio."""
+        producto = Producto.objects.get(pk=self.producto.pk)
+        producto.pk = None
+        producto.epc = "DIRTY02"
+        producto.save(force_insert=True)
+        self.assertEqual(Producto.objects.get(epc="DIRTY02").estanteria, "E1")
+
+        recuento = Recuento.objects.create(aula=self.aula, resultado={"leidos": 1})
+        recuento = Recuento.objects.get(pk=recuento.pk)
+        recuento.resultado["leidos"] = 2
+        self.assertEqual(recuento.get_dirty_fields(), ["resultado"])
+
+    def test_deleted_row_is_reinserted(self):
+        """Si la fila se ha borrado en otro proceso, save() la vuelve a insertar."""
+        borrada = Aula.objects.get(pk=Aula.objects.create(nombre="Taller Borrado").pk)
+        Aula.objects.filter(pk=borrada.pk).delete()
+        borrada.nombre = "Taller Recuperado"
+        borrada.save()
+        self.assertEqual(Aula.objects.get(pk=borrada.pk).nombre, "Taller Recuperado")
+        self.assertEqual(borrada.get_loaded_value("nombre"), "Taller Recuperado")
+
+    def test_login_updates_only_last_login(self):
+        """El login solo escribe last_login, sin volver a guardar la Persona."""
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.force_login(self.user)
+        sqls = [sql for sql in updates(ctx) if "django_session" not in sql]
+        self.assertEqual(len(sqls), 1)
+        self.assertIn('"last_login"', sqls[0])
+
+    def test_set_current_aula_twice(self):
+        """Volver a elegir la misma aula no escribe la Persona."""
+        self.client.force_login(self.user)
+        url = reverse("almacen:set_current_aula")
+        counts = []
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.post(url, {"aula_id": self.aula.pk})
+            counts.append(len(updates(ctx, "almacen_persona")))
+        self.assertEqual(counts, [1, 0])
+        self.assertEqual(Persona.objects.get(user=self.user).last_aula, self.aula)
+
+    def test_producto_edit_without_changes(self):
+        """Guardar el formulario sin cambios no toca producto ni ubicación."""
+        self.client.force_login(self.user)
+        url = reverse("almacen:producto_edit", args=[self.producto.pk])
+        data = {
+            "epc": "DIRTY01",
+            "nombre": "Osciloscopio",
+            "aula": self.aula.pk,
+            "estanteria": "E1",
+            "posicion": "",
+            "n_serie": "",
+            "cantidad": "1",
+            "descripcion": "",
+            "fds": "",
+        }
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(updates(ctx, "almacen_producto"), [])
+        self.assertEqual(updates(ctx, "almacen_ubicacion"), [])
+
+        data["estanteria"] = "E2"
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(url, data)
+        self.assertEqual(len(updates(ctx, "almacen_producto")), 1)
+        (sql,) = updates(ctx, "almacen_ubicacion")
+        self.assertIn('"estanteria"', sql)
+        self.assertNotIn('"estado"', sql)
+
+    def test_toggle_prestamo(self):
+        """Prestar desde la tablet: un UPDATE de la ubicación y ninguno más."""
+        self.client.force_login(self.user)
+        url = reverse("almacen:toggle_prestamo", args=[self.producto.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.post(url)
+        sqls = [sql for sql in updates(ctx) if "django_session" not in sql]
+        self.assertEqual(len(sqls), 1)
+        self.assertTrue(sqls[0].startswith('UPDATE "almacen_ubicacion"'))
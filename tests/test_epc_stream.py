@@ -0,0 +1,84 @@
+"""Pruebas del endpoint SSE de EPC en vivo y del formato de los eventos."""
+
+from unittest.mock import patch
+
+import pytest
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from almacen.events import EPC_CHANNEL_FORMAT, sse_message
+from almacen.models import Aula
+
+
+def fake_subscribe(payloads):
+    """Sustituye a la suscripción de Redis: emite los payloads y termina."""
+    calls = []
+
+    async def subscribe(channels):
+        calls.append(channels)
+        for payload in payloads:
+            yield payload
+
+    subscribe.calls = calls
+    return subscribe
+
+
+@pytest.mark.django_db
+@override_settings(SECURE_SSL_REDIRECT=False)
+class TestEPCStream(TestCase):
+    """Prueba el endpoint SSE que sustituye al sondeo de get_latest_epc."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        self.aula = Aula.objects.create(nombre="Taller SSE")
+        self.user = User.objects.create_user(
+            username="sse_user", email="sse@example.com", password="x"
+        )
+        persona = self.user.persona
+        persona.aulas_access.add(self.aula)
+        persona.last_aula = self.aula
+        persona.save()
+
+    def test_sse_message_format(self):
+        """Cada línea del HTML va en su propia línea data:."""
+        self.assertEqual(
+            sse_message("<div>\n<b>x</b>\n</div>", event="epc"),
+            "event: epc\ndata: <div>\ndata: <b>x</b>\ndata: </div>\n\n",
+        )
+
+    async def test_requires_login(self):
+        """Un usuario anónimo es redirigido al login."""
+        response = await self.async_client.get(reverse("almacen:epc_stream"))
+        self.assertEqual(response.status_code, 302)
+
+    async def test_no_current_aula_returns_204(self):
+        """Sin aula actual el servidor pide a EventSource que no reconecte."""
+        other = await User.objects.acreate_user(
+            username="sse_other", email="sseother@example.com", password="x"
+        )
+        await self.async_client.aforce_login(other)
+        response = await self.async_client.get(reverse("almacen:epc_stream"))
+        self.assertEqual(response.status_code, 204)
+
+    async def test_streams_epc_of_current_aula(self):
+        """Los EPC publicados en el canal del aula llegan como eventos 'epc'."""
+        subscribe = fake_subscribe(
+            [None, {"epc": "E2001234", "leido_en": timezone.now().isoformat()}]
+        )
+        await self.async_client.aforce_login(self.user)
+
+        with patch("almacen.events.subscribe", subscribe):
+            response = await self.async_client.get(reverse("almacen:epc_stream"))
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            chunks = [
+                chunk.decode() if isinstance(chunk, bytes) else chunk
+                async for chunk in response.streaming_content
+            ]
+
+        self.assertEqual(subscribe.calls, [[EPC_CHANNEL_FORMAT.format(self.aula.pk)]])
+        self.assertTrue(chunks[0].startswith("retry:"))
+        self.assertEqual(chunks[1], ": keepalive\n\n")
+        self.assertTrue(chunks[2].startswith("event: epc\n"))
+        self.assertIn('value="E2001234"', chunks[2])
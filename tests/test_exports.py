@@ -0,0 +1,186 @@
+"""Pruebas de la exportación en streaming del inventario y de los préstamos."""
+
+import csv
+import io
+import logging
+import time
+import tracemalloc
+import zipfile
+from datetime import timedelta
+from xml.etree import ElementTree
+
+import pytest
+from django.contrib.auth.models import Group, User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from almacen.exports import PRESTAMO_COLUMNS, export_rows, stream_csv
+from almacen.models import Aula, Prestamo, Producto, Ubicacion
+from almacen.tables import prestamo_history
+
+logger = logging.getLogger(__name__)
+
+SHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+
+def read_csv(response):
+    content = b"".join(response.streaming_content).decode("utf-8-sig")
+    return list(csv.reader(io.StringIO(content)))
+
+
+def read_xlsx(response):
+    data = b"".join(response.streaming_content)
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        root = ElementTree.fromstring(zf.read("xl/worksheets/sheet1.xml"))
+    return [
+        ["".join(c.itertext()) for c in row.iter(f"{SHEET_NS}c")]
+        for row in root.iter(f"{SHEET_NS}row")
+    ]
+
+
+@pytest.mark.django_db
+@override_settings(SECURE_SSL_REDIRECT=False)
+class TestExports(TestCase):
+    """Prueba los endpoints de exportación CSV/XLSX."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        self.aula1 = Aula.objects.create(nombre="Taller Export 1")
+        self.aula2 = Aula.objects.create(nombre="Taller Export 2")
+        self.profesor = User.objects.create_user(
+            username="export_profe", email="profe@example.com", password="x"
+        )
+        self.profesor.persona.aulas_access.add(self.aula1)
+        self.profesor.groups.add(Group.objects.get_or_create(name="ProfesoresFP")[0])
+        self.alumno = User.objects.create_user(
+            username="export_alumno", email="alumno@example.com", password="x"
+        )
+        self.alumno.persona.aulas_access.add(self.aula1)
+
+        self.taladro = Producto.objects.create(
+            epc="EXP001", nombre="Taladro", aula=self.aula1
+        )
+        Ubicacion.objects.create(
+            producto=self.taladro,
+            aula=self.aula1,
+            estado="PERSONA",
+            persona=self.alumno,
+        )
+        self.prestamo = Prestamo.objects.create(
+            producto=self.taladro, usuario=self.alumno
+        )
+        self.sierra = Producto.objects.create(
+            epc="EXP002", nombre="Sierra", aula=self.aula1
+        )
+        Ubicacion.objects.create(producto=self.sierra, aula=self.aula1)
+        Producto.objects.create(epc="EXP003", nombre="Torno", aula=self.aula2)
+
+    def test_inventory_csv_is_filtered_and_annotated(self):
+        """El CSV respeta el acceso y la búsqueda e incluye el estado del préstamo."""
+        self.client.force_login(self.alumno)
+        response = self.client.get(reverse("almacen:inventory_export"))
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        self.assertIn("attachment;", response["Content-Disposition"])
+
+        rows = read_csv(response)
+        self.assertEqual(rows[0][:2], ["EPC", "Nombre"])
+        by_epc = {row[0]: row for row in rows[1:]}
+        self.assertEqual(set(by_epc), {"EXP001", "EXP002"})  # sin el aula 2
+        self.assertEqual(by_epc["EXP001"][7:9], ["En manos", "alumno@example.com"])
+        self.assertTrue(by_epc["EXP001"][9])
+        self.assertEqual(by_epc["EXP002"][7:10], ["En estantería", "", ""])
+
+        response = self.client.get(reverse("almacen:inventory_export"), {"q": "sier"})
+        self.assertEqual([row[0] for row in read_csv(response)[1:]], ["EXP002"])
+
+    def test_inventory_xlsx(self):
+        """El XLSX es un zip válido con las mismas filas."""
+        self.client.force_login(self.alumno)
+        response = self.client.get(
+            reverse("almacen:inventory_export"), {"formato": "xlsx"}
+        )
+        rows = read_xlsx(response)
+        self.assertEqual(rows[0][0], "EPC")
+        self.assertEqual(sorted(row[0] for row in rows[1:]), ["EXP001", "EXP002"])
+
+    def test_unknown_format_is_rejected(self):
+        """Un formato desconocido responde 400."""
+        self.client.force_login(self.alumno)
+        response = self.client.get(
+            reverse("almacen:inventory_export"), {"formato": "pdf"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_prestamos_export_by_date_range(self):
+        """El historial se filtra por fechas y solo lo descargan profesores."""
+        self.client.force_login(self.alumno)
+        url = reverse("almacen:prestamos_export")
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.profesor)
+        hoy = timezone.localdate()
+        rows = read_csv(self.client.get(url, {"desde": hoy, "hasta": hoy}))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][2:5], ["En préstamo", "EXP001", "Taladro"])
+
+        ayer = hoy - timedelta(days=1)
+        rows = read_csv(self.client.get(url, {"hasta": ayer}))
+        self.assertEqual(len(rows), 1)
+
+        self.assertEqual(self.client.get(url, {"desde": "2024-02-30"}).status_code, 400)
+
+    def test_export_queries_do_not_grow_with_rows(self):
+        """Sin consultas por fila: el número de consultas no depende de N."""
+        self.client.force_login(self.alumno)
+        url = reverse("almacen:inventory_export")
+        b"".join(self.client.get(url).streaming_content)
+
+        with CaptureQueriesContext(connection) as small:
+            b"".join(self.client.get(url).streaming_content)
+        Producto.objects.bulk_create(
+            Producto(epc=f"EXPB{i:04d}", nombre=f"Bulk {i}", aula=self.aula1)
+            for i in range(300)
+        )
+        with CaptureQueriesContext(connection) as large:
+            b"".join(self.client.get(url).streaming_content)
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+
+    def test_benchmark_prestamos_constant_memory(self):
+        """La memoria de la exportación no crece con el número de préstamos."""
+
+        def measure(n):
+            Prestamo.objects.all().delete()
+            Prestamo.objects.bulk_create(
+                (
+                    Prestamo(producto=self.taladro, usuario=self.alumno)
+                    for _ in range(n)
+                ),
+                batch_size=5000,
+            )
+            qs = prestamo_history(Prestamo.objects.order_by("tomado_en"))
+            tracemalloc.start()
+            start = time.perf_counter()
+            size = sum(
+                len(chunk) for chunk in stream_csv(export_rows(qs, PRESTAMO_COLUMNS))
+            )
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return peak, elapsed, size
+
+        small_peak, _, _ = measure(5_000)
+        large_peak, elapsed, size = measure(40_000)
+        logger.info(
+            "Exportación de 40000 préstamos: %.2fs, %.1f MB, pico de memoria "
+            "%.2f MB (5000 préstamos: %.2f MB)",
+            elapsed,
+            size / 1e6,
+            large_peak / 1e6,
+            small_peak / 1e6,
+        )
+        self.assertLess(elapsed, 60)
+        self.assertLess(large_peak, small_peak * 1.5)
@@ -0,0 +1,169 @@
+"""Pruebas de los límites por lector y por aula del listener MQTT."""
+
+import json
+
+import pytest
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from almacen import local_redis
+from almacen.flood_guard import FloodGuard
+from almacen.ingest import get_ingest_redis, stream_for
+from almacen.management.commands import mqtt_bridge, mqtt_listener
+from almacen.models import Aula
+from almacen.mqtt_transport import Message, QueueBroker, QueueTransport
+
+LOCAL_SERVICES = local_redis.local_services("flood-guard")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestFloodGuard(SimpleTestCase):
+    """Prueba los token buckets, el muestreo y la cuarentena."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        self.clock = FakeClock()
+        self.guard = FloodGuard(
+            20,
+            100,
+            50,
+            200,
+            sample_every=10,
+            quarantine_after=10,
+            quarantine_seconds=60,
+            report_seconds=60,
+            clock=self.clock,
+        )
+
+    def _flood(self, reader, per_second, seconds, aula="1"):
+        """Lecturas a ritmo constante; devuelve cuántas pasan."""
+        allowed = 0
+        for _ in range(int(per_second * seconds)):
+            self.clock.now += 1 / per_second
+            allowed += self.guard.allow_reader(reader) and self.guard.allow_aula(aula)
+        return allowed
+
+    def test_normal_traffic_untouched(self):
+        """Una persona con 40 productos cada 10 s no pierde ninguna lectura."""
+        with self.assertNoLogs("almacen.flood_guard", "WARNING"):
+            for _ in range(5):
+                self.assertEqual(self._flood("almacen_1", 200, 0.2), 40)
+                self.clock.now += 10
+        self.assertEqual(self.guard.totals["dropped"], 0)
+
+    def test_flood_sampled_then_quarantined(self):
+        """Un lector que inunda se muestrea y después queda en cuarentena."""
+        with self.assertLogs("almacen.flood_guard", "WARNING") as logs:
+            # Ráfaga de 100 y 20/s; del resto, una de cada diez
+            allowed = self._flood("averiado", 200, 5)
+            self.assertAlmostEqual(allowed, 100 + 20 * 5 + (1000 - 200) / 10, delta=5)
+            self.assertEqual(self.guard.totals["quarantined"], 0)
+
+            # La racha empezó al agotarse la ráfaga (~0,5 s)
+            self._flood("averiado", 200, 6)
+            self.assertEqual(self.guard.totals["quarantined"], 1)
+            # En cuarentena no pasa nada, pero los demás lectores sí
+            self.assertEqual(self._flood("averiado", 200, 30), 0)
+            self.assertEqual(self._flood("almacen_2", 10, 2, aula="2"), 20)
+
+            # Termina la cuarentena: el bucket se ha rellenado
+            self.clock.now += 60
+            self.assertEqual(self._flood("averiado", 10, 1), 10)
+            # El informe periódico muestra el ritmo del lector
+            self.clock.now += 60
+            self.guard.allow_reader("almacen_2")
+
+        output = "\n".join(logs.output)
+        self.assertIn("Lector averiado supera el límite de 20 lecturas/s", output)
+        self.assertIn("Lector averiado en cuarentena 60 s", output)
+        self.assertIn("Lector averiado sale de la cuarentena", output)
+        self.assertRegex(output, r"Lector averiado: [\d.]+ lecturas/s, \d+ descartadas")
+        self.assertNotIn("almacen_2", output)
+
+    def test_aula_limit(self):
+        """Varios lectores de la misma aula comparten su límite, sin cuarentena."""
+        allowed = 0
+        for _ in range(600):
+            self.clock.now += 1 / 120
+            for reader in ("arco_1", "arco_2", "arco_3"):
+                allowed += self.guard.allow_reader(reader) and self.guard.allow_aula(
+                    "7"
+                )
+        # Cada arco va a 120/s: lo que deja pasar cada uno supera el límite del aula
+        self.assertLess(allowed, 200 + 50 * 5 + 3 * 200)
+        self.assertGreater(self.guard.sources["Aula"]["7"].dropped, 0)
+        self.assertEqual(self.guard.totals["quarantined"], 0)
+
+
+@pytest.mark.django_db
+@override_settings(**LOCAL_SERVICES)
+class TestListenerFloodGuard(TestCase):
+    """Prueba los límites dentro del listener."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        local_redis.server.flushall()
+        self.averiada = Aula.objects.create(nombre="Aula Averiada")
+        self.normal = Aula.objects.create(nombre="Aula Normal")
+
+    def _lectura(self, reader, aula, epc):
+        payload = {"aula_id": aula.pk, "epc": epc, "timestamp": "2025-10-07T10:30:00"}
+        return Message(f"rfid/lectura/{reader}", json.dumps(payload).encode())
+
+    def test_listener_drops_flooding_reader(self):
+        """on_message descarta lo que sobra del lector averiado, no del resto."""
+        clock = FakeClock()
+        command = mqtt_listener.Command()
+        command.flood_guard = FloodGuard(20, 100, 50, 200, clock=clock)
+        command.batch_processor = mqtt_listener.BatchProcessor(60)
+        command.recuentos = mqtt_listener.RecuentoCollector()
+
+        for i in range(500):
+            clock.now += 0.005
+            command.on_message(
+                None, None, self._lectura("averiado", self.averiada, "TAG")
+            )
+            if i % 10 == 0:
+                command.on_message(
+                    None, None, self._lectura("almacen_1", self.normal, f"E{i}")
+                )
+
+        batches = command.batch_processor.batches
+        self.assertEqual(len(batches[self.normal.pk]), 50)
+        self.assertLess(len(batches[self.averiada.pk]), 500)
+        self.assertGreater(command.flood_guard.totals["dropped"], 0)
+
+    def test_bridge_drops_flooding_reader(self):
+        """mqtt_bridge aplica los límites antes de añadir la lectura al stream."""
+        clock = FakeClock()
+        broker = QueueBroker()
+        transport = QueueTransport(broker)
+        client = get_ingest_redis()
+        command = mqtt_bridge.Command()
+        command.flood_guard = FloodGuard(20, 100, 50, 200, clock=clock)
+        command.start(transport, client)
+
+        for i in range(500):
+            clock.now += 0.005
+            command.on_message(
+                None, None, self._lectura("averiado", self.averiada, "TAG")
+            )
+            if i % 10 == 0:
+                command.on_message(
+                    None, None, self._lectura("almacen_1", self.normal, f"E{i}")
+                )
+
+        normal = [
+            f
+            for _, f in client.xrange(stream_for(self.normal.pk))
+            if f[b"aula_id"] == str(self.normal.pk).encode()
+        ]
+        self.assertEqual(len(normal), 50)
+        self.assertLess(client.xlen(stream_for(self.averiada.pk)), 500)
+        self.assertGreater(command.flood_guard.totals["dropped"], 0)
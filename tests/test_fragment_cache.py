@@ -0,0 +1,131 @@
+"""Pruebas de la caché de fragmentos de productos del inventario."""
+
+import logging
+import time
+
+import pytest
+from django.contrib.auth.models import Group, User
+from django.core.cache import caches
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from almacen.fragments import render_producto_fragments
+from almacen.local_redis import locmem_caches
+from almacen.models import Aula, Producto, Ubicacion
+
+logger = logging.getLogger(__name__)
+
+LOCMEM = locmem_caches("test-fragment-cache", MAX_ENTRIES=10_000)
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+
+@pytest.mark.django_db
+@override_settings(CACHES=LOCMEM, STORAGES=STORAGES, SECURE_SSL_REDIRECT=False)
+class TestFragmentCache(TestCase):
+    """Prueba el cacheo e invalidación de filas y tarjetas de producto."""
+
+    N_PRODUCTOS = 200
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        caches["default"].clear()
+        self.aula = Aula.objects.create(nombre="Taller Fragmentos")
+        self.user = User.objects.create_user(
+            username="frag_user", email="frag@example.com", password="x"
+        )
+        self.user.persona.aulas_access.add(self.aula)
+        self.profesor = User.objects.create_user(
+            username="frag_profe", email="profe@example.com", password="x"
+        )
+        self.profesor.persona.aulas_access.add(self.aula)
+        self.profesor.groups.add(Group.objects.get_or_create(name="ProfesoresFP")[0])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.productos = [
+                Producto.objects.create(
+                    epc=f"FRAG{i:04d}", nombre=f"Producto {i}", aula=self.aula
+                )
+                for i in range(self.N_PRODUCTOS)
+            ]
+            for p in self.productos:
+                Ubicacion.objects.create(producto=p, aula=self.aula)
+
+        self.factory = RequestFactory()
+
+    def _request(self, user):
+        request = self.factory.get("/")
+        request.user = user
+        return request
+
+    def _render(self, user):
+        qs = Producto.objects.filter(aula=self.aula).order_by("nombre")
+        return render_producto_fragments(self._request(user), qs)
+
+    def test_warm_render_only_reads_ids(self):
+        """Con la caché caliente solo se consultan los ids, sin N+1."""
+        cold = self._render(self.user)
+        self.assertEqual(len(cold["row"]), self.N_PRODUCTOS)
+        self.assertEqual(len(cold["card"]), self.N_PRODUCTOS)
+
+        with CaptureQueriesContext(connection) as ctx:
+            warm = self._render(self.user)
+        # ids del queryset + ámbito de acceso del usuario (nivel de permisos)
+        self.assertLessEqual(len(ctx.captured_queries), 2)
+        self.assertEqual(warm, cold)
+
+    def test_prestamo_invalidates_only_that_product(self):
+        """Al prestar un producto su fragmento se regenera y el resto no."""
+        self._render(self.user)
+        p = self.productos[0]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            p.ubicacion.estado = "PERSONA"
+            p.ubicacion.persona = self.profesor
+            p.ubicacion.save()
+
+        request = self._request(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            rows = render_producto_fragments(
+                request, Producto.objects.filter(aula=self.aula).order_by("nombre")
+            )["row"]
+        # ids + acceso + carga y render del único producto invalidado
+        self.assertLessEqual(len(ctx.captured_queries), 5)
+        self.assertIn("En manos", rows[0])
+        self.assertIn("En estantería", rows[1])
+
+    def test_fragments_depend_on_permission_level(self):
+        """Profesores y usuarios no comparten fragmento (botón de eliminar)."""
+        row_user = self._render(self.user)["row"][0]
+        row_profe = self._render(self.profesor)["row"][0]
+        self.assertNotIn("Eliminar", row_user)
+        self.assertIn("Eliminar", row_profe)
+
+    def test_inventory_view_uses_fragments(self):
+        """La vista de inventario muestra las filas cacheadas."""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("almacen:inventory"))
+        self.assertContains(response, f'id="row-{self.productos[0].pk}"')
+        self.assertContains(response, f'id="mobile-row-{self.productos[0].pk}"')
+
+    def test_benchmark_cold_vs_warm(self):
+        """Mide el render del inventario con la caché fría y caliente."""
+        start = time.perf_counter()
+        self._render(self.user)
+        cold = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self._render(self.user)
+        warm = time.perf_counter() - start
+
+        logger.info(
+            "Fragmentos de %d productos: fría %.1f ms, caliente %.1f ms",
+            self.N_PRODUCTOS,
+            cold * 1000,
+            warm * 1000,
+        )
+        self.assertLess(warm, cold)
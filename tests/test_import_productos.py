@@ -0,0 +1,187 @@
+"""Pruebas del comando import_productos."""
+
+import csv
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from almacen.models import Aula, Producto, Ubicacion
+
+HEADER = ["epc", "nombre", "aula", "estanteria", "posicion", "cantidad", "fds"]
+
+
+@pytest.mark.django_db
+class TestImportProductos(TestCase):
+    """Prueba la importación masiva de productos desde CSV."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        self.aula_a = Aula.objects.create(nombre="Taller Import A")
+        self.aula_b = Aula.objects.create(nombre="Taller Import B")
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _csv(self, rows, name="productos.csv"):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADER)
+            writer.writerows(rows)
+        return path
+
+    def _import(self, path, *args):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("import_productos", path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_import_creates_products_and_ubicaciones(self):
+        """Crea productos y su ubicación en estantería; el aula va por nombre."""
+        path = self._csv(
+            [
+                ["IMP001", "Taladro", "taller import a", "E1", "3", "2", ""],
+                ["IMP002", "Sierra", "Taller Import B", "E2", "", "", ""],
+            ]
+        )
+        output = self._import(path)
+
+        self.assertIn("2 nuevos, 0 actualizados, 0 rechazados", output)
+        taladro = Producto.objects.get(epc="IMP001")
+        self.assertEqual(taladro.aula, self.aula_a)
+        self.assertEqual(taladro.cantidad, 2)
+        self.assertEqual(Producto.objects.get(epc="IMP002").cantidad, 1)
+        u = taladro.ubicacion
+        self.assertEqual(
+            (u.estado, u.aula, u.estanteria), ("ESTANTE", self.aula_a, "E1")
+        )
+
+    def test_rejected_rows_are_reported(self):
+        """Las filas no válidas se rechazan con el motivo y no se importan."""
+        path = self._csv(
+            [
+                ["IMP010", "Válido", "Taller Import A", "", "", "", ""],
+                ["", "Sin EPC", "Taller Import A", "", "", "", ""],
+                ["IMP011", "Aula mala", "Taller Inexistente", "", "", "", ""],
+                ["IMP012", "Cantidad", "Taller Import A", "", "", "mucho", ""],
+                ["IMP013", "URL", "Taller Import A", "", "", "", "no es url"],
+                ["IMP010", "Repetido", "Taller Import A", "", "", "", ""],
+            ]
+        )
+        rejects = os.path.join(self.tmpdir.name, "rechazos.csv")
+        output = self._import(path, "--rejects", rejects)
+
+        self.assertIn("1 nuevos, 0 actualizados, 5 rechazados", output)
+        self.assertIn("línea 3: epc:", output)
+        self.assertIn("no existe el aula 'Taller Inexistente'", output)
+        self.assertIn("repetido en el fichero", output)
+        self.assertEqual(
+            list(Producto.objects.values_list("epc", flat=True)), ["IMP010"]
+        )
+        with open(rejects, encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0][0], "linea")
+        self.assertEqual([row[0] for row in rows[1:]], ["3", "4", "5", "6", "7"])
+
+    def test_reimport_is_an_upsert_on_epc(self):
+        """Reimportar actualiza por EPC y solo mueve la ubicación si no está prestado."""
+        path = self._csv(
+            [
+                ["IMP020", "Taladro", "Taller Import A", "E1", "", "", ""],
+                ["IMP021", "Sierra", "Taller Import A", "E1", "", "", ""],
+            ]
+        )
+        self._import(path)
+        user = User.objects.create_user(username="imp", email="imp@example.com")
+        Ubicacion.objects.filter(producto__epc="IMP021").update(
+            estado="PERSONA", persona=user
+        )
+
+        path = self._csv(
+            [
+                ["IMP020", "Taladro percutor", "Taller Import B", "E9", "", "", ""],
+                ["IMP021", "Sierra", "Taller Import B", "E9", "", "", ""],
+            ],
+            name="v2.csv",
+        )
+        output = self._import(path)
+
+        self.assertIn("0 nuevos, 2 actualizados", output)
+        self.assertEqual(Producto.objects.count(), 2)
+        self.assertEqual(Ubicacion.objects.count(), 2)
+        taladro = Producto.objects.get(epc="IMP020")
+        self.assertEqual(
+            (taladro.nombre, taladro.aula), ("Taladro percutor", self.aula_b)
+        )
+        self.assertEqual(
+            (taladro.ubicacion.aula, taladro.ubicacion.estanteria), (self.aula_b, "E9")
+        )
+        prestado = Ubicacion.objects.get(producto__epc="IMP021")
+        self.assertEqual((prestado.estado, prestado.estanteria), ("PERSONA", "E1"))
+
+    def test_reimport_creates_missing_ubicacion(self):
+        """Un producto existente sin ubicación recibe una en estantería al importarlo."""
+        Producto.objects.create(epc="IMP030", nombre="Lima", aula=self.aula_a)
+        path = self._csv(
+            [["IMP030", "Lima plana", "Taller Import B", "E3", "", "", ""]]
+        )
+        output = self._import(path)
+
+        self.assertIn("0 nuevos, 1 actualizados", output)
+        ubicacion = Ubicacion.objects.get(producto__epc="IMP030")
+        self.assertEqual(
+            (ubicacion.estado, ubicacion.aula, ubicacion.estanteria),
+            ("ESTANTE", self.aula_b, "E3"),
+        )
+
+    def test_queries_per_chunk_are_constant(self):
+        """Sin consultas por fila: solo crecen los lotes del INSERT masivo."""
+
+        def queries(n, name):
+            rows = [
+                [f"IMQ{name}{i:04d}", f"P{i}", "Taller Import A", "", "", "", ""]
+                for i in range(n)
+            ]
+            path = self._csv(rows, name=f"{name}.csv")
+            with CaptureQueriesContext(connection) as ctx:
+                self._import(path, "--chunk-size", "500")
+            return [q["sql"] for q in ctx.captured_queries]
+
+        small, large = queries(50, "a"), queries(400, "b")
+        not_insert = [
+            [sql for sql in qs if not sql.startswith("INSERT")] for qs in (small, large)
+        ]
+        self.assertEqual(len(not_insert[0]), len(not_insert[1]))
+        self.assertLess(len(large), 400 / 10)
+
+    def test_caches_are_invalidated(self):
+        """Como bulk_create no emite señales, se invalidan las cachés a mano."""
+        path = self._csv([["IMP030", "Taladro", "Taller Import A", "", "", "", ""]])
+        with (
+            patch(
+                "almacen.management.commands.import_productos.bump_producto_versions"
+            ) as bump_productos,
+            patch(
+                "almacen.management.commands.import_productos.bump_aula_versions"
+            ) as bump_aulas,
+        ):
+            self._import(path)
+        pk = Producto.objects.get(epc="IMP030").pk
+        bump_productos.assert_called_once_with([pk])
+        bump_aulas.assert_called_once_with({self.aula_a.pk})
+
+    def test_dry_run_writes_nothing(self):
+        """--dry-run solo valida."""
+        path = self._csv([["IMP040", "Taladro", "Taller Import A", "", "", "", ""]])
+        output = self._import(path, "--dry-run")
+        self.assertIn("Validados", output)
+        self.assertFalse(Producto.objects.exists())
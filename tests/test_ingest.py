@@ -0,0 +1,211 @@
+"""
+Pruebas del bus de ingesta con Redis Streams (mqtt_bridge → streams →
+ingest_worker), con el Redis en memoria de almacen/local_redis.py.
+"""
+
+import io
+import json
+import threading
+from unittest.mock import patch
+
+import pytest
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from almacen import local_redis
+from almacen.ingest import (
+    StreamConsumer,
+    add_reading,
+    get_ingest_redis,
+    stream_for,
+    stream_names,
+    stream_status,
+)
+from almacen.management.commands import ingest_worker, mqtt_bridge, mqtt_listener
+from almacen.models import Aula, Prestamo, Producto
+from almacen.mqtt_transport import QueueBroker, QueueTransport
+
+LOCAL_SERVICES = {**local_redis.local_services("ingest"), "INGEST_PARTITIONS": 4}
+
+
+@pytest.mark.django_db
+@override_settings(**LOCAL_SERVICES)
+class TestIngestBus(TestCase):
+    """Prueba el puente MQTT → streams y el worker que confirma tras el commit."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        local_redis.server.flushall()
+        self.client = get_ingest_redis()
+        self.aula = Aula.objects.create(nombre="Taller Streams")
+        self.productos = [
+            Producto.objects.create(
+                epc=f"STREAM{i:03d}", nombre=f"Producto {i}", aula=self.aula
+            )
+            for i in range(3)
+        ]
+        self.user = User.objects.create_user(
+            username="streams", email="streams@example.com"
+        )
+        self.user.groups.add(Group.objects.get_or_create(name="ProfesoresFP")[0])
+        persona = self.user.persona
+        persona.epc = "LLAVERO_STREAMS"
+        persona.save()
+
+    def _add_pass(self):
+        """Llavero y los tres productos, como los deja mqtt_bridge."""
+        for epc in ["LLAVERO_STREAMS"] + [p.epc for p in self.productos]:
+            add_reading(
+                self.client,
+                str(self.aula.pk),
+                epc,
+                timezone.now(),
+                "rfid/lectura/almacen_1",
+            )
+
+    def _run_worker(self, consumer):
+        command = ingest_worker.Command()
+        command.start(consumer, ingest_worker.AckingBatchProcessor(0, consumer))
+        stop = threading.Event()
+        stop.set()
+        command.serve(consumer, 0.01, stop)
+
+    def _totals(self):
+        status = stream_status(self.client)
+        return sum(s["lag"] for s in status), sum(s["pending"] for s in status)
+
+    def test_bridge_partitions_by_aula(self):
+        """Cada lectura válida va, decodificada, al stream de su aula."""
+        broker = QueueBroker()
+        transport = QueueTransport(broker)
+        command = mqtt_bridge.Command()
+        command.start(transport, self.client)
+
+        aulas = [str(n) for n in range(1, 9)]
+        for aula_id in aulas:
+            broker.publish(
+                "rfid/lectura/almacen_1",
+                json.dumps(
+                    {
+                        "aula_id": aula_id,
+                        "epc": f"EPC{aula_id}",
+                        "timestamp": "2025-10-07T10:30:00",
+                    }
+                ),
+            )
+        broker.publish("rfid/lectura/almacen_1", "no es json")
+        broker.publish("rfid/pantalla/almacen_1", "1")
+        stop = threading.Event()
+        stop.set()
+        command.serve(transport, stop)
+
+        self.assertEqual(sum(self.client.xlen(s) for s in stream_names()), 8)
+        self.assertGreater(len({stream_for(a) for a in aulas}), 1)
+        for aula_id in aulas:
+            fields = [f for _, f in self.client.xrange(stream_for(aula_id))]
+            self.assertIn(
+                {
+                    b"aula_id": aula_id.encode(),
+                    b"epc": f"EPC{aula_id}".encode(),
+                    b"leido_en": b"2025-10-07T10:30:00+02:00",
+                    b"topic": b"rfid/lectura/almacen_1",
+                },
+                fields,
+            )
+
+    def test_worker_acks_after_commit(self):
+        """El worker crea los préstamos y solo entonces confirma las lecturas."""
+        self._add_pass()
+        consumer = StreamConsumer(self.client, stream_names(), "prueba")
+        self._run_worker(consumer)
+
+        self.assertEqual(
+            Prestamo.objects.filter(
+                usuario=self.user, devuelto_en__isnull=True
+            ).count(),
+            3,
+        )
+        self.assertEqual(self._totals(), (0, 0))
+        cached = mqtt_listener.CACHE_KEY_FORMAT.format(self.aula.pk)
+        self.assertIsNotNone(
+            mqtt_listener.get_epc_cache().get(cached),
+        )
+
+    def test_failed_batch_is_redelivered(self):
+        """Si el commit falla las lecturas siguen pendientes y se reprocesan."""
+        self._add_pass()
+        toggle = mqtt_listener.toggle
+        calls = []
+
+        def locked_once(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise OperationalError("database is locked")
+            return toggle(*args, **kwargs)
+
+        consumer = StreamConsumer(
+            self.client, stream_names(), "prueba", retry_seconds=0
+        )
+        with patch.object(mqtt_listener, "toggle", side_effect=locked_once):
+            command = ingest_worker.Command()
+            command.start(consumer, ingest_worker.AckingBatchProcessor(0, consumer))
+            consumer.loop(0.01)  # historial vacío
+            consumer.loop(0.01)  # lecturas nuevas
+            command.batch_processor.check_and_process_batches()
+            self.assertEqual(self._totals(), (0, 4))
+            self.assertFalse(Prestamo.objects.exists())
+
+            stop = threading.Event()
+            stop.set()
+            command.serve(consumer, 0.01, stop)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(Prestamo.objects.filter(devuelto_en__isnull=True).count(), 3)
+        self.assertEqual(self._totals(), (0, 0))
+
+    def test_backlog_not_rate_limited(self):
+        """Al vaciar un atraso de un solo lector no se descarta ninguna lectura."""
+        leido_en = timezone.now()
+        for i in range(1200):
+            add_reading(
+                self.client,
+                str(self.aula.pk),
+                f"ATRASO{i:04d}",
+                leido_en,
+                "rfid/lectura/almacen_1",
+            )
+        consumer = StreamConsumer(self.client, stream_names(), "prueba")
+        add_epc = mqtt_listener.BatchProcessor.add_epc
+        with patch.object(
+            ingest_worker.AckingBatchProcessor, "add_epc", autospec=True
+        ) as queued:
+            queued.side_effect = add_epc
+            self._run_worker(consumer)
+
+        self.assertEqual(queued.call_count, 1200)
+        self.assertEqual(self._totals(), (0, 0))
+
+    def test_status_and_rewind(self):
+        """ingest_status muestra el lag y --rewind vuelve a entregar lecturas."""
+        self._add_pass()
+        out = io.StringIO()
+        call_command("ingest_status", stdout=out)
+        self.assertIn(
+            f"{stream_for(self.aula.pk)}: 4 lecturas, 4 sin leer", out.getvalue()
+        )
+        with self.assertRaises(CommandError):
+            call_command("ingest_status", max_lag=3, stdout=io.StringIO())
+
+        self._run_worker(StreamConsumer(self.client, stream_names(), "prueba"))
+        self.assertEqual(self._totals(), (0, 0))
+
+        call_command("ingest_status", rewind="0", stdout=io.StringIO())
+        self.assertEqual(self._totals(), (4, 0))
+        # Reprocesar la misma pasada devuelve los productos
+        self._run_worker(StreamConsumer(self.client, stream_names(), "prueba"))
+        self.assertEqual(Prestamo.objects.filter(devuelto_en__isnull=False).count(), 3)
+        self.assertEqual(self._totals(), (0, 0))
@@ -0,0 +1,126 @@
+"""Pruebas de las actualizaciones en vivo de filas de inventario y préstamos."""
+
+from unittest.mock import call, patch
+
+import pytest
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from almacen.events import PRODUCTO_CHANNEL_FORMAT, publish_producto_change
+from almacen.models import Aula, Producto, Ubicacion
+from tests.test_epc_stream import fake_subscribe
+
+
+async def read_stream(response):
+    return [
+        chunk.decode() if isinstance(chunk, bytes) else chunk
+        async for chunk in response.streaming_content
+    ]
+
+
+@pytest.mark.django_db
+@override_settings(SECURE_SSL_REDIRECT=False)
+class TestLiveRows(TestCase):
+    """Prueba la publicación de cambios y el endpoint SSE de filas."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        self.aula1 = Aula.objects.create(nombre="Taller Vivo 1")
+        self.aula2 = Aula.objects.create(nombre="Taller Vivo 2")
+        self.user = User.objects.create_user(
+            username="live_user", email="live@example.com", password="x"
+        )
+        self.user.persona.aulas_access.add(self.aula1)
+
+        self.producto1 = Producto.objects.create(
+            epc="LIVE001", nombre="Taladro", aula=self.aula1
+        )
+        Ubicacion.objects.create(producto=self.producto1, aula=self.aula1)
+        self.producto2 = Producto.objects.create(
+            epc="LIVE002", nombre="Soldador", aula=self.aula2
+        )
+
+    def test_publish_after_commit_to_each_aula(self):
+        """El cambio se publica al confirmar, una vez por aula afectada."""
+        with patch("almacen.events.publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                publish_producto_change(7, self.aula1.pk, self.aula2.pk, None)
+                publish.assert_not_called()
+
+        payload = {"producto_id": 7}
+        publish.assert_has_calls(
+            [
+                call(PRODUCTO_CHANNEL_FORMAT.format(self.aula1.pk), payload),
+                call(PRODUCTO_CHANNEL_FORMAT.format(self.aula2.pk), payload),
+            ],
+            any_order=True,
+        )
+
+    def test_toggle_prestamo_publishes_change(self):
+        """Tomar un producto desde la web notifica a las páginas abiertas."""
+        self.client.force_login(self.user)
+        with patch("almacen.events.publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(
+                    reverse("almacen:toggle_prestamo", args=[self.producto1.pk])
+                )
+
+        publish.assert_called_once_with(
+            PRODUCTO_CHANNEL_FORMAT.format(self.aula1.pk),
+            {"producto_id": self.producto1.pk},
+        )
+
+    async def test_inventory_stream_is_filtered_by_access(self):
+        """Solo se suscribe a las aulas accesibles y envía la fila renderizada."""
+        subscribe = fake_subscribe(
+            [
+                {"producto_id": self.producto1.pk},
+                {"producto_id": self.producto2.pk},
+            ]
+        )
+        await self.async_client.aforce_login(self.user)
+
+        with patch("almacen.events.subscribe", subscribe):
+            response = await self.async_client.get(
+                reverse("almacen:productos_stream"), {"vista": "inventario"}
+            )
+            chunks = await read_stream(response)
+
+        self.assertEqual(
+            subscribe.calls, [[PRODUCTO_CHANNEL_FORMAT.format(self.aula1.pk)]]
+        )
+        self.assertTrue(chunks[1].startswith("event: row\n"))
+        self.assertIn(f'id="row-{self.producto1.pk}"', chunks[1])
+        self.assertIn("Taladro", chunks[1])
+        # Un producto de un aula no accesible nunca se renderiza
+        self.assertEqual(
+            chunks[2], f"event: row-removed\ndata: row-{self.producto2.pk}\n\n"
+        )
+
+    async def test_prestamos_stream_adds_and_removes_rows(self):
+        """En préstamos se envía la fila si está en manos y se elimina si no."""
+        await Ubicacion.objects.filter(producto=self.producto1).aupdate(
+            estado="PERSONA", persona=self.user
+        )
+        subscribe = fake_subscribe([{"producto_id": self.producto1.pk}])
+        await self.async_client.aforce_login(self.user)
+
+        with patch("almacen.events.subscribe", subscribe):
+            response = await self.async_client.get(
+                reverse("almacen:productos_stream"), {"vista": "prestamos"}
+            )
+            chunks = await read_stream(response)
+        self.assertIn(f'id="prestamo-{self.producto1.pk}"', chunks[1])
+
+        await Ubicacion.objects.filter(producto=self.producto1).aupdate(
+            estado="ESTANTE", persona=None
+        )
+        with patch("almacen.events.subscribe", subscribe):
+            response = await self.async_client.get(
+                reverse("almacen:productos_stream"), {"vista": "prestamos"}
+            )
+            chunks = await read_stream(response)
+        self.assertEqual(
+            chunks[1], f"event: row-removed\ndata: prestamo-{self.producto1.pk}\n\n"
+        )
@@ -0,0 +1,71 @@
+"""Pruebas del banco de carga de arcos RFID y usuarios simulados."""
+
+import json
+import os
+import tempfile
+from io import StringIO
+
+import pytest
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+from django.test import TransactionTestCase
+
+from almacen.models import Aula, Prestamo, Producto, Ubicacion
+
+
+@pytest.mark.django_db(transaction=True)
+class TestLoadtestFleet(TransactionTestCase):
+    """Prueba una ejecución corta con el listener real y el broker sustituto."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        profesores = Group.objects.get_or_create(name="ProfesoresFP")[0]
+        for n in (1, 2):
+            aula = Aula.objects.create(nombre=f"Taller Carga {n}")
+            for i in range(10):
+                producto = Producto.objects.create(
+                    epc=f"CARGA{n}{i:02d}", nombre=f"Producto {n}-{i}", aula=aula
+                )
+                Ubicacion.objects.create(producto=producto, aula=aula)
+            user = User.objects.create_user(
+                username=f"carga{n}", email=f"carga{n}@example.com"
+            )
+            user.groups.add(profesores)
+            persona = user.persona
+            persona.epc = f"LLAVERO{n}"
+            persona.save()
+            persona.aulas_access.add(aula)
+
+    def test_gates_and_users(self):
+        """Todas las lecturas se guardan, sin errores de bloqueo de la BD."""
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+
+        out = StringIO()
+        call_command(
+            "loadtest_fleet",
+            "--gates=2",
+            "--users=2",
+            "--duration=2",
+            "--interval=0.3",
+            "--think=0.1",
+            "--batch-time=0.3",
+            "--check-interval=0.1",
+            f"--report={path}",
+            stdout=out,
+        )
+        self.assertIn("Reading → commit: p50", out.getvalue())
+
+        with open(path, encoding="utf-8") as f:
+            report = json.load(f)
+        readings = report["readings"]
+        self.assertGreater(readings["published"], 0)
+        self.assertEqual(readings["pending"], 0)
+        self.assertGreater(readings["committed"], 0)
+        self.assertEqual(report["lock_errors"], {})
+        self.assertEqual(report["errors"], {})
+        self.assertTrue(
+            set(report["pages"]) <= {"get_latest_epc", "inventory", "toggle_prestamo"}
+        )
+        self.assertTrue(Prestamo.objects.exists())
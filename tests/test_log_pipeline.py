@@ -0,0 +1,135 @@
+"""Pruebas del logging por cola del listener MQTT (almacen/log_pipeline.py)."""
+
+import json
+import logging
+import logging.handlers
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from almacen.log_pipeline import (
+    InProcessQueueHandler,
+    RateLimitFilter,
+    start_queue_logging,
+    stop_queue_logging,
+)
+from almacen.management.commands import mqtt_listener
+
+
+class TestLogPipeline(SimpleTestCase):
+    """Prueba la cola de logging, el límite por plantilla y el modo JSON."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir)
+        self.log_file = os.path.join(log_dir, "mqtt-listener.log")
+
+        root = logging.getLogger()
+        level, handlers = root.level, list(root.handlers)
+
+        def restore():
+            stop_queue_logging()
+            root.setLevel(level)
+            root.handlers[:] = handlers
+
+        self.addCleanup(restore)
+        # Sin los handlers de captura del runner, que formatean en este hilo
+        root.handlers[:] = []
+        self.logger = logging.getLogger("almacen.management.commands.mqtt_listener")
+
+    def _lines(self):
+        stop_queue_logging()  # vacía la cola y cierra el fichero
+        with open(self.log_file, encoding="utf-8") as f:
+            return f.read().splitlines()
+
+    def test_each_line_written_once(self):
+        """setup_logging repetido deja un solo handler y cada línea una vez."""
+        with patch.object(mqtt_listener, "get_log_file", return_value=self.log_file):
+            mqtt_listener.setup_logging()
+            mqtt_listener.setup_logging()
+        handlers = [
+            h
+            for h in logging.getLogger().handlers
+            if isinstance(h, InProcessQueueHandler)
+        ]
+        self.assertEqual(len(handlers), 1)
+        self.assertFalse(self.logger.handlers)
+
+        self.logger.warning("EPC '%s' no encontrado", "E1")
+        lines = [line for line in self._lines() if "no encontrado" in line]
+        self.assertEqual(len(lines), 1)
+        self.assertIn("WARNING - EPC 'E1' no encontrado", lines[0])
+
+    def test_file_written_by_writer_thread(self):
+        """El hilo que emite no formatea ni escribe: lo hace el hilo escritor."""
+        start_queue_logging(self.log_file)
+        threads = []
+        emit = logging.handlers.RotatingFileHandler.emit
+
+        def spy(handler, record):
+            threads.append(threading.current_thread())
+            emit(handler, record)
+
+        formatted = []
+
+        class Arg:
+            def __str__(self):
+                formatted.append(threading.current_thread())
+                return "valor"
+
+        with patch.object(logging.handlers.RotatingFileHandler, "emit", spy):
+            self.logger.info("Lectura %s", Arg())
+            self.assertEqual(self._lines()[-1].rsplit(" - ", 1)[-1], "Lectura valor")
+        self.assertNotIn(threading.current_thread(), threads + formatted)
+
+    def test_rate_limit_per_template(self):
+        """Los INFO repetidos se limitan por plantilla; los WARNING y la auditoría no."""
+        handler = start_queue_logging(self.log_file, rate_per_minute=5)
+        [rate_limit] = handler.filters
+        rate_limit.window_seconds = 0.2
+
+        for i in range(50):
+            self.logger.info("Lectura recibida: '%s'", i)
+            self.logger.info("Batch procesado: '%s'", i)
+            self.logger.warning("EPC '%s' no encontrado", i)
+            self.logger.info("✓ PRÉSTAMO: '%s'", i, extra={"rate_limit": False})
+        time.sleep(0.25)
+        self.logger.info("Lectura recibida: '%s'", "siguiente")
+
+        lines = self._lines()
+        lecturas = [line for line in lines if "Lectura recibida" in line]
+        self.assertEqual(len(lecturas), 6)
+        self.assertTrue(lecturas[-1].endswith("'siguiente' [+45 similares omitidos]"))
+        self.assertEqual(len([line for line in lines if "Batch procesado" in line]), 5)
+        self.assertEqual(len([line for line in lines if "no encontrado" in line]), 50)
+        self.assertEqual(len([line for line in lines if "PRÉSTAMO" in line]), 50)
+
+    def test_json_format(self):
+        """En modo JSON cada línea es un objeto con los campos de extra."""
+        start_queue_logging(self.log_file, json_format=True)
+        self.logger.info(
+            "✓ PRÉSTAMO: '%s'", "Taladro", extra={"aula_id": "3", "epc": "E1"}
+        )
+        try:
+            raise ValueError("fallo")
+        except ValueError:
+            self.logger.exception("Error procesando batch")
+
+        prestamo, error = [json.loads(line) for line in self._lines()]
+        self.assertEqual(prestamo["msg"], "✓ PRÉSTAMO: 'Taladro'")
+        self.assertEqual(prestamo["level"], "INFO")
+        self.assertEqual((prestamo["aula_id"], prestamo["epc"]), ("3", "E1"))
+        self.assertIn("ValueError: fallo", error["exc"])
+
+    def test_rate_limit_filter_alone(self):
+        """Sin límite (0) todo pasa; por encima de INFO nunca se descarta."""
+        record = logging.makeLogRecord({"msg": "x", "levelno": logging.INFO})
+        self.assertTrue(all(RateLimitFilter(0).filter(record) for _ in range(10)))
+        limited = RateLimitFilter(1)
+        self.assertEqual([limited.filter(record) for _ in range(3)], [1, 0, 0])
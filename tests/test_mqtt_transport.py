@@ -0,0 +1,182 @@
+"""
+Pruebas del broker MQTT en memoria y del camino completo del listener
+(broker → on_message → caché y eventos → BatchProcessor → BD) sin mosquitto
+ni Redis.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import Group, User
+from django.db import connections
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from almacen.events import aget_latest_epc, get_epc_cache, publish, subscribe
+from almacen.local_redis import local_services
+from almacen.management.commands import mqtt_listener
+from almacen.management.commands.loadtest_fleet import (
+    PAYLOAD_FORMAT,
+    Stats,
+    TimedBatchProcessor,
+    percentiles,
+)
+from almacen.models import Aula, Prestamo, Producto, Ubicacion
+from almacen.mqtt_transport import QueueBroker, QueueTransport
+
+logger = logging.getLogger(__name__)
+
+LOCAL_SERVICES = local_services("mqtt-transport")
+
+
+class TestQueueBroker(SimpleTestCase):
+    """Prueba los filtros de topic del broker en memoria."""
+
+    def test_topic_filters(self):
+        """Cada suscripción recibe solo los topics que encajan con su filtro."""
+        broker = QueueBroker()
+        todo = broker.subscribe("rfid/#")
+        pantallas = broker.subscribe("rfid/pantalla/+")
+
+        self.assertEqual(broker.publish("rfid/lectura/almacen_1", "{}"), 1)
+        self.assertEqual(broker.publish("rfid/pantalla/almacen_1", "1"), 2)
+        self.assertEqual(broker.publish("otro/topic", "x"), 0)
+        self.assertEqual(broker.pending(), 3)
+
+        self.assertEqual(todo.get_nowait().topic, "rfid/lectura/almacen_1")
+        message = pantallas.get_nowait()
+        self.assertEqual(message, ("rfid/pantalla/almacen_1", b"1"))
+
+        broker.unsubscribe(todo)
+        self.assertEqual(broker.publish("rfid/lectura/almacen_1", "{}"), 0)
+
+    @override_settings(**LOCAL_SERVICES)
+    def test_memory_pubsub(self):
+        """Con memory:// lo publicado desde otro hilo llega a la suscripción SSE."""
+
+        async def receive():
+            stream = subscribe(["almacen:test"])
+            first = asyncio.ensure_future(anext(stream))
+            await asyncio.sleep(0.05)  # ya suscrito
+            thread = threading.Thread(target=publish, args=("almacen:test", {"a": 1}))
+            thread.start()
+            payload = await asyncio.wait_for(first, 5)
+            thread.join()
+            await stream.aclose()
+            return payload
+
+        self.assertEqual(async_to_sync(receive)(), {"a": 1})
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(**LOCAL_SERVICES)
+class TestListenerEndToEnd(TransactionTestCase):
+    """Prueba el listener real alimentado por el broker en memoria."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        self.aula = Aula.objects.create(nombre="Taller Transporte")
+        self.productos = [
+            Producto.objects.create(
+                epc=f"TRANSPORTE{i:03d}", nombre=f"Producto {i}", aula=self.aula
+            )
+            for i in range(50)
+        ]
+        for producto in self.productos:
+            Ubicacion.objects.create(producto=producto, aula=self.aula)
+        self.user = User.objects.create_user(
+            username="transporte", email="transporte@example.com"
+        )
+        self.user.groups.add(Group.objects.get_or_create(name="ProfesoresFP")[0])
+        persona = self.user.persona
+        persona.epc = "LLAVERO_TRANSPORTE"
+        persona.save()
+
+    def test_readings_reach_database_and_events(self):
+        """Llavero y productos de varias pasadas acaban en préstamos y eventos."""
+        broker = QueueBroker()
+        transport = QueueTransport(broker)
+        stats = Stats()
+        command = mqtt_listener.Command()
+        command.start(transport, TimedBatchProcessor(0.2, stats))
+        stop = threading.Event()
+
+        def serve():
+            try:
+                command.serve(transport, 0.05, stop)
+            finally:
+                connections.close_all()
+
+        listener = threading.Thread(target=serve, daemon=True)
+        listener.start()
+
+        aula_id = str(self.aula.pk)
+        start = time.perf_counter()
+        # Cinco pasadas: llavero y diez productos cada una
+        for n in range(5):
+            epcs = ["LLAVERO_TRANSPORTE"] + [
+                p.epc for p in self.productos[n * 10 : (n + 1) * 10]
+            ]
+            for epc in epcs:
+                broker.publish("rfid/pantalla/almacen_1", "1")
+                stats.sent(aula_id, epc, broker.pending())
+                broker.publish(
+                    "rfid/lectura/almacen_1",
+                    PAYLOAD_FORMAT.format(aula_id, epc, timezone.now().isoformat()),
+                )
+            time.sleep(0.3)  # el arco queda libre: se cierra el batch
+        stop.set()
+        listener.join(timeout=10)
+        elapsed = time.perf_counter() - start
+        self.assertFalse(listener.is_alive())
+
+        self.assertEqual(stats.pending, {})
+        self.assertEqual(stats.errors, {})
+        self.assertEqual(
+            Prestamo.objects.filter(
+                usuario=self.user, devuelto_en__isnull=True
+            ).count(),
+            50,
+        )
+        last = self.productos[-1].epc
+        cached = get_epc_cache().get(mqtt_listener.CACHE_KEY_FORMAT.format(aula_id))
+        self.assertEqual(cached["epc"], last)
+        self.assertEqual(async_to_sync(aget_latest_epc)(aula_id)["epc"], last)
+
+        p50, p95, _ = percentiles(stats.reading_latencies)
+        logger.info(
+            "Listener: %d lecturas en %.2fs (%.0f lecturas/s), "
+            "lectura → commit p50 %.0f ms, p95 %.0f ms",
+            stats.published,
+            elapsed,
+            stats.published / elapsed,
+            p50,
+            p95,
+        )
+        # Batch de 0.2 s más el intervalo de comprobación, con margen
+        self.assertLess(p95, 2000)
+
+    def test_unknown_topic_and_bad_payload(self):
+        """Mensajes fuera de rfid/lectura o con JSON inválido no llegan a la BD."""
+        broker = QueueBroker()
+        transport = QueueTransport(broker)
+        command = mqtt_listener.Command()
+        command.start(transport, mqtt_listener.BatchProcessor(0))
+
+        broker.publish("rfid/estado/almacen_1", "online")
+        broker.publish("rfid/lectura/almacen_1", "no es json")
+        broker.publish(
+            "rfid/lectura/almacen_1",
+            json.dumps({"aula_id": str(self.aula.pk), "epc": "TRANSPORTE000"}),
+        )
+        stop = threading.Event()
+        stop.set()
+        command.serve(transport, 0.05, stop)
+
+        self.assertEqual(transport.pending(), 0)
+        self.assertFalse(Prestamo.objects.exists())
@@ -0,0 +1,277 @@
+"""
+Presupuestos de consultas y tiempos de las vistas calientes con datos escalados.
+
+Cada vista declara su presupuesto con @query_budget (almacen/perf.py); aquí se
+comprueba con assertNumQueries que se cumple igual con 100 que con 10k o 100k
+productos. Con ALMACEN_PERF_REPORT=<ruta> los tiempos se guardan en ese
+informe JSON para comparar entre versiones; sin ella no se escribe nada.
+
+Los tamaños se eligen con ALMACEN_PERF_SIZES (por defecto "100,10000"; la
+ejecución completa es ALMACEN_PERF_SIZES=100,10000,100000).
+"""
+
+import json
+import os
+import time
+import unittest
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+from django.contrib.auth.models import Group, User
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from almacen.local_redis import locmem_caches
+from almacen.management.commands.mqtt_listener import BatchProcessor
+from almacen.models import Aula, Prestamo, Producto, Ubicacion
+from almacen.perf import get_query_budget
+
+SIZES = [
+    int(size)
+    for size in os.environ.get("ALMACEN_PERF_SIZES", "100,10000").split(",")
+    if size.strip()
+]
+REPORT_PATH = os.environ.get("ALMACEN_PERF_REPORT")
+CHUNK_SIZE = 5000
+# Uno de cada PRESTADOS_CADA productos está prestado
+PRESTADOS_CADA = 10
+INVENTORY_COLD_QUERIES = 8
+LOCMEM = locmem_caches("test-perf", MAX_ENTRIES=1_000_000)
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+_report = {}
+
+
+def write_report():
+    """Mezcla los tiempos medidos con los del informe existente."""
+    if not REPORT_PATH:
+        return
+    try:
+        with open(REPORT_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {}
+    for name, sizes in _report.items():
+        data.setdefault(name, {}).update(sizes)
+    with open(REPORT_PATH, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+class QueryBudgetMixin:
+    """Datos de SIZE productos (y sus préstamos) y las comprobaciones comunes."""
+
+    SIZE = 0
+
+    @classmethod
+    def setUpTestData(cls):
+        """Configurar datos de prueba."""
+        size = cls.SIZE
+        cls.aula = Aula.objects.create(nombre=f"Taller {size}")
+        cls.profesor = User.objects.create_user(
+            username=f"perf_profe_{size}", email=f"profe{size}@example.com"
+        )
+        cls.profesor.groups.add(Group.objects.get_or_create(name="ProfesoresFP")[0])
+        persona = cls.profesor.persona
+        persona.aulas_access.add(cls.aula)
+        persona.last_aula = cls.aula
+        persona.epc = f"LLAVERO{size}"
+        persona.save()
+        cls.alumnos = [
+            User.objects.create_user(
+                username=f"perf_alumno_{size}_{i}", email=f"a{size}_{i}@example.com"
+            )
+            for i in range(10)
+        ]
+
+        productos = Producto.objects.bulk_create(
+            (
+                Producto(
+                    epc=f"E{size:06d}{i:08d}",
+                    nombre=f"Producto {i}",
+                    aula=cls.aula,
+                    estanteria=f"E{i % 20}",
+                )
+                for i in range(size)
+            ),
+            batch_size=CHUNK_SIZE,
+        )
+        ahora = timezone.now()
+        ubicaciones, prestamos = [], []
+        for i, p in enumerate(productos):
+            prestado = i % PRESTADOS_CADA == 0
+            alumno = cls.alumnos[i % len(cls.alumnos)]
+            ubicaciones.append(
+                Ubicacion(
+                    producto=p,
+                    aula=None if prestado else cls.aula,
+                    estado="PERSONA" if prestado else "ESTANTE",
+                    persona=alumno if prestado else None,
+                    estanteria=p.estanteria,
+                )
+            )
+            # Historial: un préstamo ya devuelto por producto y el abierto
+            prestamos.append(
+                Prestamo(
+                    producto=p, usuario=alumno, devuelto_en=ahora - timedelta(days=1)
+                )
+            )
+            if prestado:
+                prestamos.append(Prestamo(producto=p, usuario=alumno))
+        Ubicacion.objects.bulk_create(ubicaciones, batch_size=CHUNK_SIZE)
+        Prestamo.objects.bulk_create(prestamos, batch_size=CHUNK_SIZE)
+        cls.producto = productos[1]
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        for alias in LOCMEM:
+            caches[alias].clear()
+        self.client.force_login(self.profesor)
+
+    def _record(self, name, queries, seconds):
+        _report.setdefault(name, {})[str(self.SIZE)] = {
+            "queries": queries,
+            "seconds": round(seconds, 4),
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        write_report()
+        super().tearDownClass()
+
+    def _check_view(self, name, url, method="get", warm=True, **extra):
+        budget = get_query_budget(resolve(url).func)
+        self.assertIsNotNone(budget, f"{name} no declara @query_budget")
+        request = getattr(self.client, method)
+        if warm:
+            request(url, **extra)  # cachés calientes, como en producción
+        start = time.perf_counter()
+        with self.assertNumQueries(budget):
+            response = request(url, **extra)
+        self._record(name, budget, time.perf_counter() - start)
+        self.assertLess(response.status_code, 400)
+        return response
+
+    def test_dashboard(self):
+        self._check_view("dashboard", reverse("almacen:dashboard"))
+
+    def test_inventory(self):
+        # Sin fragmentos en caché tampoco hay consultas por producto
+        with self.assertNumQueries(INVENTORY_COLD_QUERIES):
+            self.client.get(reverse("almacen:inventory"))
+        self._check_view("inventory", reverse("almacen:inventory"), warm=False)
+
+    def test_inventory_row(self):
+        self._check_view(
+            "inventory_row",
+            reverse("almacen:inventory_row", args=[self.producto.pk]),
+            HTTP_HX_REQUEST="true",
+        )
+
+    def test_prestamos_overview(self):
+        self._check_view("prestamos_overview", reverse("almacen:prestamos_overview"))
+
+    def test_toggle_prestamo(self):
+        url = reverse("almacen:toggle_prestamo", args=[self.producto.pk])
+        self.client.get(reverse("almacen:inventory_row", args=[self.producto.pk]))
+        with self.captureOnCommitCallbacks(execute=True):
+            self._check_view(
+                "toggle_prestamo",
+                url,
+                method="post",
+                warm=False,
+                HTTP_HX_REQUEST="true",
+            )
+        self.assertEqual(
+            Ubicacion.objects.get(producto=self.producto).estado, "PERSONA"
+        )
+
+    def test_listener_batch(self):
+        """Un lote del lector: llavero y 50 productos, la mitad prestados."""
+        processor = BatchProcessor(5)
+        epcs = list(
+            Producto.objects.filter(aula=self.aula)
+            .order_by("pk")
+            .values_list("epc", flat=True)[:50]
+        )
+        ahora = timezone.now()
+        batch = [(f"LLAVERO{self.SIZE}", ahora)] + [(epc, ahora) for epc in epcs]
+        budget = get_query_budget(BatchProcessor._process_batch_logic)
+
+        start = time.perf_counter()
+        with (
+            patch("almacen.management.commands.mqtt_listener.publish_producto_change"),
+            self.assertNumQueries(budget),
+        ):
+            processor._process_batch_logic(self.aula.pk, batch)
+        self._record("listener_batch", budget, time.perf_counter() - start)
+        self.assertEqual(
+            Ubicacion.objects.filter(
+                producto__epc__in=epcs, persona=self.profesor
+            ).count(),
+            45,  # los 5 que estaban prestados se devuelven
+        )
+
+
+def _budget_case(size):
+    @pytest.mark.django_db
+    @override_settings(CACHES=LOCMEM, STORAGES=STORAGES, SECURE_SSL_REDIRECT=False)
+    @unittest.skipUnless(size in SIZES, f"ALMACEN_PERF_SIZES no incluye {size}")
+    class Case(QueryBudgetMixin, TestCase):
+        SIZE = size
+
+    Case.__name__ = Case.__qualname__ = f"TestQueryBudgets{size}"
+    Case.__doc__ = f"Prueba los presupuestos de consultas con {size} productos."
+    return Case
+
+
+TestQueryBudgets100 = _budget_case(100)
+TestQueryBudgets10000 = _budget_case(10_000)
+TestQueryBudgets100000 = _budget_case(100_000)
+
+
+@pytest.mark.django_db
+@override_settings(
+    CACHES=LOCMEM, STORAGES=STORAGES, SECURE_SSL_REDIRECT=False, DEBUG=True
+)
+class TestQueryBudgetMiddleware(TestCase):
+    """Prueba el aviso de DEBUG cuando una vista se pasa de su presupuesto."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        for alias in LOCMEM:
+            caches[alias].clear()
+        self.user = User.objects.create_user(
+            username="budget", email="budget@example.com"
+        )
+        self.client.force_login(self.user)
+
+    def test_warns_over_budget(self):
+        url = reverse("almacen:dashboard")
+        self.client.get(url)  # cachés calientes
+        with self.assertNoLogs("almacen.perf", "WARNING"):
+            self.client.get(url)
+        with (
+            patch.object(resolve(url).func, "query_budget", 0),
+            self.assertLogs("almacen.perf", "WARNING") as logs,
+        ):
+            self.client.get(url)
+        self.assertIn("GET /almacen/ (dashboard):", logs.output[0])
+        self.assertIn("presupuesto 0", logs.output[0])
+
+    async def test_warns_over_budget_async(self):
+        """Las vistas async también se cuentan (la conexión es la de su hilo)."""
+        url = reverse("almacen:dashboard_counters")
+        await self.async_client.aforce_login(self.user)
+        with (
+            patch.object(resolve(url).func, "query_budget", 0, create=True),
+            self.assertLogs("almacen.perf", "WARNING") as logs,
+        ):
+            await self.async_client.get(url)
+        self.assertIn("(dashboard_counters):", logs.output[0])
+        self.assertNotIn(" 0 consultas", logs.output[0])
@@ -0,0 +1,278 @@
+"""Pruebas del servicio de préstamos compartido por la web y el listener."""
+
+import threading
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+from django.contrib.auth.models import Group, User
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from almacen import prestamos
+from almacen.models import Aula, Prestamo, Producto, Ubicacion
+
+
+def crear_productos(aula, n, prefijo):
+    productos = Producto.objects.bulk_create(
+        Producto(epc=f"{prefijo}{i:04d}", nombre=f"P{i}", aula=aula, estanteria="E1")
+        for i in range(n)
+    )
+    Ubicacion.objects.bulk_create(
+        Ubicacion(producto=p, aula=aula, estanteria="E1") for p in productos
+    )
+    return productos
+
+
+@pytest.mark.django_db
+@override_settings(SECURE_SSL_REDIRECT=False)
+class TestPrestamosService(TestCase):
+    """Prueba checkout, checkin y toggle."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        self.aula = Aula.objects.create(nombre="Taller Servicio")
+        self.user = User.objects.create_user(
+            username="servicio", email="servicio@example.com", password="x"
+        )
+        self.user.persona.aulas_access.add(self.aula)
+
+    def test_checkout_and_checkin(self):
+        """Prestar y devolver dejan Ubicacion y Prestamo coherentes."""
+        p1, p2 = crear_productos(self.aula, 2, "SRV")
+        Ubicacion.objects.filter(producto=p2).delete()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(
+                prestamos.checkout([p1, p2.pk], self.user), sorted([p1.pk, p2.pk])
+            )
+        self.assertEqual(prestamos.checkout([p1], self.user), [])  # ya prestado
+        u = Ubicacion.objects.get(producto=p2)
+        self.assertEqual((u.estado, u.persona, u.aula), ("PERSONA", self.user, None))
+        self.assertEqual(Prestamo.objects.filter(devuelto_en__isnull=True).count(), 2)
+
+        self.assertEqual(prestamos.checkin([p1]), [p1.pk])
+        u = Ubicacion.objects.get(producto=p1)
+        self.assertEqual(
+            (u.estado, u.persona, u.aula, u.estanteria),
+            ("ESTANTE", None, self.aula, "E1"),
+        )
+        self.assertIsNotNone(Prestamo.objects.get(producto=p1).devuelto_en)
+
+        prestados, devueltos = prestamos.toggle([p1, p2], None)
+        self.assertEqual((prestados, devueltos), ([p1.pk], [p2.pk]))
+        self.assertIsNone(Prestamo.objects.get(producto=p1, devuelto_en=None).usuario)
+
+    def test_reading_time_and_persona_checked_under_lock(self):
+        """tomado_en es la hora de la lectura; checkin(persona=) respeta al prestatario."""
+        otro = User.objects.create_user(username="otro", email="otro@example.com")
+        (p,) = crear_productos(self.aula, 1, "LCK")
+        leido_en = timezone.now() - timedelta(seconds=3)
+        prestamos.checkout([p], otro, leido_en)
+        self.assertEqual(Prestamo.objects.get(producto=p).tomado_en, leido_en)
+
+        self.assertEqual(prestamos.checkin([p], persona=self.user), [])
+        self.assertEqual(Ubicacion.objects.get(producto=p).persona, otro)
+        self.assertEqual(prestamos.checkin([p], persona=otro), [p.pk])
+
+    def test_toggle_view_return_raced_by_relend(self):
+        """Si entre la lectura y el bloqueo se presta a otra persona, no se devuelve."""
+        otro = User.objects.create_user(username="otro", email="otro@example.com")
+        (p,) = crear_productos(self.aula, 1, "RACE")
+        prestamos.checkout([p], self.user)
+        self.client.force_login(self.user)
+
+        def relend_then_checkin(*args, **kwargs):
+            # Una lectura RFID se adelanta: devuelve y presta a otra persona
+            prestamos.checkin([p])
+            prestamos.checkout([p], otro)
+            return prestamos.checkin(*args, **kwargs)
+
+        with patch("almacen.views.checkin", side_effect=relend_then_checkin):
+            self.client.post(reverse("almacen:toggle_prestamo", args=[p.pk]))
+        u = Ubicacion.objects.get(producto=p)
+        self.assertEqual((u.estado, u.persona), ("PERSONA", otro))
+
+    def test_queries_do_not_grow_with_products(self):
+        """Mismo número de consultas para 5 que para 50 productos."""
+
+        def queries(productos):
+            counts = []
+            for action in (
+                lambda: prestamos.checkout(productos, self.user),
+                lambda: prestamos.checkin(productos),
+            ):
+                with CaptureQueriesContext(connection) as ctx:
+                    action()
+                counts.append(len(ctx.captured_queries))
+            return counts
+
+        pocos = queries(crear_productos(self.aula, 5, "QA"))
+        muchos = queries(crear_productos(self.aula, 50, "QB"))
+        self.assertEqual(pocos, muchos)
+
+    def test_changes_are_published(self):
+        """Se invalidan las cachés y se avisa a las páginas en vivo."""
+        (p,) = crear_productos(self.aula, 1, "EVT")
+        with (
+            patch("almacen.prestamos.publish_producto_change") as publish,
+            patch("almacen.prestamos.bump_producto_versions") as bump,
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            prestamos.checkout([p], self.user)
+        publish.assert_called_once_with(p.pk, self.aula.pk)
+        bump.assert_called_once_with([p.pk])
+
+    def test_toggle_view_uses_the_service(self):
+        """toggle_prestamo presta y devuelve a través del servicio."""
+        (p,) = crear_productos(self.aula, 1, "VIEW")
+        self.client.force_login(self.user)
+        url = reverse("almacen:toggle_prestamo", args=[p.pk])
+        with patch("almacen.views.checkout", wraps=prestamos.checkout) as checkout:
+            self.client.post(url)
+        checkout.assert_called_once()
+        self.assertEqual(Ubicacion.objects.get(producto=p).estado, "PERSONA")
+        self.client.post(url)
+        self.assertEqual(Ubicacion.objects.get(producto=p).estado, "ESTANTE")
+
+
+@pytest.mark.django_db
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {
+            "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+        },
+    },
+)
+class TestDevolverTodo(TestCase):
+    """Prueba la devolución de todo lo prestado desde la lista de préstamos."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        self.aula = Aula.objects.create(nombre="Taller Devolver")
+        self.profesor = User.objects.create_user(
+            username="devolver_profe", email="profe@example.com", password="x"
+        )
+        self.profesor.persona.aulas_access.add(self.aula)
+        self.profesor.groups.add(Group.objects.get_or_create(name="ProfesoresFP")[0])
+        self.alumno = User.objects.create_user(
+            username="devolver_alumno", email="alumno@example.com", password="x"
+        )
+        self.otro = User.objects.create_user(
+            username="devolver_otro", email="otro@example.com", password="x"
+        )
+        self.url = reverse("almacen:prestamos_devolver_todo")
+
+    def _prestar(self, n, prefijo, user):
+        productos = crear_productos(self.aula, n, prefijo)
+        prestamos.checkout(productos, user)
+        return productos
+
+    def test_return_all_of_one_persona(self):
+        """Devuelve todo lo de una persona y responde con un swap fuera de banda."""
+        self._prestar(50, "ALU", self.alumno)
+        self._prestar(3, "OTR", self.otro)
+        self.client.force_login(self.profesor)
+        page = self.client.get(reverse("almacen:prestamos_overview"))
+        self.assertContains(page, "alumno@example.com (50)")
+
+        response = self.client.post(
+            self.url, {"persona": self.alumno.pk}, HTTP_HX_REQUEST="true"
+        )
+        self.assertContains(response, 'id="prestamos-list" hx-swap-oob="true"')
+        self.assertContains(response, "Se han devuelto 50 productos")
+        self.assertContains(response, "otro@example.com")
+        self.assertFalse(
+            Prestamo.objects.filter(usuario=self.alumno, devuelto_en=None).exists()
+        )
+        self.assertEqual(Ubicacion.objects.filter(estado="PERSONA").count(), 3)
+
+        response = self.client.post(self.url)
+        self.assertRedirects(response, reverse("almacen:prestamos_overview"))
+        self.assertFalse(Ubicacion.objects.filter(estado="PERSONA").exists())
+
+    def test_queries_do_not_grow_with_items(self):
+        """Devolver 5 o 50 productos cuesta las mismas consultas."""
+        self.client.force_login(self.profesor)
+
+        def queries(n, prefijo):
+            self._prestar(n, prefijo, self.alumno)
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.post(self.url, HTTP_HX_REQUEST="true")
+            return len(ctx.captured_queries)
+
+        self.assertEqual(queries(5, "Q5"), queries(50, "Q50"))
+
+    def test_only_profesores(self):
+        """Un alumno no puede devolver lo de los demás."""
+        self._prestar(1, "NOP", self.otro)
+        self.client.force_login(self.alumno)
+        self.assertEqual(self.client.post(self.url).status_code, 403)
+        self.assertTrue(Ubicacion.objects.filter(estado="PERSONA").exists())
+
+
+@pytest.mark.django_db(transaction=True)
+class TestPrestamosConcurrency(TransactionTestCase):
+    """Prueba que toques de la tablet y lecturas RFID simultáneos no se pisan."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        self.aula = Aula.objects.create(nombre="Taller Carrera")
+        self.users = [
+            User.objects.create_user(username=f"carrera{i}", email=f"c{i}@example.com")
+            for i in range(8)
+        ]
+
+    def _race(self, targets):
+        barrier = threading.Barrier(len(targets))
+        results, errors = [], []
+
+        def run(target):
+            try:
+                barrier.wait()
+                results.append(target())
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(t,)) for t in targets]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def test_simultaneous_checkouts_lend_once(self):
+        """De ocho préstamos simultáneos del mismo producto solo uno prospera."""
+        (p,) = crear_productos(self.aula, 1, "RACE")
+        results = self._race(
+            [lambda u=u: prestamos.checkout([p.pk], u) for u in self.users]
+        )
+        self.assertEqual(sorted(map(len, results)), [0] * 7 + [1])
+        prestamo = Prestamo.objects.get(producto=p)
+        self.assertEqual(Ubicacion.objects.get(producto=p).persona, prestamo.usuario)
+
+    def test_taps_and_reads_keep_state_consistent(self):
+        """Mezcla de toques y lecturas RFID: préstamos abiertos y ubicación coinciden."""
+        productos = crear_productos(self.aula, 3, "MIX")
+        for _ in range(5):
+            self._race(
+                [lambda u=u: prestamos.checkout(productos, u) for u in self.users[:3]]
+                + [lambda: prestamos.checkin(productos)]
+                + [lambda u=u: prestamos.toggle(productos, u) for u in self.users[3:]]
+            )
+            for p in productos:
+                u = Ubicacion.objects.get(producto=p)
+                abiertos = list(Prestamo.objects.filter(producto=p, devuelto_en=None))
+                if u.estado == "PERSONA":
+                    self.assertEqual(len(abiertos), 1)
+                    self.assertEqual(abiertos[0].usuario_id, u.persona_id)
+                else:
+                    self.assertEqual(abiertos, [])
@@ -0,0 +1,172 @@
+"""Pruebas del perfilado por petición (Server-Timing, log y página de staff)."""
+
+import json
+import os
+import shutil
+import tempfile
+
+import pytest
+from django.contrib.auth.models import Group, User
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from almacen.local_redis import locmem_caches
+from almacen.models import Aula, Producto
+from almacen.profiling import (
+    PROFILE_COOKIE,
+    PROFILE_HEADER,
+    fingerprint,
+    read_log,
+    slowest_endpoints,
+)
+
+LOCMEM = locmem_caches("test-profiling")
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+HEADER = {f"HTTP_{PROFILE_HEADER.upper().replace('-', '_')}": "1"}
+
+
+@pytest.mark.django_db
+@override_settings(
+    SECURE_SSL_REDIRECT=False,
+    CACHES=LOCMEM,
+    STORAGES=STORAGES,
+    PROFILING_ENABLED=True,
+    PROFILING_SAMPLE_RATE=0,
+)
+class TestProfiling(TestCase):
+    """Prueba ProfilingMiddleware y la página de endpoints lentos."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        for alias in LOCMEM:
+            caches[alias].clear()
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir)
+        self.log = os.path.join(log_dir, "profiling.jsonl")
+        patcher = override_settings(PROFILING_LOG=self.log)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+        self.aula = Aula.objects.create(nombre="Taller Perfilado")
+        for i in range(3):
+            Producto.objects.create(epc=f"PERF{i}", nombre=f"P{i}", aula=self.aula)
+        self.profesor = User.objects.create_user(
+            username="perfil_profe", email="perfilprofe@example.com", password="x"
+        )
+        self.profesor.groups.add(Group.objects.get_or_create(name="ProfesoresFP")[0])
+        self.staff = User.objects.create_user(
+            username="perfil_staff",
+            email="perfilstaff@example.com",
+            password="x",
+            is_staff=True,
+        )
+        for user in (self.profesor, self.staff):
+            persona = user.persona
+            persona.aulas_access.add(self.aula)
+            persona.last_aula = self.aula
+            persona.save()
+
+    def _records(self):
+        return list(read_log(1, self.log))
+
+    def test_fingerprint(self):
+        """Las consultas con distintos parámetros comparten huella."""
+        self.assertEqual(
+            fingerprint('SELECT "a" FROM "t" WHERE "id" IN (%s, %s, %s) LIMIT 21'),
+            'SELECT "a" FROM "t" WHERE "id" IN (...) LIMIT ?',
+        )
+        self.assertEqual(
+            fingerprint("SELECT 1 FROM t WHERE x = 'o''k'\n  AND y = 2.5"),
+            "SELECT ? FROM t WHERE x = ? AND y = ?",
+        )
+
+    def test_not_profiled_by_default(self):
+        """Sin cabecera, cookie ni muestreo no hay Server-Timing ni log."""
+        self.client.force_login(self.profesor)
+        response = self.client.get(reverse("almacen:inventory"), **HEADER)
+        self.assertEqual(response.status_code, 200)
+        # La cabecera de un usuario que no es staff se ignora
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(self._records(), [])
+
+    def test_staff_header(self):
+        """Un staff con la cabecera recibe Server-Timing y la petición se registra."""
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("almacen:inventory"), **HEADER)
+        self.assertEqual(response.status_code, 200)
+        timing = response["Server-Timing"]
+        for metric in ("sql;dur=", "tpl;dur=", "cache;desc=", "total;dur="):
+            self.assertIn(metric, timing)
+
+        [record] = self._records()
+        self.assertEqual(record["v"], "almacen:inventory")
+        self.assertEqual(record["s"], 200)
+        self.assertGreater(record["sql"], 0)
+        self.assertGreater(record["tpl_ms"], 0)
+        self.assertGreater(record["hit"] + record["miss"], 0)
+        self.assertLessEqual(record["tpl_ms"], record["ms"])
+        self.assertTrue(record["q"])
+
+    async def test_staff_header_async(self):
+        """Con una vista async la petición también se perfila, con sus consultas."""
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get(
+            reverse("almacen:dashboard_counters"), headers={PROFILE_HEADER: "1"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("sql;dur=", response["Server-Timing"])
+
+        [record] = self._records()
+        self.assertEqual(record["v"], "almacen:dashboard_counters")
+        self.assertGreater(record["sql"], 0)
+
+    def test_sampling_and_disabled(self):
+        """Con muestreo 1 se perfila todo; con PROFILING_ENABLED=False, nada."""
+        self.client.force_login(self.profesor)
+        with override_settings(PROFILING_SAMPLE_RATE=1):
+            response = self.client.get(reverse("almacen:inventory"))
+        self.assertIn("Server-Timing", response)
+        with override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_ENABLED=False):
+            self.client.handler.load_middleware()
+            response = self.client.get(reverse("almacen:inventory"))
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(len(self._records()), 1)
+
+    def test_staff_page(self):
+        """La página resume el log por endpoint y activa la cookie de perfilado."""
+        url = reverse("almacen:profiling")
+        self.client.force_login(self.profesor)
+        self.assertEqual(self.client.get(url).status_code, 302)  # no es staff
+
+        self.client.force_login(self.staff)
+        response = self.client.post(url)
+        self.assertEqual(response.cookies[PROFILE_COOKIE].value, "1")
+        for _ in range(3):
+            self.assertIn(
+                "Server-Timing", self.client.get(reverse("almacen:inventory"))
+            )
+        self.client.get(reverse("almacen:prestamos_overview"))
+
+        endpoints = slowest_endpoints(read_log(1, self.log))
+        inventory = next(e for e in endpoints if e["view"] == "almacen:inventory")
+        self.assertEqual(inventory["requests"], 3)
+        self.assertTrue(inventory["queries"])
+
+        response = self.client.get(url, {"horas": "6"})
+        self.assertContains(response, "almacen:inventory")
+        self.assertContains(response, "almacen:prestamos_overview")
+        self.assertContains(response, "Dejar de perfilar")
+
+        response = self.client.post(url)
+        self.assertEqual(response.cookies[PROFILE_COOKIE].value, "")
+
+    def test_log_skips_old_and_broken_lines(self):
+        """read_log filtra por horas e ignora líneas cortadas por la rotación."""
+        with open(self.log, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"t": 0, "m": "GET", "v": "vieja"}) + "\n")
+            f.write('{"t": 17\n')
+        self.assertEqual(self._records(), [])
@@ -0,0 +1,166 @@
+"""Pruebas de los recuentos de aula con el lector RFID."""
+
+import json
+import logging
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from django.contrib.auth.models import Group, User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from almacen.management.commands.mqtt_listener import (
+    BatchProcessor,
+    Command,
+    RecuentoCollector,
+)
+from almacen.models import Aula, Producto, Recuento, RecuentoLectura, Ubicacion
+from almacen.recuentos import finalizar_recuento, iniciar_recuento
+
+logger = logging.getLogger(__name__)
+
+
+def lectura(aula_id, epc):
+    payload = {
+        "aula_id": str(aula_id),
+        "epc": epc,
+        "timestamp": timezone.now().replace(tzinfo=None).isoformat(),
+    }
+    return SimpleNamespace(topic="rfid/lectura", payload=json.dumps(payload).encode())
+
+
+@pytest.mark.django_db
+@override_settings(SECURE_SSL_REDIRECT=False)
+class TestRecuentos(TestCase):
+    """Prueba el modo recuento del listener y el informe de diferencias."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        self.aula = Aula.objects.create(nombre="Taller Recuento")
+        self.otra = Aula.objects.create(nombre="Taller Vecino")
+        self.profesor = User.objects.create_user(
+            username="recuento_profe", email="profe@example.com", password="x"
+        )
+        self.profesor.persona.aulas_access.add(self.aula)
+        self.profesor.persona.epc = "LLAVERO01"
+        self.profesor.persona.save()
+        self.profesor.groups.add(Group.objects.get_or_create(name="ProfesoresFP")[0])
+
+        for i in range(3):
+            p = Producto.objects.create(
+                epc=f"REC00{i}", nombre=f"Producto {i}", aula=self.aula
+            )
+            Ubicacion.objects.create(producto=p, aula=self.aula)
+        prestado = Producto.objects.create(
+            epc="REC_PRESTADO", nombre="Prestado", aula=self.aula
+        )
+        Ubicacion.objects.create(
+            producto=prestado, estado="PERSONA", persona=self.profesor
+        )
+        Producto.objects.create(epc="REC_VECINO", nombre="Vecino", aula=self.otra)
+
+        self.command = Command()
+        self.command.batch_processor = BatchProcessor(3)
+        self.command.recuentos = RecuentoCollector(refresh_seconds=0)
+
+    def test_reads_are_diverted_from_loans(self):
+        """Con un recuento abierto las lecturas no crean préstamos."""
+        recuento = iniciar_recuento(self.aula, self.profesor)
+        self.command.recuentos.refresh()
+
+        for epc in ["REC000", "REC000", "REC_VECINO", "DESCONOCIDO"]:
+            self.command.on_message(None, None, lectura(self.aula.pk, epc))
+        self.command.recuentos.flush()
+
+        self.assertFalse(self.command.batch_processor.batches)
+        self.assertEqual(
+            set(recuento.lecturas.values_list("epc", flat=True)),
+            {"REC000", "REC_VECINO", "DESCONOCIDO"},
+        )
+        self.assertFalse(
+            Ubicacion.objects.filter(producto__epc="REC000")
+            .filter(estado="PERSONA")
+            .exists()
+        )
+
+        # Al cerrarse, la siguiente actualización devuelve el aula a préstamos
+        finalizar_recuento(recuento)
+        self.command.recuentos.flush()
+        self.assertFalse(self.command.recuentos.add_epc(self.aula.pk, "REC001"))
+
+    def test_result_is_a_set_difference(self):
+        """Faltan, otra aula, desconocidos y prestados leídos."""
+        recuento = iniciar_recuento(self.aula, self.profesor)
+        RecuentoLectura.objects.bulk_create(
+            RecuentoLectura(recuento=recuento, epc=epc)
+            for epc in ["REC000", "REC_PRESTADO", "REC_VECINO", "XYZ", "LLAVERO01"]
+        )
+        resultado = finalizar_recuento(recuento).resultado
+
+        self.assertEqual(resultado["faltan"], ["REC001", "REC002"])
+        self.assertEqual(resultado["otra_aula"], ["REC_VECINO"])
+        self.assertEqual(resultado["inesperados"], ["XYZ"])
+        self.assertEqual(resultado["prestados"], ["REC_PRESTADO"])
+        self.assertEqual((resultado["leidos"], resultado["esperados"]), (5, 3))
+
+    def test_report_views(self):
+        """El profesor inicia, finaliza y descarga el informe; un alumno no."""
+        alumno = User.objects.create_user(
+            username="recuento_alumno", email="alumno@example.com", password="x"
+        )
+        self.client.force_login(alumno)
+        self.assertEqual(self.client.get(reverse("almacen:recuentos")).status_code, 403)
+
+        self.client.force_login(self.profesor)
+        url = reverse("almacen:recuentos")
+        response = self.client.post(url, {"aula_id": self.otra.pk})
+        self.assertFalse(Recuento.objects.exists())  # sin acceso a esa aula
+
+        response = self.client.post(url, {"aula_id": self.aula.pk})
+        recuento = Recuento.objects.get()
+        self.assertRedirects(
+            response,
+            reverse("almacen:recuento_detalle", args=[recuento.pk]),
+            fetch_redirect_response=False,
+        )
+        RecuentoLectura.objects.create(recuento=recuento, epc="REC000")
+
+        detalle = reverse("almacen:recuento_detalle", args=[recuento.pk])
+        self.assertEqual(self.client.get(detalle, HTTP_HX_REQUEST="true").content, b"1")
+        self.client.post(reverse("almacen:recuento_finalizar", args=[recuento.pk]))
+
+        response = self.client.get(detalle, {"formato": "csv"})
+        content = b"".join(response.streaming_content).decode("utf-8-sig")
+        self.assertIn("No encontrados en el aula,REC001,Producto 1", content)
+        self.assertNotIn(",REC000,", content)
+
+    def test_throughput_without_queries_per_read(self):
+        """Miles de lecturas: ninguna consulta por lectura, solo el INSERT del flush."""
+        recuento = iniciar_recuento(self.aula, self.profesor)
+        collector = RecuentoCollector(refresh_seconds=60)
+        self.command.recuentos = collector
+        collector.refresh()
+        mensajes = [lectura(self.aula.pk, f"BARRIDO{i % 500:04d}") for i in range(6000)]
+
+        with (
+            patch("almacen.management.commands.mqtt_listener.publish_epc"),
+            CaptureQueriesContext(connection) as ctx,
+        ):
+            start = time.perf_counter()
+            for msg in mensajes:
+                self.command.on_message(None, None, msg)
+            elapsed = time.perf_counter() - start
+            collector.flush()
+            collector.flush()
+        logger.info("6000 lecturas de recuento en %.2fs", elapsed)
+        self.assertLess(elapsed, 30)
+
+        # Solo el INSERT de los 500 EPC distintos (SQLite lo parte en lotes)
+        sqls = [q["sql"] for q in ctx.captured_queries]
+        self.assertTrue(all(sql.startswith("INSERT") for sql in sqls), sqls)
+        self.assertEqual(recuento.lecturas.count(), 500)
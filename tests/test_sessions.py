@@ -0,0 +1,104 @@
+"""Pruebas de las sesiones en Redis (SESSION_STORE) y de migrate_sessions."""
+
+import logging
+from io import StringIO
+
+import pytest
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from almacen.local_redis import locmem_caches
+from almacen.models import Aula
+
+logger = logging.getLogger(__name__)
+
+LOCMEM_CACHES = locmem_caches("sessions-test")
+
+# Un minuto de navegación: elegir aula y 12 sondeos de get_latest_epc (cada 5 s)
+POLLS_PER_MINUTE = 12
+
+
+def session_queries(ctx):
+    """(escrituras, lecturas) sobre django_session."""
+    sqls = [q["sql"] for q in ctx.captured_queries if "django_session" in q["sql"]]
+    writes = [sql for sql in sqls if not sql.startswith("SELECT")]
+    return len(writes), len(sqls) - len(writes)
+
+
+@pytest.mark.django_db
+@override_settings(SECURE_SSL_REDIRECT=False, CACHES=LOCMEM_CACHES)
+class TestSessionStore(TestCase):
+    """Prueba cuánto trabajo da cada motor de sesiones a SQLite."""
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        for alias in LOCMEM_CACHES:
+            caches[alias].clear()
+        self.aula = Aula.objects.create(nombre="Taller Sesiones")
+        self.user = User.objects.create_user(
+            username="sesiones", email="sesiones@example.com", password="x"
+        )
+        self.user.persona.aulas_access.add(self.aula)
+
+    def _navigate(self, store):
+        engine = f"django.contrib.sessions.backends.{store}"
+        with override_settings(SESSION_ENGINE=engine, SESSION_STORE=store):
+            # Cliente nuevo: SessionMiddleware elige el motor al cargarse
+            self.client = Client()
+            self.client.force_login(self.user)
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.post(
+                    reverse("almacen:set_current_aula"), {"aula_id": self.aula.pk}
+                )
+                for _ in range(POLLS_PER_MINUTE):
+                    self.client.get(reverse("almacen:get_latest_epc"))
+            self.client.logout()
+        return session_queries(ctx)
+
+    def test_sqlite_work_per_engine(self):
+        """Con Redis los sondeos no leen django_session; con 'cache' nada la toca."""
+        results = {
+            store: self._navigate(store) for store in ("db", "cached_db", "cache")
+        }
+        for store, (writes, reads) in results.items():
+            logger.info(
+                "Sesiones %s: %d escrituras/min, %d lecturas/min en SQLite",
+                store,
+                writes,
+                reads,
+            )
+
+        self.assertGreaterEqual(results["db"][1], POLLS_PER_MINUTE)
+        self.assertEqual(results["cached_db"][1], 0)
+        self.assertLessEqual(results["cached_db"][0], results["db"][0])
+        self.assertEqual(results["cache"], (0, 0))
+
+    @override_settings(
+        SESSION_ENGINE="django.contrib.sessions.backends.cache", SESSION_STORE="cache"
+    )
+    def test_migrate_sessions_keeps_users_logged_in(self):
+        """Las sesiones de la base de datos pasan a Redis y siguen valiendo."""
+        old = DBStore()
+        old["_auth_user_id"] = str(self.user.pk)
+        old["_auth_user_backend"] = "django.contrib.auth.backends.ModelBackend"
+        old["_auth_user_hash"] = self.user.get_session_auth_hash()
+        old["current_aula_id"] = self.aula.pk
+        old.create()
+
+        out = StringIO()
+        call_command("migrate_sessions", "--clear", stdout=out)
+        self.assertIn("Copied 1 sessions", out.getvalue())
+        self.assertFalse(Session.objects.exists())
+
+        self.client.cookies["sessionid"] = old.session_key
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("almacen:get_latest_epc"))
+        self.assertEqual(response.status_code, 204)  # autenticado, sin EPC nuevo
+        self.assertEqual(session_queries(ctx), (0, 0))
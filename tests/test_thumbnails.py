@@ -0,0 +1,123 @@
+"""Pruebas de las miniaturas de Producto.foto."""
+
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.template.loader import render_to_string
+from django.test import RequestFactory, TestCase, override_settings
+from PIL import Image
+
+from almacen.models import Aula, Producto
+from almacen.thumbnails import process_producto_foto
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix="almacen-thumbs-")
+
+
+def photo_upload(name="foto.jpg", size=(3000, 2000)):
+    """Foto JPEG de prueba del tamaño de una de móvil."""
+    buffer = BytesIO()
+    Image.effect_noise(size, 64).convert("RGB").save(buffer, "JPEG", quality=95)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/jpeg")
+
+
+@pytest.mark.django_db
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TestThumbnails(TestCase):
+    """Prueba la generación y el uso de miniaturas de productos."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        """Configurar datos de prueba."""
+        self.aula = Aula.objects.create(nombre="Taller Fotos")
+        self.request = RequestFactory().get("/")
+        self.request.user = AnonymousUser()
+
+    def _create(self, epc="FOTO001"):
+        with patch("almacen.signals.schedule_thumbnails") as schedule:
+            p = Producto.objects.create(
+                epc=epc, nombre="Osciloscopio", aula=self.aula, foto=photo_upload()
+            )
+        schedule.assert_called_once_with(p.pk)
+        return p
+
+    def test_thumbnails_are_generated_with_content_hash(self):
+        """Se generan WebP y JPEG a 1x, 2x y 3x con el hash en el nombre."""
+        p = self._create()
+        digest = process_producto_foto(p.pk)
+
+        p.refresh_from_db()
+        self.assertEqual(p.foto_hash, digest)
+        thumbs = sorted(Path(MEDIA_ROOT, "productos", "thumbs").glob(f"{digest}-*"))
+        self.assertEqual(
+            [t.name for t in thumbs],
+            sorted(
+                f"{digest}-{size}.{ext}"
+                for size in (60, 120, 180)
+                for ext in ("webp", "jpg")
+            ),
+        )
+        with Image.open(thumbs[0]) as im:
+            self.assertEqual(im.size[0], im.size[1])
+
+        # El peso de la página baja en más de un orden de magnitud
+        original = Path(p.foto.path).stat().st_size
+        largest = max(t.stat().st_size for t in thumbs)
+        self.assertLess(largest * 10, original)
+
+    def test_row_uses_srcset_and_lazy_loading(self):
+        """La fila usa las miniaturas si existen y la original mientras tanto."""
+        p = self._create()
+        html = render_to_string(
+            "almacen/_product_row.partial.html", {"p": p, "request": self.request}
+        )
+        self.assertIn(p.foto.url, html)
+        self.assertIn('loading="lazy"', html)
+        self.assertNotIn("srcset", html)
+
+        process_producto_foto(p.pk)
+        p.refresh_from_db()
+        html = render_to_string(
+            "almacen/_product_row.partial.html", {"p": p, "request": self.request}
+        )
+        self.assertNotIn(p.foto.url, html)
+        self.assertIn(f"{p.foto_hash}-60.webp 1x", html)
+        self.assertIn(f"{p.foto_hash}-120.jpg 2x", html)
+
+    def test_new_foto_resets_hash(self):
+        """Al subir otra foto se descartan las miniaturas anteriores."""
+        p = self._create()
+        process_producto_foto(p.pk)
+        p.refresh_from_db()
+
+        p.nombre = "Osciloscopio digital"
+        with patch("almacen.signals.schedule_thumbnails") as schedule:
+            p.save()
+        schedule.assert_not_called()
+        self.assertTrue(p.foto_hash)
+
+        p.foto = photo_upload("otra.jpg")
+        with patch("almacen.signals.schedule_thumbnails") as schedule:
+            p.save()
+        schedule.assert_called_once_with(p.pk)
+        p.refresh_from_db()
+        self.assertEqual(p.foto_hash, "")
+
+    def test_backfill_command(self):
+        """El comando procesa en paralelo las fotos sin miniaturas."""
+        productos = [self._create(f"FOTO10{i}") for i in range(3)]
+        call_command("generate_thumbnails", "--workers", "2", stdout=StringIO())
+
+        for p in productos:
+            p.refresh_from_db()
+            self.assertTrue(p.foto_hash)